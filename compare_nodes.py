@@ -10,16 +10,35 @@
 import yaml
 import json
 import re
-from typing import Dict, List, Any, Set, Tuple, Union
-from collections import defaultdict
+import argparse
+import codecs
+import contextlib
+import cProfile
+import heapq
+import fnmatch
+import hashlib
+import io
+import os
+import pickle
+import sys
+import time
+from array import array
+from typing import Dict, List, Any, Set, Tuple, Union, Iterator, Optional
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
-def is_legitimate_difference(path: str, before_val: Any, after_val: Any, node_type: str) -> Tuple[bool, str]:
+
+def _reference_is_legitimate_difference(path: str, before_val: Any, after_val: Any, node_type: str) -> Tuple[bool, str]:
     """
-    判断是否为合法差异 (根据 mihomo 官方文档规范)
-    path: 差异字段路径，例如 'ws-opts.headers.Host'
-    返回: (是否合法, 说明)
+    原有的 if 链实现, 规则已迁移至 compare_rules.yaml
+    仅供 --self-test 校验规则引擎的结论与其一致
     """
     
     # 忽略 None 与 空字符串/空字典/空列表 的差异 (通常视为等价)
@@ -109,10 +128,241 @@ def is_legitimate_difference(path: str, before_val: Any, after_val: Any, node_ty
     return (False, "")
 
 
+RULES_FILE = Path(__file__).resolve().parent / 'compare_rules.yaml'
+
+
+def _is_empty(v: Any) -> bool:
+    return v is None or v == "" or v == {} or v == []
+
+
+def _is_blank(v: Any) -> bool:
+    return v is None or v == ""
+
+
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+def canonical_value(value: Any) -> Tuple[type, Any]:
+    """差异值的可哈希规范形式: 标量保留类型 (True/1/1.0 不会合并), 容器使用 repr"""
+    value_type = type(value)
+    if value_type in _SCALAR_TYPES:
+        return value_type, value
+    return value_type, repr(value)
+
+
+def _same_set(before_val: Any, after_val: Any) -> bool:
+    try:
+        return set(before_val) == set(after_val)
+    except TypeError:
+        return False
+
+
+# 规则文件中 before/after 可用的单值判断
+VALUE_PREDICATES = {
+    'empty': _is_empty,
+    'blank': _is_blank,
+    'truthy': bool,
+    'is_none': lambda v: v is None,
+    'is_true': lambda v: v is True,
+    'is_false': lambda v: v is False,
+    'int': lambda v: isinstance(v, int),
+    'str': lambda v: isinstance(v, str),
+    'list': lambda v: isinstance(v, list),
+    'scalar': lambda v: isinstance(v, (int, str, float)),
+}
+
+# 规则文件中 relation 可用的联合判断
+RELATIONS = {
+    'same_str': lambda b, a: str(b) == str(a),
+    'same_set': _same_set,
+}
+
+
+def _compile_value_predicate(spec: Any):
+    if isinstance(spec, dict) and set(spec) == {'equals'}:
+        expected = spec['equals']
+        return lambda v: v == expected
+    if isinstance(spec, str) and spec in VALUE_PREDICATES:
+        return VALUE_PREDICATES[spec]
+    raise ValueError(f"未知的值判断: {spec!r}")
+
+
+def _compile_relation(spec: Any):
+    if isinstance(spec, dict) and set(spec) == {'drop_suffix'}:
+        suffix = spec['drop_suffix']
+        return lambda b, a: b.endswith(suffix) and a == b.replace(suffix, '')
+    if isinstance(spec, str) and spec in RELATIONS:
+        return RELATIONS[spec]
+    raise ValueError(f"未知的联合判断: {spec!r}")
+
+
+class Rule:
+    """编译后的单条规则"""
+    __slots__ = ('order', 'path', 'node_type', 'before', 'after', 'relation', 'reason')
+
+    def __init__(self, order: int, spec: Dict):
+        self.order = order
+        self.path = str(spec.get('path', '*'))
+        self.node_type = spec.get('type')
+        self.reason = spec.get('reason', '')
+
+        def predicates(value):
+            if value is None:
+                return ()
+            specs = value if isinstance(value, list) else [value]
+            return tuple(_compile_value_predicate(s) for s in specs)
+
+        self.before = predicates(spec.get('before'))
+        self.after = predicates(spec.get('after'))
+        self.relation = _compile_relation(spec['relation']) if 'relation' in spec else None
+
+    def check(self, before_val: Any, after_val: Any) -> bool:
+        for predicate in self.before:
+            if not predicate(before_val):
+                return False
+        for predicate in self.after:
+            if not predicate(after_val):
+                return False
+        return self.relation is None or self.relation(before_val, after_val)
+
+    def format_reason(self, before_val: Any, after_val: Any) -> str:
+        return self.reason.format(before=before_val, after=after_val,
+                                  before_type=type(before_val).__name__,
+                                  after_type=type(after_val).__name__)
+
+
+class RuleEngine:
+    """
+    合法差异规则引擎
+    精确路径的规则按 (路径, 节点类型) 建立索引, 通配路径的规则单独保存;
+    每个 (路径, 节点类型) 组合的候选规则只计算一次, 之后每条差异只需检查少量候选规则
+    结论按 (路径, 节点类型, 规范化前值, 规范化后值) 缓存, 最多保留 cache_size 条 (LRU), 0 表示不缓存
+    """
+    CACHE_SIZE = 65536
+
+    def __init__(self, specs: List[Dict], source: str = '', digest: str = '', cache_size: int = CACHE_SIZE):
+        self.source = source
+        self.digest = digest
+        self.exact = defaultdict(list)
+        self.wildcard = []
+        self._candidates = {}
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._verdicts = OrderedDict()
+        for order, spec in enumerate(specs):
+            try:
+                rule = Rule(order, spec)
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"规则 #{order + 1} 无效: {e}") from None
+            if any(c in rule.path for c in '*?['):
+                self.wildcard.append((re.compile(fnmatch.translate(rule.path)), rule))
+            else:
+                self.exact[(rule.path, rule.node_type)].append(rule)
+
+    @classmethod
+    def from_file(cls, filepath: Union[str, Path]) -> 'RuleEngine':
+        with open(filepath, 'rb') as f:
+            content = f.read()
+        data = yaml.load(content, Loader=NodeLoader) or {}
+        return cls(data.get('rules', []), source=str(filepath), digest=hashlib.sha256(content).hexdigest())
+
+    def candidates(self, path: str, node_type: str) -> List[Rule]:
+        key = (path, node_type)
+        rules = self._candidates.get(key)
+        if rules is None:
+            rules = self.exact.get((path, node_type), []) + self.exact.get((path, None), [])
+            rules += [rule for pattern, rule in self.wildcard
+                      if rule.node_type in (None, node_type) and pattern.match(path)]
+            rules.sort(key=lambda rule: rule.order)
+            self._candidates[key] = rules
+        return rules
+
+    def classify(self, path: str, before_val: Any, after_val: Any, node_type: str) -> Tuple[bool, str]:
+        key = (path, node_type, canonical_value(before_val), canonical_value(after_val))
+        verdict = self._verdicts.get(key)
+        if verdict is not None:
+            self.cache_hits += 1
+            self._verdicts.move_to_end(key)
+            return verdict
+        self.cache_misses += 1
+        verdict = self.evaluate(path, before_val, after_val, node_type)
+        if self.cache_size > 0:
+            self._verdicts[key] = verdict
+            if len(self._verdicts) > self.cache_size:
+                self._verdicts.popitem(last=False)
+        return verdict
+
+    def evaluate(self, path: str, before_val: Any, after_val: Any, node_type: str) -> Tuple[bool, str]:
+        """不经过缓存, 按顺序检查候选规则"""
+        for rule in self.candidates(path, node_type):
+            if rule.check(before_val, after_val):
+                return (True, rule.format_reason(before_val, after_val))
+        return (False, "")
+
+
+_engine: Optional[RuleEngine] = None
+
+
+def load_rules(filepath: Union[str, Path] = RULES_FILE) -> RuleEngine:
+    """加载并编译规则文件, 作为 is_legitimate_difference 使用的规则 (也用作进程池的 initializer)"""
+    global _engine
+    _engine = RuleEngine.from_file(filepath)
+    return _engine
+
+
+def is_legitimate_difference(path: str, before_val: Any, after_val: Any, node_type: str) -> Tuple[bool, str]:
+    """
+    判断是否为合法差异 (根据 mihomo 官方文档规范, 规则见 compare_rules.yaml)
+    path: 差异字段路径，例如 'ws-opts.headers.Host'
+    返回: (是否合法, 说明)
+    """
+    if _engine is None:
+        load_rules()
+    return _engine.classify(path, before_val, after_val, node_type)
+
+
+def self_test(engine: RuleEngine) -> int:
+    """
+    用原有 if 链实现校验规则引擎
+    对一组常见字段路径、取值和节点类型的全组合逐一比较结论与说明, 返回不一致的数量
+    """
+    paths = ['port', 'udp', 'flow', 'servername', 'network', 'tls', 'alpn', 'encryption',
+             'client-fingerprint', 'skip-cert-verify', 'cipher', 'ws-opts.path',
+             'ws-opts.headers', 'ws-opts.headers.Host', 'ws-opts.max-early-data',
+             'reality-opts.short-id', 'reality-opts.public-key', 'reality-opts.servername',
+             'reality-opts.fingerprint', 'h2-opts.host', 'grpc-opts.grpc-service-name']
+    values = [None, "", {}, [], 0, 1, "1", 443, "443", 1.0, True, False, "none", "tcp", "ws",
+              "chrome", "example.com", "xtls-rprx-vision-udp443", "xtls-rprx-vision",
+              ["h2", "http/1.1"], ["http/1.1", "h2"], ["h2"], {"Host": "example.com"}]
+    node_types = ['vless', 'vmess', 'ss', 'trojan']
+
+    checked = 0
+    mismatches = 0
+    for path in paths:
+        for node_type in node_types:
+            for before_val in values:
+                for after_val in values:
+                    expected = _reference_is_legitimate_difference(path, before_val, after_val, node_type)
+                    actual = engine.classify(path, before_val, after_val, node_type)
+                    checked += 1
+                    if expected != actual:
+                        mismatches += 1
+                        if mismatches <= 10:
+                            print(f"不一致: {path} [{node_type}] {before_val!r} -> {after_val!r}: "
+                                  f"原实现 {expected}, 规则引擎 {actual}")
+    print(f"规则引擎自检: 共 {checked} 组, 不一致 {mismatches} 组")
+    return mismatches
+
+
 def deep_compare(obj1: Any, obj2: Any, path: str = "") -> List[Dict]:
     """
     递归对比两个对象，返回差异列表
     """
+    # 同类型且相等的子树不会产生差异, 由 C 层的相等比较直接跳过整棵子树
+    if type(obj1) is type(obj2) and obj1 == obj2:
+        return []
+
     diffs = []
     
     # 类型不一致且不能安全转换为字符串相等的情况
@@ -205,21 +455,887 @@ def deep_compare(obj1: Any, obj2: Any, path: str = "") -> List[Dict]:
     return diffs
 
 
-def load_file(filepath: str) -> Dict:
-    """加载YAML文件"""
-    import re
-    if not Path(filepath).exists():
+try:
+    from yaml import CSafeLoader as _SafeLoader
+except ImportError:  # 未安装 libyaml 时退回纯 Python 实现
+    from yaml import SafeLoader as _SafeLoader
+
+
+class NodeLoader(_SafeLoader):
+    """
+    加载对比文件使用的 Loader, 优先使用 libyaml 的 CSafeLoader
+    在构造阶段把 !<str> 和 !str 标签当作 !!str 处理
+    """
+
+
+class StreamLoader(yaml.SafeLoader):
+    """
+    流式读取使用的 Loader
+    需要逐个 compose 节点, 只能基于纯 Python 实现, 标签处理与 NodeLoader 相同
+    """
+
+
+for _loader in (NodeLoader, StreamLoader):
+    _loader.add_constructor('str', _loader.construct_yaml_str)
+    _loader.add_constructor('!str', _loader.construct_yaml_str)
+
+# 解析结果缓存格式版本, 缓存内容或 Loader 行为变化时需要递增
+CACHE_VERSION = 1
+CACHE_DIR_NAME = '.compare_cache'
+
+
+def _atomic_write(path: Path, data: bytes):
+    """先写临时文件再 rename, 避免并发读取到写了一半的缓存"""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _prune_cache(cache_dir: Path, stamp_file: Path, old_digest: Optional[str]):
+    """
+    源文件内容变化后删除其旧摘要对应的 pickle
+    同目录下其他文件的 stamp 仍引用该摘要时保留
+    """
+    if not old_digest:
+        return
+    for other in cache_dir.glob('*.stamp'):
+        if other == stamp_file:
+            continue
+        try:
+            if json.loads(other.read_text(encoding='utf-8')).get('sha256') == old_digest:
+                return
+        except (OSError, ValueError, AttributeError):
+            continue
+    try:
+        (cache_dir / f"{old_digest}.pickle").unlink()
+    except OSError:
+        pass
+
+
+def load_file(filepath: str, use_cache: bool = True) -> Dict:
+    """
+    加载YAML文件
+    解析结果以 pickle 缓存在文件同目录的 .compare_cache 下:
+    <sha256>.pickle 按文件内容哈希保存, 另有按路径记录 size/mtime 的 stamp,
+    文件未变化时无需重新哈希, 直接读取缓存
+    每个源文件只保留最新内容的缓存, 缓存目录无法创建或写入时直接解析
+    """
+    path = Path(filepath)
+    if not path.exists():
         raise FileNotFoundError(f"文件未找到: {filepath}")
-        
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
-        # 将 !<str> 和 !str 标签都转换为标准的 !!str
-        content = re.sub(r'!\s*<?\s*str\s*>?', '!!str', content)
-        return yaml.safe_load(content)
 
+    cache_dir = path.resolve().parent / CACHE_DIR_NAME
+    if use_cache:
+        try:
+            cache_dir.mkdir(exist_ok=True)
+        except OSError as e:
+            print(f"⚠️  无法创建缓存目录 {cache_dir}, 不使用缓存: {e}", file=sys.stderr)
+            use_cache = False
+
+    if not use_cache:
+        with open(path, 'rb') as f:
+            return yaml.load(f, Loader=NodeLoader)
+
+    st = path.stat()
+    stamp_file = cache_dir / (hashlib.sha1(str(path.resolve()).encode('utf-8')).hexdigest() + '.stamp')
 
-def compare_nodes(before: Dict, after: Dict) -> Dict:
-    """对比节点差异"""
+    content = None
+    digest = None
+    old_digest = None
+    try:
+        stamp = json.loads(stamp_file.read_text(encoding='utf-8'))
+        old_digest = stamp.get('sha256')
+        if stamp['size'] == st.st_size and stamp['mtime_ns'] == st.st_mtime_ns:
+            digest = stamp['sha256']
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+
+    if digest is None:
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        stamp = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': digest}
+        try:
+            _atomic_write(stamp_file, json.dumps(stamp).encode('utf-8'))
+        except OSError:
+            pass
+        else:
+            if old_digest != digest:
+                _prune_cache(cache_dir, stamp_file, old_digest)
+
+    cache_file = cache_dir / f"{digest}.pickle"
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('version') == CACHE_VERSION:
+            return cached['data']
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+
+    if content is None:
+        with open(path, 'rb') as f:
+            content = f.read()
+    data = yaml.load(content, Loader=NodeLoader)
+    try:
+        _atomic_write(cache_file, pickle.dumps({'version': CACHE_VERSION, 'data': data}, protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError:
+        pass
+    return data
+
+
+class _OffsetTextStream:
+    """
+    包装二进制文件供 yaml Reader 读取, 记录字符位置与字节偏移的对应关系
+    只保留尚未释放的文本块, 内存占用与单个节点大小相关
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.name = getattr(raw, 'name', '<file>')
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.chunks = deque()  # (起始字符位置, 起始字节偏移, 文本)
+        self.chars = 0
+        self.bytes = 0
+
+    def read(self, size: int = -1) -> str:
+        text = ''
+        while not text:
+            data = self.raw.read(size)
+            text = self.decoder.decode(data, final=not data)
+            if not data:
+                break
+        if text:
+            self.chunks.append((self.chars, self.bytes, text))
+            self.chars += len(text)
+            self.bytes += len(text.encode('utf-8'))
+        return text
+
+    def byte_offset(self, index: int) -> int:
+        """字符位置 -> 文件字节偏移"""
+        for char_start, byte_start, text in reversed(self.chunks):
+            if char_start <= index:
+                return byte_start + len(text[:index - char_start].encode('utf-8'))
+        raise ValueError(f"字符位置 {index} 所在的文本块已被释放")
+
+    def release(self, index: int):
+        """丢弃 index 之前已完整读取过的文本块"""
+        while len(self.chunks) > 1 and self.chunks[1][0] <= index:
+            self.chunks.popleft()
+
+
+def iter_proxy_nodes(loader: yaml.SafeLoader) -> Iterator[yaml.Node]:
+    """
+    在事件层面定位顶层 proxies 序列, 逐个 compose 其中的节点
+    其余顶层字段会被解析后直接丢弃
+    """
+    loader.get_event()  # StreamStart
+    if loader.check_event(yaml.StreamEndEvent):
+        return
+    loader.get_event()  # DocumentStart
+    if not loader.check_event(yaml.MappingStartEvent):
+        return
+    loader.get_event()
+    while not loader.check_event(yaml.MappingEndEvent):
+        key = loader.construct_object(loader.compose_node(None, None))
+        if key == 'proxies' and loader.check_event(yaml.SequenceStartEvent):
+            loader.get_event()
+            index = 0
+            while not loader.check_event(yaml.SequenceEndEvent):
+                yield loader.compose_node(None, index)
+                index += 1
+            loader.get_event()
+        else:
+            loader.compose_node(None, None)
+
+
+def construct_proxy(loader: yaml.SafeLoader, node: yaml.Node) -> Any:
+    """构造单个节点, 并清理 Loader 的构造缓存避免其随节点数增长"""
+    data = loader.construct_object(node, deep=True)
+    loader.constructed_objects = {}
+    loader.recursive_objects = {}
+    return data
+
+
+def node_key(node: Dict, name_counters: Dict[str, int]) -> str:
+    """节点索引 key: 使用名称, 重复名称使用 name###type###index"""
+    name = node.get('name', 'UNKNOWN')
+    node_type = node.get('type', 'unknown')
+    counter = name_counters.get(name, 0)
+    name_counters[name] = counter + 1
+
+    if counter == 0:
+        return name
+    return f"{name}###{node_type}###{counter}"
+
+
+MATCH_MODES = ('identity', 'name')
+# 协议身份中的凭据字段 (存在的字段全部参与) 与传输路径字段 (取第一个非空值)
+IDENTITY_CREDENTIALS = ('uuid', 'password', 'auth-str', 'auth', 'psk', 'private-key', 'username')
+IDENTITY_PATHS = (('ws-opts', 'path'), ('h2-opts', 'path'), ('http-opts', 'path'),
+                  ('xhttp-opts', 'path'), ('grpc-opts', 'grpc-service-name'))
+
+
+def node_identity(node: Dict) -> Optional[Tuple]:
+    """
+    节点的协议身份: (类型, 服务器, 端口, 凭据, 传输路径), 与名称无关
+    端口统一为整数, 服务器忽略大小写, 传输路径 '/' 视为未设置; 缺少服务器时返回 None
+    """
+    server = node.get('server')
+    if not server:
+        return None
+    port = node.get('port')
+    try:
+        port = int(port)
+    except (TypeError, ValueError):
+        port = str(port)
+    credential = tuple(str(node[field]) for field in IDENTITY_CREDENTIALS if node.get(field) not in (None, ''))
+    transport = ''
+    for opts, field in IDENTITY_PATHS:
+        value = node.get(opts)
+        value = value.get(field) if isinstance(value, dict) else None
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if value not in (None, ''):
+            transport = str(value)
+            break
+    if transport == '/':
+        transport = ''
+    return str(node.get('type', 'unknown')).lower(), str(server).strip().lower(), port, credential, transport
+
+
+def _identity_index(nodes: List[Dict]) -> Dict[Tuple, List[int]]:
+    """协议身份 -> 节点下标列表"""
+    index = defaultdict(list)
+    for i, node in enumerate(nodes):
+        identity = node_identity(node)
+        if identity is not None:
+            index[identity].append(i)
+    return index
+
+
+def match_nodes(before_nodes: List[Dict], after_nodes: List[Dict],
+                match: str = 'identity') -> Tuple[Dict, Dict, Dict[str, str]]:
+    """
+    配对转换前后节点, 返回 (转换前索引, 转换后索引, 重命名节点 {key: 转换后名称})
+    转换前节点按 node_key 索引, 配对的转换后节点使用同一个 key, 未配对的转换后节点使用不与转换前冲突的 key
+    identity 模式: 协议身份在前后两侧各恰好出现一次的节点直接配对, 名称可以不同 (重命名/emoji 规则);
+    身份缺失、重复或只出现在一侧的节点退回按名称配对, 同名节点按出现顺序配对
+    两种模式都只做哈希查找, 整体为 O(n)
+    """
+    name_counters = {}
+    before_keys = [node_key(node, name_counters) for node in before_nodes]
+    before_dict = dict(zip(before_keys, before_nodes))
+
+    paired = {}
+    if match == 'identity':
+        before_ids = _identity_index(before_nodes)
+        for identity, after_indexes in _identity_index(after_nodes).items():
+            before_indexes = before_ids.get(identity)
+            if len(after_indexes) == 1 and before_indexes is not None and len(before_indexes) == 1:
+                paired[after_indexes[0]] = before_indexes[0]
+
+    claimed = set(paired.values())
+    by_name = defaultdict(deque)
+    for i, node in enumerate(before_nodes):
+        if i not in claimed:
+            by_name[node.get('name', 'UNKNOWN')].append(i)
+
+    after_dict = {}
+    renamed = {}
+    name_counters = {}
+    for j, node in enumerate(after_nodes):
+        name = node.get('name', 'UNKNOWN')
+        i = paired.get(j)
+        if i is None and by_name.get(name):
+            i = by_name[name].popleft()
+        if i is None:
+            key = node_key(node, name_counters)
+            while key in before_dict:
+                key = node_key(node, name_counters)
+        else:
+            key = before_keys[i]
+            if before_nodes[i].get('name', 'UNKNOWN') != name:
+                renamed[key] = name
+        after_dict[key] = node
+    return before_dict, after_dict, renamed
+
+
+def warn_duplicates(label: str, names_count: Dict[str, int]):
+    """报告重复节点名称"""
+    duplicates = [name for name, count in names_count.items() if count > 1]
+    if duplicates:
+        print(f"\n⚠️  警告: {label}文件中发现 {len(duplicates)} 个重复节点名称:")
+        for name in duplicates[:5]:
+            print(f"  - {name} (出现 {names_count[name]} 次)")
+
+
+def diff_node(before_node: Dict, after_node: Dict, key: str, timings: Optional[List[float]] = None) -> Optional[Dict]:
+    """
+    对比单个节点, 无差异时返回 None
+    传入 timings 时把 deep_compare 与合法性判断的耗时分别累加到 timings[0] / timings[1]
+    """
+    node_name = before_node.get('name', key)
+    node_type = before_node.get('type', 'unknown')
+
+    # 使用 Deep Compare
+    start = time.perf_counter() if timings is not None else 0.0
+    diffs = deep_compare(before_node, after_node)
+    if timings is not None:
+        compared = time.perf_counter()
+        timings[0] += compared - start
+    if not diffs:
+        return None
+
+    node_diff_record = {
+        'name': node_name,
+        'type': node_type,
+        'diffs': {},
+        'legitimate': {},
+        'issues': {}
+    }
+
+    for d in diffs:
+        path = d['path']
+        before_val = d['before']
+        after_val = d['after']
+
+        is_legit, reason = is_legitimate_difference(path, before_val, after_val, node_type)
+
+        record = {
+            'path': path,
+            'before': before_val,
+            'after': after_val,
+            'type': d['type']
+        }
+
+        if is_legit:
+             record['reason'] = reason
+             node_diff_record['legitimate'][path] = record
+        else:
+             node_diff_record['issues'][path] = record
+
+        node_diff_record['diffs'][path] = record
+
+    if timings is not None:
+        timings[1] += time.perf_counter() - compared
+    return node_diff_record
+
+
+def _diff_chunk(pairs: List[Tuple[str, Dict, Dict]]) -> Tuple[List[Optional[Dict]], List[float], List[float]]:
+    """
+    进程池 worker: 依次对比一组 (key, 转换前节点, 转换后节点)
+    返回 (差异记录, 每个节点的对比耗时, [deep_compare 总耗时, 合法性判断总耗时, 结论缓存命中数, 未命中数])
+    """
+    engine = _engine if _engine is not None else load_rules()
+    hits, misses = engine.cache_hits, engine.cache_misses
+    records = []
+    seconds = []
+    timings = [0.0, 0.0]
+    for key, before_node, after_node in pairs:
+        start = time.perf_counter()
+        records.append(diff_node(before_node, after_node, key, timings))
+        seconds.append(time.perf_counter() - start)
+    timings += [engine.cache_hits - hits, engine.cache_misses - misses]
+    return records, seconds, timings
+
+
+class DiffTable:
+    """
+    列式差异记录
+    每条差异在各列中只占一个元素: 节点名称/字段路径/节点类型/说明均驻留为整数编码,
+    差异类型与是否合法为单字节编码, 只有前后值保留原始对象
+    """
+    KINDS = ('missing', 'added', 'modified')
+
+    def __init__(self):
+        self.node_names = []
+        self.paths = []
+        self.node_types = []
+        self.reasons = ['']
+        self._path_ids = {}
+        self._type_ids = {}
+        self._reason_ids = {'': 0}
+        self.node = array('I')
+        self.path = array('I')
+        self.node_type = array('I')
+        self.kind = array('B')
+        self.is_legit = array('B')
+        self.reason = array('I')
+        self.before = []
+        self.after = []
+
+    def __len__(self) -> int:
+        return len(self.path)
+
+    @staticmethod
+    def _intern(value: str, values: List[str], ids: Dict[str, int]) -> int:
+        code = ids.get(value)
+        if code is None:
+            code = ids[value] = len(values)
+            values.append(value)
+        return code
+
+    def add_node(self, node_diff_record: Dict):
+        """追加 diff_node 返回的单个节点差异记录"""
+        node = len(self.node_names)
+        self.node_names.append(node_diff_record['name'])
+        type_code = self._intern(node_diff_record['type'], self.node_types, self._type_ids)
+        for path, record in node_diff_record['diffs'].items():
+            self.node.append(node)
+            self.path.append(self._intern(path, self.paths, self._path_ids))
+            self.node_type.append(type_code)
+            self.kind.append(self.KINDS.index(record['type']))
+            is_legit = 'reason' in record
+            self.is_legit.append(is_legit)
+            self.reason.append(self._intern(record['reason'], self.reasons, self._reason_ids) if is_legit else 0)
+            self.before.append(record['before'])
+            self.after.append(record['after'])
+
+    def rows(self) -> Iterator[Tuple[int, str, str, str, bool, str, Any, Any]]:
+        """按追加顺序逐条返回 (节点序号, 字段路径, 节点类型, 差异类型, 是否合法, 说明, 前值, 后值)"""
+        for i in range(len(self.path)):
+            yield (self.node[i], self.paths[self.path[i]], self.node_types[self.node_type[i]],
+                   self.KINDS[self.kind[i]], bool(self.is_legit[i]), self.reasons[self.reason[i]],
+                   self.before[i], self.after[i])
+
+    def to_report(self, stats: Dict) -> Dict:
+        """还原为原有的 JSON 报告结构"""
+        differences = defaultdict(list)
+        field_diffs = defaultdict(int)
+        type_issues = defaultdict(list)
+        legitimate_diffs = defaultdict(list)
+        actual_issues = defaultdict(list)
+
+        node_diff_record = None
+        current_node = -1
+        for node, path, node_type, kind, is_legit, reason, before_val, after_val in self.rows():
+            node_name = self.node_names[node]
+            if node != current_node:
+                current_node = node
+                node_diff_record = {
+                    'name': node_name,
+                    'type': node_type,
+                    'diffs': {},
+                    'legitimate': {},
+                    'issues': {}
+                }
+                differences[node_type].append(node_diff_record)
+
+            record = {
+                'path': path,
+                'before': before_val,
+                'after': after_val,
+                'type': kind
+            }
+
+            if is_legit:
+                 record['reason'] = reason
+                 node_diff_record['legitimate'][path] = record
+                 legitimate_diffs[node_type].append({
+                     'name': node_name,
+                     'field': path,
+                     'before': before_val,
+                     'after': after_val,
+                     'reason': reason
+                 })
+            else:
+                 node_diff_record['issues'][path] = record
+                 actual_issues[node_type].append({
+                     'name': node_name,
+                     'field': path,
+                     'before': before_val,
+                     'after': after_val
+                 })
+            
+            # 统计
+            field_diffs[path] += 1
+            type_issues[node_type].append({
+                'name': node_name,
+                'field': path,
+                'before': before_val,
+                'after': after_val,
+                'is_legitimate': is_legit,
+                'reason': reason if is_legit else ''
+            })
+
+            node_diff_record['diffs'][path] = record
+
+        return {
+            'stats': stats,
+            'differences': dict(differences),
+            'field_diffs': dict(field_diffs),
+            'type_issues': dict(type_issues),
+            'legitimate_diffs': dict(legitimate_diffs),
+            'actual_issues': dict(actual_issues)
+        }
+
+    def summary(self, stats: Dict) -> Dict:
+        """供 print_report 使用的汇总结果, 问题详情只保留每种节点类型前 5 条样例"""
+        field_diffs = defaultdict(int)
+        legitimate_counts = defaultdict(int)
+        actual_issue_counts = defaultdict(int)
+        actual_issues = defaultdict(list)
+        for node, path, node_type, kind, is_legit, reason, before_val, after_val in self.rows():
+            field_diffs[path] += 1
+            if is_legit:
+                legitimate_counts[node_type] += 1
+                continue
+            actual_issue_counts[node_type] += 1
+            if len(actual_issues[node_type]) < 5:
+                actual_issues[node_type].append({
+                    'name': self.node_names[node],
+                    'field': path,
+                    'before': before_val,
+                    'after': after_val
+                })
+        return {
+            'stats': stats,
+            'field_diffs': dict(field_diffs),
+            'legitimate_counts': dict(legitimate_counts),
+            'actual_issue_counts': dict(actual_issue_counts),
+            'actual_issues': dict(actual_issues)
+        }
+
+    def to_grouped_report(self, stats: Dict) -> Dict:
+        """
+        分组报告: 在 summary 的基础上, 把 (字段路径, 节点类型, 差异类型, 前值, 后值) 完全相同的差异合并为一条,
+        附带出现次数与节点名称列表, 按出现次数从多到少排列
+        """
+        groups = {}
+        for node, path, node_type, kind, is_legit, reason, before_val, after_val in self.rows():
+            key = (path, node_type, kind, canonical_value(before_val), canonical_value(after_val))
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    'path': path,
+                    'type': node_type,
+                    'kind': kind,
+                    'before': before_val,
+                    'after': after_val,
+                    'is_legitimate': is_legit,
+                    'reason': reason,
+                    'count': 0,
+                    'nodes': []
+                }
+            group['count'] += 1
+            group['nodes'].append(self.node_names[node])
+        report = self.summary(stats)
+        report['groups'] = sorted(groups.values(), key=lambda group: group['count'], reverse=True)
+        return report
+
+    def to_arrow(self, stats: Dict, metrics: Optional[Dict] = None):
+        """
+        转换为 pyarrow.Table
+        驻留的字符串列直接以字典编码输出, 前后值类型不固定, 以 JSON 文本保存
+        统计与运行指标保存在 schema metadata 中
+        """
+        import pyarrow as pa
+
+        def dictionary(codes, values):
+            return pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32()), pa.array(values, type=pa.string()))
+
+        def json_values(values):
+            return pa.array([json.dumps(v, ensure_ascii=False) for v in values], type=pa.string())
+
+        table = pa.table({
+            'node': dictionary(self.node, self.node_names),
+            'node_type': dictionary(self.node_type, self.node_types),
+            'path': dictionary(self.path, self.paths),
+            'kind': dictionary(self.kind, list(self.KINDS)),
+            'is_legit': pa.array([bool(v) for v in self.is_legit], type=pa.bool_()),
+            'reason': dictionary(self.reason, self.reasons),
+            'before': json_values(self.before),
+            'after': json_values(self.after),
+        })
+        counts = {key: value if isinstance(value, int) else len(value) for key, value in stats.items()}
+        metadata = {'stats': json.dumps(counts)}
+        if metrics is not None:
+            metadata['metrics'] = json.dumps(metrics, ensure_ascii=False)
+        return table.replace_schema_metadata(metadata)
+
+
+class Metrics:
+    """
+    运行指标: 各阶段的墙钟/CPU 耗时与截至该阶段的峰值内存 (RSS), 节点与差异计数,
+    以及单节点对比耗时的直方图 (按节点类型), 可写入 JSON 报告或导出为 Prometheus 文本格式
+    """
+    # 单节点对比耗时直方图的桶上界 (秒)
+    BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+    SLOWEST = 10
+
+    def __init__(self):
+        self.phases = {}
+        self.counts = defaultdict(int)
+        self.compare_seconds = 0.0
+        self.classify_seconds = 0.0
+        # 节点类型 -> [各桶计数..., 超出最大桶的计数], 以及耗时总和/最大值
+        self.histogram = {}
+        self.type_seconds = defaultdict(float)
+        self.type_max = defaultdict(float)
+        self.slowest = []
+
+    @staticmethod
+    def peak_rss() -> Optional[int]:
+        """进程峰值常驻内存 (字节), 不支持的平台返回 None"""
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """记录一个阶段的耗时, 同名阶段多次进入时累加"""
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            entry = self.phases.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'peak_rss_bytes': None})
+            entry['wall_seconds'] += time.perf_counter() - wall
+            entry['cpu_seconds'] += time.process_time() - cpu
+            entry['peak_rss_bytes'] = self.peak_rss()
+
+    def observe(self, key: str, node_type: str, seconds: float):
+        """记录单个节点的对比耗时"""
+        buckets = self.histogram.get(node_type)
+        if buckets is None:
+            buckets = self.histogram[node_type] = [0] * (len(self.BUCKETS) + 1)
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+        self.type_seconds[node_type] += seconds
+        if seconds > self.type_max[node_type]:
+            self.type_max[node_type] = seconds
+        item = (seconds, key, node_type)
+        if len(self.slowest) < self.SLOWEST:
+            heapq.heappush(self.slowest, item)
+        elif item > self.slowest[0]:
+            heapq.heapreplace(self.slowest, item)
+
+    def to_dict(self) -> Dict:
+        node_types = {}
+        for node_type, buckets in self.histogram.items():
+            count = sum(buckets)
+            node_types[node_type] = {
+                'count': count,
+                'seconds': round(self.type_seconds[node_type], 6),
+                'mean_seconds': round(self.type_seconds[node_type] / count, 9) if count else 0.0,
+                'max_seconds': round(self.type_max[node_type], 6),
+                'buckets': {str(bound): n for bound, n in zip(self.BUCKETS + ('+Inf',), buckets)},
+            }
+        return {
+            'phases': {name: {k: round(v, 6) if isinstance(v, float) else v for k, v in entry.items()}
+                       for name, entry in self.phases.items()},
+            'peak_rss_bytes': self.peak_rss(),
+            'counts': dict(self.counts),
+            'diff_seconds': {'deep_compare': round(self.compare_seconds, 6), 'classify': round(self.classify_seconds, 6)},
+            # 按总耗时排序, 最慢的节点类型在前
+            'node_types': dict(sorted(node_types.items(), key=lambda item: item[1]['seconds'], reverse=True)),
+            'slowest_nodes': [{'key': key, 'type': node_type, 'seconds': round(seconds, 6)}
+                              for seconds, key, node_type in sorted(self.slowest, reverse=True)],
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式, 可交给 node_exporter 的 textfile collector 采集"""
+        def label(value: str) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        lines = ['# HELP compare_nodes_phase_wall_seconds Wall clock time spent in each phase.',
+                 '# TYPE compare_nodes_phase_wall_seconds gauge']
+        lines += [f'compare_nodes_phase_wall_seconds{{phase="{label(name)}"}} {entry["wall_seconds"]:.6f}'
+                  for name, entry in self.phases.items()]
+        lines += ['# HELP compare_nodes_phase_cpu_seconds CPU time spent in each phase.',
+                  '# TYPE compare_nodes_phase_cpu_seconds gauge']
+        lines += [f'compare_nodes_phase_cpu_seconds{{phase="{label(name)}"}} {entry["cpu_seconds"]:.6f}'
+                  for name, entry in self.phases.items()]
+        peak = self.peak_rss()
+        if peak is not None:
+            lines += ['# HELP compare_nodes_peak_rss_bytes Peak resident set size of the process.',
+                      '# TYPE compare_nodes_peak_rss_bytes gauge',
+                      f'compare_nodes_peak_rss_bytes {peak}']
+        lines += ['# HELP compare_nodes_items Nodes and differences processed.',
+                  '# TYPE compare_nodes_items gauge']
+        lines += [f'compare_nodes_items{{item="{label(name)}"}} {value}' for name, value in self.counts.items()]
+        lines += ['# HELP compare_nodes_diff_seconds Time spent in deep_compare and in classifying differences.',
+                  '# TYPE compare_nodes_diff_seconds gauge',
+                  f'compare_nodes_diff_seconds{{step="deep_compare"}} {self.compare_seconds:.6f}',
+                  f'compare_nodes_diff_seconds{{step="classify"}} {self.classify_seconds:.6f}']
+        lines += ['# HELP compare_nodes_node_diff_seconds Time spent comparing a single node.',
+                  '# TYPE compare_nodes_node_diff_seconds histogram']
+        for node_type, buckets in self.histogram.items():
+            cumulative = 0
+            for bound, n in zip(self.BUCKETS + ('+Inf',), buckets):
+                cumulative += n
+                lines.append(f'compare_nodes_node_diff_seconds_bucket{{type="{label(node_type)}",le="{bound}"}} {cumulative}')
+            lines.append(f'compare_nodes_node_diff_seconds_sum{{type="{label(node_type)}"}} {self.type_seconds[node_type]:.6f}')
+            lines.append(f'compare_nodes_node_diff_seconds_count{{type="{label(node_type)}"}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filepath: Union[str, Path]):
+        _atomic_write(Path(filepath), self.to_prometheus().encode('utf-8'))
+
+    def print_summary(self):
+        print("\n" + "=" * 80)
+        print("⏱️  阶段耗时")
+        print("=" * 80)
+        for name, entry in self.phases.items():
+            rss = entry['peak_rss_bytes']
+            rss_text = f"{rss / 1048576:8.1f} MB" if rss is not None else ''
+            print(f"{name:20s} 墙钟 {entry['wall_seconds']:8.3f}s  CPU {entry['cpu_seconds']:8.3f}s  峰值内存 {rss_text}")
+        print(f"{'其中 deep_compare':20s} {self.compare_seconds:8.3f}s, 合法性判断 {self.classify_seconds:.3f}s")
+        hits = self.counts.get('verdict_cache_hits', 0)
+        lookups = hits + self.counts.get('verdict_cache_misses', 0)
+        if lookups:
+            print(f"{'合法性结论缓存':20s} 命中 {hits}/{lookups} ({hits / lookups:.1%})")
+        slow_types = sorted(self.type_seconds.items(), key=lambda item: item[1], reverse=True)[:5]
+        if slow_types:
+            print("最耗时的节点类型: " + ", ".join(
+                f"{node_type} {seconds:.3f}s/{sum(self.histogram[node_type])} 个" for node_type, seconds in slow_types))
+
+
+REPORT_FORMATS = ('json', 'parquet', 'arrow')
+
+
+def write_table(table: DiffTable, stats: Dict, report_file: str, fmt: str, metrics: Optional[Dict] = None):
+    """以 Parquet 或 Arrow IPC 格式写出列式差异记录"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError(f"输出 {fmt} 格式需要安装 pyarrow: pip install pyarrow") from None
+
+    arrow_table = table.to_arrow(stats, metrics)
+    if fmt == 'parquet':
+        pq.write_table(arrow_table, report_file)
+    else:
+        with pa.OSFile(report_file, 'wb') as sink:
+            with pa.ipc.new_file(sink, arrow_table.schema) as writer:
+                writer.write_table(arrow_table)
+
+
+def diff_pairs(pairs: List[Tuple[str, Dict, Dict]], jobs: int = 1,
+               metrics: Optional[Metrics] = None) -> List[Optional[Dict]]:
+    """
+    依次对比 (key, 转换前节点, 转换后节点), 返回与输入顺序一致的差异记录
+    jobs > 1 时分块交给进程池对比, 结果按分块顺序合并, 与单进程输出完全一致
+    传入 metrics 时记录每个节点的对比耗时
+    """
+    # 内容完全相同的节点不会产生差异, 整个节点先做一次 C 层的相等比较,
+    # 只有不相等的节点才进入递归对比 (也只有这些节点需要发送给进程池)
+    changed = [i for i, (key, before_node, after_node) in enumerate(pairs) if before_node != after_node]
+    changed_pairs = [pairs[i] for i in changed]
+
+    if jobs <= 1 or len(changed_pairs) <= 1:
+        results = [_diff_chunk(changed_pairs)]
+    else:
+        # 每个进程分到若干块, 平衡各块耗时差异
+        chunk_size = -(-len(changed_pairs) // (jobs * 4))
+        chunks = [changed_pairs[i:i + chunk_size] for i in range(0, len(changed_pairs), chunk_size)]
+        rules_file = _engine.source if _engine is not None else RULES_FILE
+        with ProcessPoolExecutor(max_workers=jobs, initializer=load_rules, initargs=(rules_file,)) as executor:
+            results = list(executor.map(_diff_chunk, chunks))
+    changed_records = [record for part, _, _ in results for record in part]
+
+    if metrics is not None:
+        seconds = [s for _, part, _ in results for s in part]
+        for (key, before_node, _), s in zip(changed_pairs, seconds):
+            metrics.observe(key, before_node.get('type', 'unknown'), s)
+        metrics.compare_seconds += sum(timings[0] for _, _, timings in results)
+        metrics.classify_seconds += sum(timings[1] for _, _, timings in results)
+        metrics.counts['verdict_cache_hits'] += sum(timings[2] for _, _, timings in results)
+        metrics.counts['verdict_cache_misses'] += sum(timings[3] for _, _, timings in results)
+        metrics.counts['nodes_equal'] += len(pairs) - len(changed_pairs)
+        metrics.counts['nodes_compared'] += len(changed_pairs)
+
+    records = [None] * len(pairs)
+    for i, record in zip(changed, changed_records):
+        records[i] = record
+    return records
+
+
+def node_fingerprint(node: Dict) -> str:
+    """节点内容指纹: 对按 key 排序的规范化 JSON 计算哈希"""
+    try:
+        canonical = json.dumps(node, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    except TypeError:  # 混合类型的 key 无法排序
+        canonical = repr(node)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class IncrementalState:
+    """
+    增量对比状态, 保存在报告旁的 <报告名>.fingerprints.json
+    记录每个公共节点 (按 make_node_map 的 key) 的前后指纹及其差异记录;
+    格式版本或规则文件变化时丢弃上次的状态
+    """
+    VERSION = 1
+
+    def __init__(self, filepath: Union[str, Path], rules_digest: str):
+        self.filepath = Path(filepath)
+        self.rules_digest = rules_digest
+        self.previous = {}
+        self.nodes = {}
+        try:
+            with open(self.filepath, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION and data.get('rules') == rules_digest:
+                self.previous = data.get('nodes', {})
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def path_for(report_file: Union[str, Path]) -> Path:
+        report_file = Path(report_file)
+        return report_file.with_name(f"{report_file.stem}.fingerprints.json")
+
+    def lookup(self, key: str, fingerprint: Tuple[str, str]) -> Tuple[bool, Optional[Dict]]:
+        entry = self.previous.get(key)
+        if entry is not None and entry[0] == fingerprint[0] and entry[1] == fingerprint[1]:
+            return (True, entry[2])
+        return (False, None)
+
+    def update(self, key: str, fingerprint: Tuple[str, str], node_diff_record: Optional[Dict]):
+        self.nodes[key] = [fingerprint[0], fingerprint[1], node_diff_record]
+
+    def save(self):
+        data = {'version': self.VERSION, 'rules': self.rules_digest, 'nodes': self.nodes}
+        _atomic_write(self.filepath, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+def collect_diffs(before: Dict, after: Dict, jobs: int = 1,
+                  state: Optional[IncrementalState] = None,
+                  metrics: Optional[Metrics] = None,
+                  match: str = 'identity') -> Tuple[Dict, DiffTable]:
+    """
+    对比节点差异, 返回 (节点统计, 列式差异记录)
+    match 为节点配对方式, 见 match_nodes
+    传入 state 时只重新对比前后指纹有变化的节点, 并把本次结果写回 state
+    传入 metrics 时记录建立索引与对比两个阶段的耗时及计数
+    """
+    if metrics is None:
+        metrics = Metrics()
+    with metrics.phase('index'):
+        stats, before_dict, after_dict = _index_nodes(before, after, match)
+    with metrics.phase('diff'):
+        table = _diff_common(stats, before_dict, after_dict, jobs, state, metrics)
+    metrics.counts['nodes_before'] = stats['total_before']
+    metrics.counts['nodes_after'] = stats['total_after']
+    metrics.counts['nodes_common'] = len(stats['common'])
+    metrics.counts['nodes_missing'] = len(stats['missing'])
+    metrics.counts['nodes_new'] = len(stats['new'])
+    metrics.counts['nodes_renamed'] = len(stats['renamed'])
+    metrics.counts['nodes_changed'] = len(table.node_names)
+    metrics.counts['diffs'] = len(table)
+    metrics.counts['diffs_legitimate'] = sum(table.is_legit)
+    return stats, table
+
+
+def _index_nodes(before: Dict, after: Dict, match: str = 'identity') -> Tuple[Dict, Dict, Dict]:
+    """配对并按 key 索引前后节点, 返回 (节点统计, 转换前索引, 转换后索引)"""
     before_nodes = before.get('proxies', [])
     after_nodes = after.get('proxies', [])
     
@@ -234,150 +1350,253 @@ def compare_nodes(before: Dict, after: Dict) -> Dict:
         name = node.get('name', 'UNKNOWN')
         after_names_count[name] = after_names_count.get(name, 0) + 1
     
-    # 报告重复节点
-    duplicates_before = [name for name, count in before_names_count.items() if count > 1]
-    duplicates_after = [name for name, count in after_names_count.items() if count > 1]
+    warn_duplicates('转换前', before_names_count)
+    warn_duplicates('转换后', after_names_count)
     
-    if duplicates_before:
-        print(f"\n⚠️  警告: 转换前文件中发现 {len(duplicates_before)} 个重复节点名称:")
-        for name in duplicates_before[:5]:
-            print(f"  - {name} (出现 {before_names_count[name]} 次)")
-    
-    if duplicates_after:
-        print(f"\n⚠️  警告: 转换后文件中发现 {len(duplicates_after)} 个重复节点名称:")
-        for name in duplicates_after[:5]:
-            print(f"  - {name} (出现 {after_names_count[name]} 次)")
-    
-    # 按名称索引 (对于重复节点,使用 name_type_index 作为唯一key)
-    def make_node_map(nodes):
-        node_map = {}
-        name_counters = {}
-        for node in nodes:
-            name = node.get('name', 'UNKNOWN')
-            node_type = node.get('type', 'unknown')
-            counter = name_counters.get(name, 0)
-            name_counters[name] = counter + 1
-            
-            if counter == 0:
-                key = name
-            else:
-                key = f"{name}###{node_type}###{counter}"
-            node_map[key] = node
-        return node_map
+    # 按协议身份或名称配对 (对于重复节点,使用 name_type_index 作为唯一key)
+    before_dict, after_dict, renamed = match_nodes(before_nodes, after_nodes, match)
 
-    before_dict = make_node_map(before_nodes)
-    after_dict = make_node_map(after_nodes)
-    
     before_keys = set(before_dict.keys())
     after_keys = set(after_dict.keys())
-    
+
     stats = {
         'total_before': len(before_nodes),
         'total_after': len(after_nodes),
         'missing': list(before_keys - after_keys),
         'new': list(after_keys - before_keys),
         'common': list(before_keys & after_keys),
+        'renamed': renamed,
     }
-    
-    # 对比公共节点的差异
-    differences = defaultdict(list)
-    field_diffs = defaultdict(int)
-    type_issues = defaultdict(list)
-    legitimate_diffs = defaultdict(list)
-    actual_issues = defaultdict(list)
-    
-    for key in stats['common']:
-        before_node = before_dict[key]
-        after_node = after_dict[key]
-        node_name = before_node.get('name', key)
-        node_type = before_node.get('type', 'unknown')
-        
-        # 使用 Deep Compare
-        diffs = deep_compare(before_node, after_node)
-        
-        if diffs:
-            node_diff_record = {
-                'name': node_name,
-                'type': node_type,
-                'diffs': {},
-                'legitimate': {},
-                'issues': {}
-            }
-            
-            for d in diffs:
-                path = d['path']
-                before_val = d['before']
-                after_val = d['after']
-                
-                is_legit, reason = is_legitimate_difference(path, before_val, after_val, node_type)
-                
-                record = {
-                    'path': path,
-                    'before': before_val,
-                    'after': after_val,
-                    'type': d['type']
-                }
-                
-                if is_legit:
-                     record['reason'] = reason
-                     node_diff_record['legitimate'][path] = record
-                     legitimate_diffs[node_type].append({
-                         'name': node_name,
-                         'field': path,
-                         'before': before_val,
-                         'after': after_val,
-                         'reason': reason
-                     })
+    return stats, before_dict, after_dict
+
+
+def _diff_common(stats: Dict, before_dict: Dict, after_dict: Dict, jobs: int,
+                 state: Optional[IncrementalState], metrics: Metrics) -> DiffTable:
+    """对比公共节点的差异"""
+    common = stats['common']
+    if state is None:
+        node_records = diff_pairs([(key, before_dict[key], after_dict[key]) for key in common], jobs, metrics)
+    else:
+        # 增量模式: 前后指纹都未变化的节点直接复用上次的结果
+        fingerprints = {}
+        node_records = {}
+        pending = []
+        for key in common:
+            fingerprint = (node_fingerprint(before_dict[key]), node_fingerprint(after_dict[key]))
+            fingerprints[key] = fingerprint
+            hit, node_diff_record = state.lookup(key, fingerprint)
+            if hit:
+                node_records[key] = node_diff_record
+            else:
+                pending.append((key, before_dict[key], after_dict[key]))
+        for (key, _, _), node_diff_record in zip(pending, diff_pairs(pending, jobs, metrics)):
+            node_records[key] = node_diff_record
+        for key in common:
+            state.update(key, fingerprints[key], node_records[key])
+        print(f"增量对比: 复用 {len(common) - len(pending)} 个节点的结果, 重新对比 {len(pending)} 个节点")
+        metrics.counts['nodes_reused'] += len(common) - len(pending)
+        node_records = [node_records[key] for key in common]
+
+    table = DiffTable()
+    for node_diff_record in node_records:
+        if node_diff_record is not None:
+            table.add_node(node_diff_record)
+    return table
+
+
+def compare_nodes(before: Dict, after: Dict, jobs: int = 1, match: str = 'identity') -> Dict:
+    """对比节点差异, 返回原有的 JSON 报告结构"""
+    stats, table = collect_diffs(before, after, jobs, match=match)
+    return table.to_report(stats)
+
+
+def compare_nodes_stream(before_file: str, after_file: str, report_file: str,
+                         metrics: Optional[Metrics] = None, match: str = 'identity') -> Dict:
+    """
+    流式对比节点差异
+    转换前文件只保留 key -> (字节偏移, 长度, 列号) 的索引, 对比时按偏移重新读取单个节点;
+    转换后文件逐个节点读取, 差异记录以 JSON Lines 逐条写入报告, 最后一行为汇总信息
+    节点配对规则同 match_nodes, 但转换后节点按到达顺序贪心配对:
+    转换后一侧的身份重复只能在第二次出现时发现, 此时该节点退回按名称配对
+    返回与 print_report 兼容的汇总结果 (问题详情只保留前 5 条样例)
+    """
+    for filepath in (before_file, after_file):
+        if not Path(filepath).exists():
+            raise FileNotFoundError(f"文件未找到: {filepath}")
+    if metrics is None:
+        metrics = Metrics()
+
+    # 第一遍: 建立转换前节点索引, 以及协议身份 (重复时为 None) 与名称到 key 的索引
+    index = {}
+    name_counters = {}
+    identities = {}
+    by_name = defaultdict(deque)
+    with metrics.phase('index'), open(before_file, 'rb') as raw:
+        stream = _OffsetTextStream(raw)
+        loader = StreamLoader(stream)
+        try:
+            for node in iter_proxy_nodes(loader):
+                proxy = construct_proxy(loader, node)
+                key = node_key(proxy, name_counters)
+                by_name[proxy.get('name', 'UNKNOWN')].append(key)
+                if match == 'identity':
+                    identity = node_identity(proxy)
+                    if identity is not None:
+                        identities[identity] = None if identity in identities else key
+                if loader.anchors:
+                    # 使用了锚点/别名的文档无法单独重新解析某个节点, 只能保留节点本身
+                    index[key] = proxy
                 else:
-                     node_diff_record['issues'][path] = record
-                     actual_issues[node_type].append({
-                         'name': node_name,
-                         'field': path,
-                         'before': before_val,
-                         'after': after_val
-                     })
-                
-                # 统计
-                field_diffs[path] += 1
-                type_issues[node_type].append({
-                    'name': node_name,
-                    'field': path,
-                    'before': before_val,
-                    'after': after_val,
-                    'is_legitimate': is_legit,
-                    'reason': reason if is_legit else ''
-                })
-                
-                node_diff_record['diffs'][path] = record
+                    # block 风格的节点需要补回起始列的缩进才能单独解析
+                    start = stream.byte_offset(node.start_mark.index)
+                    end = stream.byte_offset(node.end_mark.index)
+                    column = 0 if getattr(node, 'flow_style', False) else node.start_mark.column
+                    index[key] = (start, end - start, column)
+                stream.release(node.end_mark.index)
+        finally:
+            loader.dispose()
+    warn_duplicates('转换前', name_counters)
 
-            differences[node_type].append(node_diff_record)
-    
-    return {
-        'stats': stats,
-        'differences': dict(differences),
-        'field_diffs': dict(field_diffs),
-        'type_issues': dict(type_issues),
-        'legitimate_diffs': dict(legitimate_diffs),
-        'actual_issues': dict(actual_issues)
+    stats = {
+        'total_before': sum(name_counters.values()),
+        'total_after': 0,
+        'missing': [],
+        'new': [],
+        'common': 0,
+        'renamed': {},
     }
+    field_diffs = defaultdict(int)
+    legitimate_counts = defaultdict(int)
+    actual_issue_counts = defaultdict(int)
+    actual_issues = defaultdict(list)
+
+    # 第二遍: 逐个读取转换后节点并与转换前节点对比
+    name_counters = {}
+    seen_identities = set()
+    with open(before_file, 'rb') as before_raw, \
+         open(after_file, 'r', encoding='utf-8') as after_stream, \
+         open(report_file, 'w', encoding='utf-8') as report:
+        loader = StreamLoader(after_stream)
+        timings = [0.0, 0.0]
+        engine = _engine if _engine is not None else load_rules()
+        hits, misses = engine.cache_hits, engine.cache_misses
+        try:
+            with metrics.phase('diff'):
+                for node in iter_proxy_nodes(loader):
+                    after_node = construct_proxy(loader, node)
+                    name = after_node.get('name', 'UNKNOWN')
+                    fallback_key = node_key(after_node, name_counters)
+                    key = None
+                    if match == 'identity':
+                        identity = node_identity(after_node)
+                        if identity is not None and identity not in seen_identities:
+                            seen_identities.add(identity)
+                            key = identities.get(identity)
+                            if key not in index:
+                                key = None
+                    if key is None:
+                        queue = by_name.get(name)
+                        while queue:
+                            candidate = queue.popleft()
+                            if candidate in index:
+                                key = candidate
+                                break
+                    if key is None:
+                        stats['new'].append(fallback_key)
+                        continue
+                    entry = index.pop(key)
+                    stats['common'] += 1
+
+                    if isinstance(entry, tuple):
+                        offset, length, column = entry
+                        before_raw.seek(offset)
+                        text = ' ' * column + before_raw.read(length).decode('utf-8')
+                        before_node = yaml.load(text, Loader=NodeLoader)
+                    else:
+                        before_node = entry
+                    if before_node.get('name', 'UNKNOWN') != name:
+                        stats['renamed'][key] = name
+
+                    if before_node == after_node:
+                        metrics.counts['nodes_equal'] += 1
+                        continue
+                    start = time.perf_counter()
+                    node_diff_record = diff_node(before_node, after_node, key, timings)
+                    metrics.observe(key, before_node.get('type', 'unknown'), time.perf_counter() - start)
+                    metrics.counts['nodes_compared'] += 1
+                    if node_diff_record is None:
+                        continue
+                    metrics.counts['nodes_changed'] += 1
+                    metrics.counts['diffs'] += len(node_diff_record['diffs'])
+                    metrics.counts['diffs_legitimate'] += len(node_diff_record['legitimate'])
+                    report.write(json.dumps(node_diff_record, ensure_ascii=False) + '\n')
+
+                    node_type = node_diff_record['type']
+                    for path, record in node_diff_record['diffs'].items():
+                        field_diffs[path] += 1
+                        if 'reason' in record:
+                            legitimate_counts[node_type] += 1
+                            continue
+                        actual_issue_counts[node_type] += 1
+                        if len(actual_issues[node_type]) < 5:
+                            actual_issues[node_type].append({
+                                'name': node_diff_record['name'],
+                                'field': path,
+                                'before': record['before'],
+                                'after': record['after']
+                            })
+        finally:
+            loader.dispose()
+        warn_duplicates('转换后', name_counters)
+
+        stats['total_after'] = sum(name_counters.values())
+        stats['missing'] = list(index.keys())
+        metrics.compare_seconds += timings[0]
+        metrics.classify_seconds += timings[1]
+        metrics.counts['verdict_cache_hits'] += engine.cache_hits - hits
+        metrics.counts['verdict_cache_misses'] += engine.cache_misses - misses
+        metrics.counts['nodes_before'] = stats['total_before']
+        metrics.counts['nodes_after'] = stats['total_after']
+        metrics.counts['nodes_common'] = stats['common']
+        metrics.counts['nodes_missing'] = len(stats['missing'])
+        metrics.counts['nodes_new'] = len(stats['new'])
+        metrics.counts['nodes_renamed'] = len(stats['renamed'])
+        summary = {
+            'stats': stats,
+            'field_diffs': dict(field_diffs),
+            'legitimate_counts': dict(legitimate_counts),
+            'actual_issue_counts': dict(actual_issue_counts),
+            'actual_issues': dict(actual_issues)
+        }
+        report.write(json.dumps({'summary': summary, 'metrics': metrics.to_dict()}, ensure_ascii=False) + '\n')
+
+    return summary
 
 
 def print_report(result: Dict):
     """打印对比报告"""
     stats = result['stats']
+    # 流式模式的汇总结果只保存计数, 详情仅保留样例
+    common_count = stats['common'] if isinstance(stats['common'], int) else len(stats['common'])
+    legitimate_counts = result.get('legitimate_counts') or \
+        {node_type: len(diffs) for node_type, diffs in result.get('legitimate_diffs', {}).items()}
+    actual_issue_counts = result.get('actual_issue_counts') or \
+        {node_type: len(issues) for node_type, issues in result.get('actual_issues', {}).items()}
     
     print("=" * 80)
     print("节点转换前后对比报告 (深度对比模式)")
     print("=" * 80)
     print(f"转换前节点总数: {stats['total_before']}")
     print(f"转换后节点总数: {stats['total_after']}")
-    print(f"公共节点数量: {len(stats['common'])}")
+    print(f"公共节点数量: {common_count}")
+    if stats.get('renamed'):
+        print(f"  其中按协议身份配对的重命名节点: {len(stats['renamed'])}")
     print(f"缺失节点数量: {len(stats['missing'])}")
     print(f"新增节点数量: {len(stats['new'])}")
     print()
     
-    total_legitimate = sum(len(diffs) for diffs in result.get('legitimate_diffs', {}).values())
-    total_actual = sum(len(issues) for issues in result.get('actual_issues', {}).values())
+    total_legitimate = sum(legitimate_counts.values())
+    total_actual = sum(actual_issue_counts.values())
     total_diffs = sum(result['field_diffs'].values())
     
     print("=" * 80)
@@ -406,7 +1625,8 @@ def print_report(result: Dict):
         print("=" * 80)
         for node_type, issues in sorted(result['actual_issues'].items()):
             if issues:
-                print(f"\n【{node_type}】类型节点 - {len(issues)} 个差异")
+                issue_count = actual_issue_counts.get(node_type, len(issues))
+                print(f"\n【{node_type}】类型节点 - {issue_count} 个差异")
                 print("-" * 80)
                 
                 # 仅展示前 5 个
@@ -416,8 +1636,8 @@ def print_report(result: Dict):
                     print(f"     前: {issue['before']}")
                     print(f"     后: {issue['after']}")
                 
-                if len(issues) > 5:
-                    print(f"\n  ... (隐藏其余 {len(issues)-5} 个差异)")
+                if issue_count > 5:
+                    print(f"\n  ... (隐藏其余 {issue_count-5} 个差异)")
     else:
         print("\n🎉 未发现需要关注的差异 (所有差异均判断为合法)")
 
@@ -426,13 +1646,13 @@ def print_report(result: Dict):
     print("📊 转换质量评估")
     print("=" * 80)
     if total_diffs > 0:
-        quality_score = (total_legitimate / total_diffs) * 100
-        print(f"一致性得分: {quality_score:.1f}%")
-        if quality_score == 100:
+        score = quality_score(total_legitimate, total_diffs)
+        print(f"一致性得分: {score:.1f}%")
+        if score == 100:
             print("评价: 完美转换")
-        elif quality_score >= 90:
+        elif score >= 90:
              print("评价: 优秀")
-        elif quality_score >= 70:
+        elif score >= 70:
              print("评价: 良好")
         else:
              print("评价: 需注意")
@@ -446,32 +1666,246 @@ def print_report(result: Dict):
     print("\nmihomo 官方文档: https://wiki.metacubex.one/config/")
     print("  - 传输层配置: https://wiki.metacubex.one/config/proxies/transport/")
 
+def quality_score(total_legitimate: int, total_diffs: int) -> float:
+    """一致性得分: 合法差异占全部差异的百分比, 无差异时为 100"""
+    return (total_legitimate / total_diffs) * 100 if total_diffs else 100.0
+
+
+def load_batch_pairs(batch_path: Path) -> List[Dict]:
+    """
+    读取批量对比的文件对
+    目录: 每个同时包含 转换前/转换后 的子目录为一组, 以子目录名命名
+    清单 (YAML/JSON): [{name, before, after}, ...], 相对路径以清单所在目录为基准
+    """
+    pairs = []
+    if batch_path.is_dir():
+        for sub in sorted(p for p in batch_path.iterdir() if p.is_dir()):
+            if (sub / '转换前').exists() and (sub / '转换后').exists():
+                pairs.append({'name': sub.name, 'before': str(sub / '转换前'), 'after': str(sub / '转换后')})
+    else:
+        with open(batch_path, 'rb') as f:
+            entries = yaml.load(f, Loader=NodeLoader) or []
+        if isinstance(entries, dict):
+            entries = entries.get('pairs', [])
+        for i, entry in enumerate(entries, 1):
+            before = batch_path.parent / entry['before']
+            after = batch_path.parent / entry['after']
+            name = entry.get('name') or before.parent.name or f'pair-{i}'
+            pairs.append({'name': str(name), 'before': str(before), 'after': str(after)})
+
+    # 报告按名称保存, 重名时追加序号
+    seen = defaultdict(int)
+    for pair in pairs:
+        seen[pair['name']] += 1
+        if seen[pair['name']] > 1:
+            pair['name'] = f"{pair['name']}-{seen[pair['name']]}"
+    return pairs
+
+
+def run_pair(pair: Dict, output_dir: Path, fmt: str, use_cache: bool, incremental: bool,
+             match: str = 'identity', group: bool = False) -> Dict:
+    """批量模式 worker: 对比一组文件并写出报告, 返回索引条目"""
+    start = time.perf_counter()
+    entry = {'name': pair['name'], 'before': pair['before'], 'after': pair['after'], 'report': None}
+    try:
+        # 批量模式下不逐组打印重复节点等提示
+        with contextlib.redirect_stdout(io.StringIO()):
+            before = load_file(pair['before'], use_cache=use_cache)
+            after = load_file(pair['after'], use_cache=use_cache)
+            report_file = output_dir / f"{pair['name']}.{fmt}"
+            state = IncrementalState(IncrementalState.path_for(report_file), _engine.digest) if incremental else None
+            stats, table = collect_diffs(before, after, state=state, match=match)
+            if state is not None:
+                state.save()
+
+        if fmt == 'json':
+            result = table.to_grouped_report(stats) if group else table.to_report(stats)
+            with open(report_file, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+        else:
+            write_table(table, stats, str(report_file), fmt)
+
+        summary = table.summary(stats)
+        total_legitimate = sum(summary['legitimate_counts'].values())
+        total_diffs = sum(summary['field_diffs'].values())
+        entry.update({
+            'report': str(report_file),
+            'total_before': stats['total_before'],
+            'total_after': stats['total_after'],
+            'common': len(stats['common']),
+            'missing': len(stats['missing']),
+            'new': len(stats['new']),
+            'renamed': len(stats['renamed']),
+            'total_diffs': total_diffs,
+            'legitimate': total_legitimate,
+            'issues': sum(summary['actual_issue_counts'].values()),
+            'quality_score': round(quality_score(total_legitimate, total_diffs), 2),
+        })
+    except Exception as e:
+        entry['error'] = f"{type(e).__name__}: {e}"
+    entry['seconds'] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def run_batch(batch_path: Path, output_dir: Path, jobs: int = 1, fmt: str = 'json',
+              use_cache: bool = True, incremental: bool = False, match: str = 'identity',
+              group: bool = False) -> Dict:
+    """
+    批量对比: 在同一进程 (或进程池) 中处理所有文件对
+    每组写出一份报告, 并在输出目录生成汇总索引 index.json
+    """
+    start = time.perf_counter()
+    pairs = load_batch_pairs(batch_path)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    args = (repeat(output_dir), repeat(fmt), repeat(use_cache), repeat(incremental), repeat(match), repeat(group))
+    if jobs > 1 and len(pairs) > 1:
+        rules_file = _engine.source if _engine is not None else RULES_FILE
+        with ProcessPoolExecutor(max_workers=jobs, initializer=load_rules, initargs=(rules_file,)) as executor:
+            entries = list(executor.map(run_pair, pairs, *args))
+    else:
+        entries = list(map(run_pair, pairs, *args))
+
+    index = {
+        'source': str(batch_path),
+        'pairs': entries,
+        'failed': sum(1 for entry in entries if 'error' in entry),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+    with open(output_dir / 'index.json', 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return index
+
+
+def print_batch_index(index: Dict):
+    """打印批量对比汇总"""
+    print("=" * 80)
+    print(f"批量对比汇总: 共 {len(index['pairs'])} 组, 失败 {index['failed']} 组, 耗时 {index['seconds']:.2f}s")
+    print("=" * 80)
+    print(f"{'名称':30s} {'得分':>8s} {'差异':>8s} {'需关注':>8s} {'缺失':>6s} {'新增':>6s} {'耗时':>8s}")
+    for entry in index['pairs']:
+        if 'error' in entry:
+            print(f"{entry['name']:30s} 出错: {entry['error']}")
+            continue
+        print(f"{entry['name']:30s} {entry['quality_score']:7.1f}% {entry['total_diffs']:8d} {entry['issues']:8d} "
+              f"{entry['missing']:6d} {entry['new']:6d} {entry['seconds']:7.2f}s")
+
+
 def main():
     base = Path(__file__).resolve().parent
-    before_file = base / '转换前'
-    after_file = base / '转换后'
-    
+    parser = argparse.ArgumentParser(description='节点配置对比工具')
+    parser.add_argument('--before', default=str(base / '转换前'), help='转换前文件 (默认: 脚本目录下的 转换前)')
+    parser.add_argument('--after', default=str(base / '转换后'), help='转换后文件 (默认: 脚本目录下的 转换后)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='报告路径 (默认: 脚本目录下的 comparison_report.<格式>, 流式模式为 comparison_report.jsonl)')
+    parser.add_argument('--format', choices=REPORT_FORMATS, default='json',
+                        help='报告格式: json 为原有嵌套结构, parquet/arrow 为列式差异记录 (需要 pyarrow)')
+    parser.add_argument('--batch', default=None, metavar='PATH',
+                        help='批量对比: 包含若干 转换前/转换后 子目录的目录, 或 [{name, before, after}] 形式的 YAML/JSON 清单; '
+                             '此时 -o 为报告输出目录 (默认: 脚本目录下的 batch_reports)')
+    parser.add_argument('--group-diffs', action='store_true',
+                        help='JSON 报告把完全相同的差异 (字段/节点类型/前后值) 合并为一条, 附带次数与节点列表, '
+                             '代替按节点展开的明细 (只对 json 格式生效, 流式模式下不生效)')
+    parser.add_argument('--stream', action='store_true',
+                        help='流式对比: 逐个读取 proxies 节点, 差异记录以 JSON Lines 逐条写出, 内存占用与单个节点大小相关')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量对比: 在报告旁保存节点指纹, 下次只重新对比内容有变化的节点 (流式模式下不生效)')
+    parser.add_argument('--match', choices=MATCH_MODES, default='identity',
+                        help='节点配对方式: identity 按协议身份 (类型/服务器/端口/凭据/传输路径) 配对, '
+                             '身份不唯一时退回按名称; name 只按名称配对 (默认: identity)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='并行对比使用的进程数, 批量模式下为同时处理的文件对数 (默认: 1, 流式模式下不生效)')
+    parser.add_argument('--rules', default=str(RULES_FILE), help='合法差异规则文件 (默认: 脚本目录下的 compare_rules.yaml)')
+    parser.add_argument('--self-test', action='store_true', help='校验规则引擎与原有判断逻辑的结论是否一致后退出')
+    parser.add_argument('--no-cache', action='store_true', help=f'不读写 {CACHE_DIR_NAME} 下的解析结果缓存')
+    parser.add_argument('--metrics', default=None, metavar='PATH',
+                        help='把各阶段耗时/峰值内存/单节点对比耗时直方图以 Prometheus 文本格式写入 PATH (可供 textfile collector 采集)')
+    parser.add_argument('--profile', default=None, metavar='PATH',
+                        help='使用 cProfile 分析本次运行并把 pstats 数据写入 PATH (-j 大于 1 时不包含子进程)')
+    args = parser.parse_args()
+
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run(args, base)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"\ncProfile 数据已保存到: {args.profile} (可用 python -m pstats 查看)")
+
+
+def run(args: argparse.Namespace, base: Path):
+    """按命令行参数执行一次对比"""
+    metrics = Metrics()
+
+    engine = load_rules(args.rules)
+    if args.self_test:
+        sys.exit(1 if self_test(engine) else 0)
+
+    if args.batch:
+        output_dir = Path(args.output) if args.output else base / 'batch_reports'
+        index = run_batch(Path(args.batch), output_dir, jobs=args.jobs, fmt=args.format,
+                          use_cache=not args.no_cache, incremental=args.incremental, match=args.match,
+                          group=args.group_diffs)
+        print_batch_index(index)
+        print(f"\n汇总索引已保存到: {output_dir / 'index.json'}")
+        return
+
+    before_file = Path(args.before)
+    after_file = Path(args.after)
+
     print(f"工作目录: {base}")
     if not before_file.exists() or not after_file.exists():
         print("错误: 找不到 '转换前' 或 '转换后' 文件，请确保它们在脚本同目录下。")
         return
 
-    print("正在加载文件...")
     try:
-        before = load_file(str(before_file))
-        after = load_file(str(after_file))
-        
-        print("正在进行深度对比...")
-        result = compare_nodes(before, after)
-        
-        print_report(result)
-        
-        report_file = base / 'comparison_report.json'
-        # Convert non-serializable objects if any (usually basic types handled by json)
-        with open(str(report_file), 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
-        print(f"\n详细 JSON 报告已保存到: {report_file}")
-        
+        if args.stream:
+            report_file = Path(args.output) if args.output else base / 'comparison_report.jsonl'
+            print("正在进行流式对比...")
+            result = compare_nodes_stream(str(before_file), str(after_file), str(report_file), metrics, args.match)
+            print_report(result)
+            print(f"\n详细 JSON Lines 报告已保存到: {report_file}")
+        else:
+            print("正在加载文件...")
+            with metrics.phase('load_before'):
+                before = load_file(str(before_file), use_cache=not args.no_cache)
+            with metrics.phase('load_after'):
+                after = load_file(str(after_file), use_cache=not args.no_cache)
+
+            print("正在进行深度对比...")
+            report_file = Path(args.output) if args.output else base / f'comparison_report.{args.format}'
+            state = IncrementalState(IncrementalState.path_for(report_file), engine.digest) if args.incremental else None
+            stats, table = collect_diffs(before, after, jobs=args.jobs, state=state, metrics=metrics,
+                                         match=args.match)
+            if state is not None:
+                state.save()
+
+            if args.format != 'json':
+                print_report(table.summary(stats))
+                with metrics.phase('write'):
+                    write_table(table, stats, str(report_file), args.format, metrics.to_dict())
+                print(f"\n列式差异记录 ({args.format}) 已保存到: {report_file}")
+            else:
+                with metrics.phase('report'):
+                    result = table.to_grouped_report(stats) if args.group_diffs else table.to_report(stats)
+
+                print_report(result)
+
+                # 报告中的指标不包含写出报告本身的耗时, 该阶段只出现在 Prometheus 文本与终端输出中
+                result['metrics'] = metrics.to_dict()
+                with metrics.phase('write'), open(str(report_file), 'w', encoding='utf-8') as f:
+                    json.dump(result, f, ensure_ascii=False, indent=2)
+                print(f"\n详细 JSON 报告已保存到: {report_file}")
+
+        metrics.print_summary()
+        if args.metrics:
+            metrics.write_prometheus(args.metrics)
+            print(f"Prometheus 指标已保存到: {args.metrics}")
+
     except Exception as e:
         print(f"运行出错: {e}")
         import traceback
@@ -0,0 +1,123 @@
+"""
+concurrency benchmark for the webGet cache tiers (in-memory LRU, request coalescing, disk cache).
+
+the server is started once per cache_memory_size value (0 keeps content on disk only) against the
+stand-in upstream of bench_http.py. for each one a burst of simultaneous /sub requests is sent with
+the cache flushed, showing how many upstream fetches the burst caused, then a warm phase measures
+latency with everything cached. the /cachestats counters of the server are recorded after each phase.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+import urllib.request
+
+from bench_http import (ACCESS_TOKEN, endpoint_paths, free_port, prepare_workdir, request, run_load,
+                        standin_stats, summarize, wait_ready, write_subscription)
+from standin_server import start_server
+
+
+def cache_stats(host: str, port: int) -> dict[str, int]:
+    with urllib.request.urlopen(f"http://{host}:{port}/cachestats?token={ACCESS_TOKEN}") as r:
+        return {k: int(v) for k, _, v in (line.partition("=") for line in r.read().decode().split()) if v}
+
+
+async def run_burst(host: str, port: int, path: str, total: int, timeout: float) -> tuple[list[float], int, float]:
+    """total requests sent at the same time on a flushed cache"""
+    await request(host, port, f"/flushcache?token={ACCESS_TOKEN}", timeout)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[request(host, port, path, timeout) for _ in range(total)], return_exceptions=True)
+    wall = time.perf_counter() - start
+    latencies = [r[2] for r in results if not isinstance(r, BaseException) and r[0] == 200]
+    return latencies, total - len(latencies), wall
+
+
+def bench_memory_size(args, memory_size: int, tmp: str, standin_url: str, subscription_url: str) -> dict:
+    workdir = os.path.join(tmp, f"base-{memory_size}")
+    pref = prepare_workdir(workdir, args.base_dir, standin_url, args.cache_ttl, subscription_url)
+    with open(pref, "r", encoding="utf-8") as f:
+        content = re.sub(r"(?m)^cache_memory_size = .*$", f"cache_memory_size = {memory_size}", f.read())
+    with open(pref, "w", encoding="utf-8") as f:
+        f.write(content)
+
+    host, port = "127.0.0.1", free_port()
+    env = dict(os.environ, PORT=str(port), API_MODE="false")
+    process = subprocess.Popen([os.path.abspath(args.binary), "-f", pref, "-l", os.path.join(tmp, f"subconverter-{memory_size}.log")],
+                               cwd=workdir, env=env, stdout=subprocess.DEVNULL)
+    try:
+        version = wait_ready(host, port, process, args.timeout)
+        path = endpoint_paths(subscription_url, standin_url)["sub"]
+        result = {"version": version, "cache_memory_size": memory_size}
+
+        before = standin_stats(standin_url)
+        counters = cache_stats(host, port)
+        latencies, errors, wall = asyncio.run(run_burst(host, port, path, args.burst, args.timeout))
+        result["burst"] = summarize(latencies, errors, wall, standin_stats(standin_url) - before)
+        result["burst"]["cache"] = {k: v - counters.get(k, 0) for k, v in cache_stats(host, port).items()}
+
+        before = standin_stats(standin_url)
+        counters = cache_stats(host, port)
+        latencies, errors, wall = asyncio.run(run_load(host, port, path, args.requests, args.concurrency, args.timeout))
+        result["warm"] = summarize(latencies, errors, wall, standin_stats(standin_url) - before)
+        result["warm"]["cache"] = {k: v - counters.get(k, 0) for k, v in cache_stats(host, port).items()}
+        return result
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--binary", default="./subconverter", help="subconverter executable to start")
+    parser.add_argument("--base-dir", default="base", help="base directory copied as the working directory of the server")
+    parser.add_argument("--rules-dir", default="base/rules/LM-Firefly", help="local copy of the rule repository served by the stand-in")
+    parser.add_argument("--nodes", type=int, default=200, help="nodes in the generated subscription")
+    parser.add_argument("--memory-sizes", default="0,16777216", help="comma separated cache_memory_size values to compare")
+    parser.add_argument("--burst", type=int, default=32, help="simultaneous requests on a flushed cache")
+    parser.add_argument("-c", "--concurrency", type=int, default=32, help="concurrent connections of the warm phase")
+    parser.add_argument("-n", "--requests", type=int, default=500, help="requests in the warm phase")
+    parser.add_argument("--cache-ttl", type=int, default=3600, help="cache_subscription/config/ruleset written to the pref")
+    parser.add_argument("--upstream-delay", type=float, default=0.2, help="seconds the stand-in waits before answering")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("-o", "--output", default="bench_fetch_cache.json", help="where to write the results")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
+
+    tmp = tempfile.mkdtemp(prefix="subconverter-cache-bench-")
+    subscription = os.path.join(tmp, "subscription.txt")
+    write_subscription(subscription, args.nodes)
+    standin = start_server({"/rules": args.rules_dir, "/sub": tmp}, delay=args.upstream_delay)
+    standin_url = f"http://127.0.0.1:{standin.server_port}"
+    subscription_url = f"{standin_url}/sub/{os.path.basename(subscription)}"
+
+    results = {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+               "settings": {k: getattr(args, k) for k in ("burst", "concurrency", "requests", "cache_ttl", "upstream_delay", "nodes")},
+               "runs": []}
+    try:
+        for memory_size in [int(v) for v in args.memory_sizes.split(",") if v.strip()]:
+            run = bench_memory_size(args, memory_size, tmp, standin_url, subscription_url)
+            results["runs"].append(run)
+            for phase in ("burst", "warm"):
+                s = run[phase]
+                logging.info(f"cache_memory_size={memory_size:<10} {phase:<5} {s['requests']} requests, {s['upstream_fetches']} upstream fetches, "
+                             f"p50 {s['p50_ms']}ms, p95 {s['p95_ms']}ms, {s['throughput_rps']} rps, {s['errors']} errors, cache {s['cache']}")
+    finally:
+        standin.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+HTTP load and latency benchmark for the subconverter endpoints (/sub, /getruleset, /getprofile, /render).
+
+a copy of base/ is started with a locally built subconverter binary, its rulesets and subscriptions
+pointed at a stand-in server (standin_server.py) instead of the network. every endpoint is measured
+twice: cold, with the webGet disk cache flushed before each request (sequential), and warm, with the
+cache primed and requests sent at the configured concurrency. results are written as json and can be
+compared with an earlier run to flag regressions.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from urllib.parse import quote
+
+from standin_server import start_server
+
+RULES_URL_PREFIX = "https://raw.githubusercontent.com/LM-Firefly/Rules/master/"
+ACCESS_TOKEN = "bench"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_subscription(path: str, nodes: int):
+    """a base64 subscription of nodes shadowsocks nodes, used when no --subscription is given"""
+    lines = []
+    for i in range(nodes):
+        userinfo = base64.urlsafe_b64encode(f"aes-128-gcm:bench-{i}".encode()).decode().rstrip("=")
+        lines.append(f"ss://{userinfo}@198.18.{i // 250 % 250}.{i % 250 + 1}:{8000 + i % 1000}#{quote(f'HK {i:05d}')}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(base64.b64encode("\n".join(lines).encode()).decode())
+
+
+def prepare_workdir(workdir: str, base_dir: str, standin_url: str, cache_ttl: int, subscription_url: str) -> str:
+    """copy base/ into workdir, enable the disk cache and route all ruleset fetches to the stand-in"""
+    shutil.copytree(base_dir, workdir, dirs_exist_ok=True)
+    with open(os.path.join(base_dir, "pref.example.toml"), "r", encoding="utf-8") as f:
+        pref = f.read()
+    replacements = {
+        r'(?m)^api_access_token = .*$': f'api_access_token = "{ACCESS_TOKEN}"',
+        r'(?m)^enable_cache = .*$': "enable_cache = true",
+        r'(?m)^cache_subscription = .*$': f"cache_subscription = {cache_ttl}",
+        r'(?m)^cache_config = .*$': f"cache_config = {cache_ttl}",
+        r'(?m)^cache_ruleset = .*$': f"cache_ruleset = {cache_ttl}",
+        r'(?m)^log_level = .*$': 'log_level = "warn"',
+    }
+    for pattern, value in replacements.items():
+        pref = re.sub(pattern, value, pref)
+    pref = pref.replace(RULES_URL_PREFIX, standin_url + "/rules/")
+    with open(os.path.join(workdir, "pref.toml"), "w", encoding="utf-8") as f:
+        f.write(pref)
+    os.makedirs(os.path.join(workdir, "profiles"), exist_ok=True)
+    with open(os.path.join(workdir, "profiles", "bench.ini"), "w", encoding="utf-8") as f:
+        f.write(f"[Profile]\ntarget=clash\nurl={subscription_url}\nprofile_token={ACCESS_TOKEN}\n")
+    shutil.rmtree(os.path.join(workdir, "cache"), ignore_errors=True)
+    return os.path.join(workdir, "pref.toml")
+
+
+def endpoint_paths(subscription_url: str, standin_url: str) -> dict[str, str]:
+    ruleset = base64.urlsafe_b64encode(f"{standin_url}/rules/PROXY.list".encode()).decode()
+    return {
+        "sub": f"/sub?target=clash&url={quote(subscription_url, safe='')}",
+        "getruleset": f"/getruleset?type=6&url={ruleset}",
+        "getprofile": f"/getprofile?name=profiles/bench.ini&token={ACCESS_TOKEN}",
+        "render": "/render?path=base/all-base.tpl&clash.dns=1",
+    }
+
+
+async def request(host: str, port: int, path: str, timeout: float) -> tuple[int, int, float]:
+    """one GET on a fresh connection, returns (status, body bytes, seconds)"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    status_line, _, rest = data.partition(b"\r\n")
+    parts = status_line.split()
+    status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+    return status, len(rest.partition(b"\r\n\r\n")[2]), elapsed
+
+
+async def run_load(host: str, port: int, path: str, total: int, concurrency: int, timeout: float) -> tuple[list[float], int, float]:
+    """total requests from concurrency workers, returns (latencies of the successful ones, errors, wall seconds)"""
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            try:
+                status, _, elapsed = await request(host, port, path, timeout)
+            except (OSError, asyncio.TimeoutError):
+                errors += 1
+                continue
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(max(1, min(concurrency, total)))])
+    return latencies, errors, time.perf_counter() - start
+
+
+async def run_cold(host: str, port: int, path: str, total: int, timeout: float) -> tuple[list[float], int, float]:
+    """sequential requests, each after flushing the disk cache"""
+    latencies = []
+    errors = 0
+    wall = 0.0
+    for _ in range(total):
+        await request(host, port, f"/flushcache?token={ACCESS_TOKEN}", timeout)
+        try:
+            status, _, elapsed = await request(host, port, path, timeout)
+        except (OSError, asyncio.TimeoutError):
+            errors += 1
+            continue
+        wall += elapsed
+        if status == 200:
+            latencies.append(elapsed)
+        else:
+            errors += 1
+    return latencies, errors, wall
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(latencies: list[float], errors: int, wall: float, upstream: int) -> dict:
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(max(latencies) if latencies else None),
+        "upstream_fetches": upstream,
+    }
+
+
+def standin_stats(standin_url: str) -> int:
+    with urllib.request.urlopen(standin_url + "/__stats") as r:
+        return sum(json.load(r).values())
+
+
+def wait_ready(host: str, port: int, process: subprocess.Popen | None, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"subconverter exited with {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://{host}:{port}/version", timeout=1) as r:
+                return r.read().decode().strip()
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"subconverter did not answer on {host}:{port} within {timeout}s")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """regressions of p95 latency or throughput beyond threshold (a ratio) against a previous run"""
+    regressions = []
+    for endpoint, phases in results["endpoints"].items():
+        for phase, current in phases.items():
+            previous = baseline.get("endpoints", {}).get(endpoint, {}).get(phase)
+            if not previous:
+                continue
+            if previous.get("p95_ms") and current.get("p95_ms") and current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+                regressions.append(f"{endpoint} {phase}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+            if previous.get("throughput_rps") and current.get("throughput_rps") and \
+                    current["throughput_rps"] < previous["throughput_rps"] * (1 - threshold):
+                regressions.append(f"{endpoint} {phase}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} rps")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--binary", default="./subconverter", help="subconverter executable to start")
+    parser.add_argument("--url", default=None, help="benchmark an already running instance (e.g. http://127.0.0.1:25500) instead; "
+                                                    "it must have been set up with the same pref rewrites")
+    parser.add_argument("--base-dir", default="base", help="base directory copied as the working directory of the server")
+    parser.add_argument("--rules-dir", default="base/rules/LM-Firefly", help="local copy of the rule repository served by the stand-in")
+    parser.add_argument("--subscription", default=None, help="subscription file served by the stand-in, a generated one by default")
+    parser.add_argument("--nodes", type=int, default=200, help="nodes in the generated subscription")
+    parser.add_argument("--endpoints", default="sub,getruleset,getprofile,render", help="comma separated endpoints to run")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="concurrent connections of the warm phase")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="requests per endpoint in the warm phase")
+    parser.add_argument("--cold-requests", type=int, default=10, help="requests per endpoint in the cold phase, 0 to skip it")
+    parser.add_argument("--cache-ttl", type=int, default=3600, help="cache_subscription/config/ruleset written to the pref")
+    parser.add_argument("--upstream-delay", type=float, default=0.0, help="seconds the stand-in waits before answering")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("-o", "--output", default="bench_http.json", help="where to write the results")
+    parser.add_argument("--baseline", default=None, help="results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative p95/throughput change reported as a regression")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
+
+    tmp = tempfile.mkdtemp(prefix="subconverter-bench-")
+    subscription = args.subscription
+    if subscription is None:
+        subscription = os.path.join(tmp, "subscription.txt")
+        write_subscription(subscription, args.nodes)
+    standin = start_server({"/rules": args.rules_dir, "/sub": os.path.dirname(os.path.abspath(subscription))}, delay=args.upstream_delay)
+    standin_url = f"http://127.0.0.1:{standin.server_port}"
+    subscription_url = f"{standin_url}/sub/{os.path.basename(subscription)}"
+
+    process = None
+    try:
+        if args.url:
+            host, _, port = args.url.split("://", 1)[-1].rstrip("/").partition(":")
+            port = int(port or 80)
+        else:
+            workdir = os.path.join(tmp, "base")
+            pref = prepare_workdir(workdir, args.base_dir, standin_url, args.cache_ttl, subscription_url)
+            host, port = "127.0.0.1", free_port()
+            env = dict(os.environ, PORT=str(port), API_MODE="false")
+            process = subprocess.Popen([os.path.abspath(args.binary), "-f", pref, "-l", os.path.join(tmp, "subconverter.log")],
+                                       cwd=workdir, env=env, stdout=subprocess.DEVNULL)
+        version = wait_ready(host, port, process, args.timeout)
+        logging.info(f"benchmarking {version} at {host}:{port}, stand-in at {standin_url}")
+
+        paths = endpoint_paths(subscription_url, standin_url)
+        results = {"version": version, "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                   "settings": {k: getattr(args, k) for k in ("concurrency", "requests", "cold_requests", "cache_ttl", "upstream_delay", "nodes")},
+                   "endpoints": {}}
+        for endpoint in [e.strip() for e in args.endpoints.split(",") if e.strip()]:
+            path = paths[endpoint]
+            phases = {}
+            if args.cold_requests:
+                before = standin_stats(standin_url)
+                latencies, errors, wall = asyncio.run(run_cold(host, port, path, args.cold_requests, args.timeout))
+                phases["cold"] = summarize(latencies, errors, wall, standin_stats(standin_url) - before)
+            asyncio.run(request(host, port, path, args.timeout))  # prime the cache
+            before = standin_stats(standin_url)
+            latencies, errors, wall = asyncio.run(run_load(host, port, path, args.requests, args.concurrency, args.timeout))
+            phases["warm"] = summarize(latencies, errors, wall, standin_stats(standin_url) - before)
+            results["endpoints"][endpoint] = phases
+            for phase, s in phases.items():
+                logging.info(f"{endpoint:<10} {phase:<4} {s['throughput_rps']} rps, p50 {s['p50_ms']}ms, p95 {s['p95_ms']}ms, "
+                             f"p99 {s['p99_ms']}ms, {s['errors']} errors, {s['upstream_fetches']} upstream fetches")
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        standin.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for r in regressions:
+            logging.warning(f"regression: {r}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
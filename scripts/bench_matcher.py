@@ -0,0 +1,148 @@
+"""
+micro-benchmark for the node rename/emoji matching: first-match over a rule table with synthetic node names.
+
+two strategies are compared on the same names and rules, both with PCRE2 (the pcre2 bindings from PyPI),
+the engine RegexMatcher uses:
+  per-call   every rule compiled again, without JIT, for every name, the way regFind/regReplace do
+  compiled   every rule compiled and JIT compiled once, names walk the table in order until the first hit
+
+the rules come from the emoji (regex,emoji) and rename (match@replace) snippets. rules PCRE2 can not
+compile are left out of both. both strategies must report the same first matching rule for every name,
+renames are followed like nodeRename does, by asking for the next matching rule after the last one.
+"""
+import argparse
+import json
+import logging
+import random
+import time
+
+import pcre2
+
+from gen_subscription import REGIONS
+
+
+def read_rules(path: str, separator: str, commented: bool = False) -> list[str]:
+    """patterns of the rules in path, with commented a ';' rule like ';上海@沪' is read as well"""
+    patterns = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f.read().splitlines():
+            if commented and line.startswith(";") and separator in line:
+                line = line[1:]
+            if not line.strip() or line.startswith((";", "#", "//")):
+                continue
+            pattern = line.rpartition(separator)[0] if separator in line else line
+            try:
+                pcre2.compile(pattern, pcre2.MULTILINE, jit=False)
+            except pcre2.error as e:
+                logging.warning(f"skipping {pattern!r} from {path}: {e}")
+                continue
+            patterns.append(pattern)
+    return patterns
+
+
+def generate_names(count: int, seed: int, miss_ratio: float) -> list[str]:
+    rng = random.Random(seed)
+    names = []
+    for index in range(count):
+        if rng.random() < miss_ratio:
+            names.append(f"node-{rng.getrandbits(32):08x} {index}")
+            continue
+        flag, code, region = rng.choice(REGIONS)
+        style = rng.randrange(4)
+        if style == 0:
+            name = f"{region} {index:02d}"
+        elif style == 1:
+            name = f"{code}-{rng.choice(('IPLC', 'IEPL', 'BGP', 'CN2'))}-{index:02d} | {rng.choice((0.5, 1, 1.5, 2))}x"
+        elif style == 2:
+            name = f"{flag} {region} {rng.choice(('专线', '中转', '直连'))} {index}"
+        else:
+            name = f"{code} {index} (倍率 {rng.choice((0.8, 1, 2))})"
+        names.append(name)
+    return names
+
+
+class PerCallMatcher:
+    def __init__(self, patterns: list[str]):
+        self.patterns = patterns
+
+    def first(self, name: str, start: int = 0) -> int:
+        for i in range(start, len(self.patterns)):
+            if pcre2.compile(self.patterns[i], pcre2.MULTILINE, jit=False).search(name):
+                return i
+        return -1
+
+
+class CompiledMatcher:
+    def __init__(self, patterns: list[str]):
+        self.regexes = [pcre2.compile(p, pcre2.MULTILINE, jit=True) for p in patterns]
+
+    def first(self, name: str, start: int = 0) -> int:
+        for i in range(start, len(self.regexes)):
+            if self.regexes[i].search(name):
+                return i
+        return -1
+
+
+def all_matches(matcher, name: str) -> list[int]:
+    found = []
+    i = matcher.first(name)
+    while i >= 0:
+        found.append(i)
+        i = matcher.first(name, i + 1)
+    return found
+
+
+def run(matcher, names: list[str], every: bool) -> tuple[list, float]:
+    start = time.perf_counter()
+    if every:
+        results = [all_matches(matcher, n) for n in names]
+    else:
+        results = [matcher.first(n) for n in names]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--emoji", default="base/snippets/emoji.txt", help="emoji rules, one regex,emoji per line")
+    parser.add_argument("--rename", default="base/snippets/rename_node.txt", help="rename rules, one match@replace per line")
+    parser.add_argument("--commented", action="store_true",
+                        help="also use rules commented out with ';', the rename snippet has only one active rule")
+    parser.add_argument("-n", "--count", type=int, default=20000, help="synthetic node names")
+    parser.add_argument("--miss-ratio", type=float, default=0.1, help="share of names matching no region")
+    parser.add_argument("--per-call-sample", type=int, default=1000,
+                        help="names also run through the per-call strategy, which is slow, to time and cross check it")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("-o", "--output", default=None, help="write the results as json")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
+
+    names = generate_names(args.count, args.seed, args.miss_ratio)
+    sample = names[:args.per_call_sample]
+    results = {"names": len(names), "per_call_sample": len(sample), "tables": {}}
+    mismatches = 0
+    for table, path, separator, every in (("emoji", args.emoji, ",", False), ("rename", args.rename, "@", True)):
+        patterns = read_rules(path, separator, args.commented)
+        if not patterns:
+            logging.warning(f"no usable rules in {path}")
+            continue
+        compiled, compiled_time = run(CompiledMatcher(patterns), names, every)
+        per_call, per_call_time = run(PerCallMatcher(patterns), sample, every)
+        differ = sum(a != b for a, b in zip(per_call, compiled))
+        mismatches += differ
+
+        rates = {"per_call": len(sample) / per_call_time, "compiled": len(names) / compiled_time}
+        results["tables"][table] = {"rules": len(patterns), "names_per_second": {k: round(v) for k, v in rates.items()},
+                                    "unmatched": sum(not r if every else r < 0 for r in compiled), "mismatches": differ}
+        logging.info(f"{table:<6} {len(patterns)} rules: per-call {rates['per_call']:.0f}, compiled {rates['compiled']:.0f} names/s, "
+                     f"speedup {rates['compiled'] / rates['per_call']:.1f}x, {differ} mismatches")
+
+    if mismatches:
+        logging.error(f"{mismatches} names got a different first match between strategies")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        logging.info(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
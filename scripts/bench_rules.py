@@ -0,0 +1,359 @@
+"""
+replay a domain/IP query log against rule lists in their configured order and measure first-match cost.
+
+rules are loaded into an indexed matcher (reversed-label suffix trie, Aho-Corasick automaton for keywords,
+sorted interval table for CIDRs) and compared with the naive linear first-match scan clients do:
+lookups per second for both, which list every query ends in and how many rules the linear scan
+walks before the first hit.
+
+a query log has one query per line: a domain, an IP address or 'process:<name>'. domain queries only
+match domain rules, no DNS resolution is simulated for IP rules.
+"""
+import argparse
+import bisect
+import ipaddress
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+
+from optimize_rules import DEFAULT_MAPS, resolve_path, ruleset_paths_from_config
+from rulelist import CIDR_TYPES, parse_network, read_rules
+
+
+class SuffixTrie:
+    """reversed-label trie, every node keeps the first position of a DOMAIN-SUFFIX ending there"""
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, domain: str, pos: int):
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, {})
+        if pos < node.get(None, pos + 1):
+            node[None] = pos
+
+    def first(self, domain: str) -> int | None:
+        best = None
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            pos = node.get(None)
+            if pos is not None and (best is None or pos < best):
+                best = pos
+        return best
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over DOMAIN-KEYWORD values, states report the first position of any keyword ending there"""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.output = [None]
+        self.fail = [0]
+
+    def add(self, keyword: str, pos: int):
+        state = 0
+        for c in keyword:
+            nxt = self.goto[state].get(c)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][c] = nxt
+                self.goto.append({})
+                self.output.append(None)
+                self.fail.append(0)
+            state = nxt
+        if self.output[state] is None or pos < self.output[state]:
+            self.output[state] = pos
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(c, 0)
+                inherited = self.output[self.fail[nxt]]
+                if inherited is not None and (self.output[nxt] is None or inherited < self.output[nxt]):
+                    self.output[nxt] = inherited
+
+    def first(self, text: str) -> int | None:
+        if len(self.goto) == 1:
+            return None
+        best = None
+        state = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for c in text:
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            pos = output[state]
+            if pos is not None and (best is None or pos < best):
+                best = pos
+        return best
+
+
+class IntervalTable:
+    """
+    CIDRs flattened into sorted disjoint segments, each holding the first position of a CIDR covering it.
+    any two CIDRs are nested or disjoint, so one sweep with a stack is enough.
+    """
+
+    def __init__(self):
+        self.items = {4: [], 6: []}
+        self.starts = {4: [], 6: []}
+        self.positions = {4: [], 6: []}
+
+    def add(self, network, pos: int):
+        self.items[network.version].append((int(network.network_address), int(network.broadcast_address), pos))
+
+    def build(self):
+        for version, items in self.items.items():
+            starts, positions = [], []
+
+            def emit(start, pos):
+                if starts and starts[-1] == start:
+                    positions[-1] = pos
+                elif not positions or positions[-1] != pos:
+                    starts.append(start)
+                    positions.append(pos)
+
+            stack = []
+            for start, end, pos in sorted(items, key=lambda i: (i[0], -i[1], i[2])):
+                while stack and stack[-1][0] < start:
+                    ended = stack.pop()[0]
+                    emit(ended + 1, stack[-1][1] if stack else None)
+                pos = min(pos, stack[-1][1]) if stack else pos
+                stack.append((end, pos))
+                emit(start, pos)
+            while stack:
+                ended = stack.pop()[0]
+                emit(ended + 1, stack[-1][1] if stack else None)
+            self.starts[version], self.positions[version] = starts, positions
+        self.items = {4: [], 6: []}
+
+    def first(self, address) -> int | None:
+        i = bisect.bisect_right(self.starts[address.version], int(address)) - 1
+        return self.positions[address.version][i] if i >= 0 else None
+
+
+class Matcher:
+    """first-match lookup over every rule of every list, positions count rules in match order"""
+
+    def __init__(self, rules: list):
+        self.exact = {}
+        self.processes = {}
+        self.suffixes = SuffixTrie()
+        self.keywords = KeywordAutomaton()
+        self.networks = IntervalTable()
+        for pos, (rule_type, value, network) in enumerate(rules):
+            if rule_type == "DOMAIN":
+                self.exact.setdefault(value, pos)
+            elif rule_type == "DOMAIN-SUFFIX":
+                self.suffixes.add(value, pos)
+            elif rule_type == "DOMAIN-KEYWORD":
+                self.keywords.add(value, pos)
+            elif rule_type == "PROCESS-NAME":
+                self.processes.setdefault(value, pos)
+            elif network is not None:
+                self.networks.add(network, pos)
+        self.keywords.build()
+        self.networks.build()
+
+    def lookup(self, query) -> int | None:
+        if isinstance(query, tuple):
+            return self.processes.get(query[1])
+        if not isinstance(query, str):
+            return self.networks.first(query)
+        candidates = [p for p in (self.exact.get(query), self.suffixes.first(query), self.keywords.first(query)) if p is not None]
+        return min(candidates) if candidates else None
+
+
+def linear_lookup(rules: list, query) -> int | None:
+    """the naive scan: walk the rules in order and stop at the first one matching"""
+    if isinstance(query, tuple):
+        for pos, (rule_type, value, _) in enumerate(rules):
+            if rule_type == "PROCESS-NAME" and value == query[1]:
+                return pos
+        return None
+    if not isinstance(query, str):
+        for pos, (_, _, network) in enumerate(rules):
+            if network is not None and network.version == query.version and query in network:
+                return pos
+        return None
+    for pos, (rule_type, value, _) in enumerate(rules):
+        if rule_type == "DOMAIN":
+            if query == value:
+                return pos
+        elif rule_type == "DOMAIN-SUFFIX":
+            if query == value or query.endswith("." + value):
+                return pos
+        elif rule_type == "DOMAIN-KEYWORD":
+            if value in query:
+                return pos
+    return None
+
+
+def load_lists(paths: list[str]) -> tuple[list, list[str], list[int]]:
+    """all rules in match order as (type, value, network), the list names and the first position of every list"""
+    rules, names, offsets = [], [], []
+    for path in paths:
+        offsets.append(len(rules))
+        names.append(path)
+        for rule in read_rules(path):
+            network = parse_network(rule.value) if rule.type in CIDR_TYPES else None
+            value = rule.value.lower().strip(".") if rule.type.startswith("DOMAIN") else rule.value
+            rules.append((rule.type, value, network))
+    return rules, names, offsets
+
+
+def parse_query(line: str):
+    line = line.strip()
+    if line.startswith("process:"):
+        return ("process", line[len("process:"):])
+    try:
+        return ipaddress.ip_address(line)
+    except ValueError:
+        return line.lower().rstrip(".")
+
+
+def generate_queries(rules: list, count: int, miss_ratio: float, seed: int) -> list[str]:
+    """a seeded query log drawn from the rules themselves, with miss_ratio of queries matching nothing"""
+    rng = random.Random(seed)
+    domains = [(t, v) for t, v, _ in rules if t in ("DOMAIN", "DOMAIN-SUFFIX")]
+    networks = [n for _, _, n in rules if n is not None]
+    queries = []
+    for _ in range(count):
+        if rng.random() < miss_ratio:
+            if rng.random() < 0.5:
+                queries.append(f"miss-{rng.getrandbits(32):08x}.example-nomatch.invalid")
+            else:
+                queries.append(str(ipaddress.IPv4Address(rng.getrandbits(32))))
+        elif networks and rng.random() < 0.3:
+            network = rng.choice(networks)
+            queries.append(str(network[rng.randrange(network.num_addresses)] if network.num_addresses < 1 << 16
+                               else network.network_address + rng.getrandbits(16)))
+        elif domains:
+            rule_type, value = rng.choice(domains)
+            queries.append(f"s{rng.randrange(1000)}.{value}" if rule_type == "DOMAIN-SUFFIX" and rng.random() < 0.7 else value)
+    return queries
+
+
+def percentile(values: list[int], p: float) -> int:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("lists", nargs="*", help="rule lists in match order, used when no --config is given")
+    parser.add_argument("-c", "--config", default=None, help="pref or external config (toml/ini) giving the ruleset order")
+    parser.add_argument("--base-dir", default="base", help="directory relative ruleset paths of the config are resolved against")
+    parser.add_argument("--map", action="append", default=None, metavar="URL_PREFIX=DIR",
+                        help=f"read rulesets under URL_PREFIX from DIR (default {DEFAULT_MAPS[0]})")
+    parser.add_argument("-q", "--queries", default=None, help="query log to replay, a synthetic one is generated otherwise")
+    parser.add_argument("-n", "--count", type=int, default=100000, help="number of synthetic queries")
+    parser.add_argument("--miss-ratio", type=float, default=0.2, help="share of synthetic queries matching no rule")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-queries", default=None, help="write the synthetic query log here")
+    parser.add_argument("--naive-sample", type=int, default=2000,
+                        help="queries also run through the linear scan, which is slow, to time and cross check it")
+    parser.add_argument("-o", "--output", default=None, help="write the results as json")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
+
+    if args.config:
+        maps = [tuple(m.split("=", 1)) for m in (args.map or DEFAULT_MAPS)]
+        paths = []
+        for location in ruleset_paths_from_config(args.config):
+            path = resolve_path(location, maps, args.base_dir)
+            if path is None or not os.path.isfile(path):
+                logging.warning(f"skipping {location}, no local copy")
+            elif path not in paths:
+                paths.append(path)
+    else:
+        paths = args.lists
+
+    start = time.perf_counter()
+    rules, names, offsets = load_lists(paths)
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    matcher = Matcher(rules)
+    build_time = time.perf_counter() - start
+    logging.info(f"loaded {len(rules)} rules from {len(names)} lists in {load_time:.2f}s, index built in {build_time:.2f}s")
+
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            lines = [line for line in f.read().splitlines() if line.strip()]
+    else:
+        lines = generate_queries(rules, args.count, args.miss_ratio, args.seed)
+        if args.save_queries:
+            with open(args.save_queries, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+    queries = [parse_query(line) for line in lines]
+
+    start = time.perf_counter()
+    results = [matcher.lookup(q) for q in queries]
+    indexed_time = time.perf_counter() - start
+
+    sample = queries[:args.naive_sample]
+    start = time.perf_counter()
+    naive_results = [linear_lookup(rules, q) for q in sample]
+    naive_time = time.perf_counter() - start
+    mismatches = sum(a != b for a, b in zip(naive_results, results))
+    if mismatches:
+        logging.error(f"{mismatches} of {len(sample)} queries differ between the indexed matcher and the linear scan")
+
+    hits = [0] * len(names)
+    scanned = []
+    for pos in results:
+        if pos is None:
+            scanned.append(len(rules))
+            continue
+        hits[bisect.bisect_right(offsets, pos) - 1] += 1
+        scanned.append(pos + 1)
+    misses = results.count(None)
+
+    report = {
+        "rules": len(rules),
+        "lists": len(names),
+        "queries": len(queries),
+        "misses": misses,
+        "load_seconds": round(load_time, 4),
+        "build_seconds": round(build_time, 4),
+        "indexed": {"seconds": round(indexed_time, 4), "lookups_per_second": round(len(queries) / indexed_time) if indexed_time else None},
+        "linear": {"queries": len(sample), "seconds": round(naive_time, 4),
+                   "lookups_per_second": round(len(sample) / naive_time) if naive_time else None, "mismatches": mismatches},
+        "rules_scanned": {"mean": round(sum(scanned) / len(scanned), 1) if scanned else 0,
+                          "p50": percentile(scanned, 50), "p95": percentile(scanned, 95), "p99": percentile(scanned, 99)},
+        "hits": [{"list": name, "position": offsets[i], "rules": (offsets[i + 1] if i + 1 < len(offsets) else len(rules)) - offsets[i],
+                  "hits": hits[i]} for i, name in enumerate(names)],
+    }
+
+    print(f"{len(rules)} rules in {len(names)} lists, {len(queries)} queries, {misses} misses")
+    print(f"indexed: {report['indexed']['lookups_per_second']} lookups/s, "
+          f"linear: {report['linear']['lookups_per_second']} lookups/s over {len(sample)} queries")
+    print(f"rules scanned before the first hit: mean {report['rules_scanned']['mean']}, p50 {report['rules_scanned']['p50']}, "
+          f"p95 {report['rules_scanned']['p95']}, p99 {report['rules_scanned']['p99']}")
+    width = max([len(n) for n in names] + [4])
+    print(f"{'list':<{width}} {'position':>9} {'rules':>7} {'hits':>8}")
+    for item in report["hits"]:
+        if item["hits"]:
+            print(f"{item['list']:<{width}} {item['position']:>9} {item['rules']:>7} {item['hits']:>8}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
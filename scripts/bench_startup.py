@@ -0,0 +1,144 @@
+"""
+startup benchmark: time-to-first-response of a freshly started server with and without the warm start snapshot.
+
+a copy of base/ has its rulesets pointed at the stand-in of bench_http.py, which answers after
+--upstream-delay like a remote host would. a priming start writes the snapshot (--snapshot), then
+every round starts the server twice on an empty webGet cache, as a new pod would: once without the
+snapshot and once with it. for each start the time until /version answers, the time until the first
+/sub request returned and the upstream fetches the start caused are recorded.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import urllib.request
+
+from bench_http import endpoint_paths, free_port, prepare_workdir, standin_stats, write_subscription
+from standin_server import start_server
+
+
+def start(args, workdir: str, pref: str, log: str, snapshot: str | None) -> tuple[subprocess.Popen, str, int]:
+    shutil.rmtree(os.path.join(workdir, "cache"), ignore_errors=True)
+    port = free_port()
+    command = [os.path.abspath(args.binary), "-f", pref, "-l", log]
+    if snapshot:
+        command += ["--snapshot", snapshot]
+    env = dict(os.environ, PORT=str(port), API_MODE="false")
+    env.pop("WARM_START_SNAPSHOT", None)
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL), "127.0.0.1", port
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def poll(url: str, process: subprocess.Popen, deadline: float) -> bytes:
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"subconverter exited with {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=max(deadline - time.monotonic(), 0.1)) as r:
+                return r.read()
+        except OSError:
+            time.sleep(0.01)
+    raise RuntimeError(f"no answer from {url} within the timeout")
+
+
+def measure(args, workdir: str, pref: str, log: str, snapshot: str | None, path: str, standin_url: str) -> dict:
+    before = standin_stats(standin_url)
+    spawned = time.monotonic()
+    process, host, port = start(args, workdir, pref, log, snapshot)
+    try:
+        deadline = spawned + args.timeout
+        poll(f"http://{host}:{port}/version", process, deadline)
+        ready = time.monotonic()
+        body = poll(f"http://{host}:{port}{path}", process, deadline)
+        first = time.monotonic()
+    finally:
+        stop(process)
+    return {"ready_ms": round((ready - spawned) * 1000, 3), "first_response_ms": round((first - spawned) * 1000, 3),
+            "first_response_bytes": len(body), "upstream_fetches": standin_stats(standin_url) - before}
+
+
+def wait_snapshot(path: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.isfile(path) and os.path.getsize(path):
+            return
+        time.sleep(0.1)
+    raise RuntimeError(f"no snapshot written to {path} within {timeout}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--binary", default="./subconverter", help="subconverter executable to start")
+    parser.add_argument("--base-dir", default="base", help="base directory copied as the working directory of the server")
+    parser.add_argument("--rules-dir", default="base/rules/LM-Firefly", help="local copy of the rule repository served by the stand-in")
+    parser.add_argument("--nodes", type=int, default=200, help="nodes in the generated subscription")
+    parser.add_argument("-r", "--rounds", type=int, default=5, help="starts measured in each mode")
+    parser.add_argument("--cache-ttl", type=int, default=3600, help="cache_subscription/config/ruleset written to the pref")
+    parser.add_argument("--upstream-delay", type=float, default=0.2, help="seconds the stand-in waits before answering")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("-o", "--output", default="bench_startup.json", help="where to write the results")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
+
+    tmp = tempfile.mkdtemp(prefix="subconverter-startup-bench-")
+    subscription = os.path.join(tmp, "subscription.txt")
+    write_subscription(subscription, args.nodes)
+    standin = start_server({"/rules": args.rules_dir, "/sub": tmp}, delay=args.upstream_delay)
+    standin_url = f"http://127.0.0.1:{standin.server_port}"
+    subscription_url = f"{standin_url}/sub/{os.path.basename(subscription)}"
+
+    workdir = os.path.join(tmp, "base")
+    pref = prepare_workdir(workdir, args.base_dir, standin_url, args.cache_ttl, subscription_url)
+    snapshot = os.path.join(tmp, "snapshot.json")
+    log = os.path.join(tmp, "subconverter.log")
+    path = endpoint_paths(subscription_url, standin_url)["sub"]
+
+    results = {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+               "settings": {k: getattr(args, k) for k in ("rounds", "cache_ttl", "upstream_delay", "nodes")},
+               "modes": {"cold": [], "snapshot": []}}
+    try:
+        process, _, _ = start(args, workdir, pref, log, snapshot)
+        try:
+            wait_snapshot(snapshot, args.timeout)
+        finally:
+            stop(process)
+        results["snapshot_bytes"] = os.path.getsize(snapshot)
+        logging.info(f"snapshot of {results['snapshot_bytes']} bytes written")
+
+        for i in range(args.rounds):
+            for mode in ("cold", "snapshot"):
+                run = measure(args, workdir, pref, log, snapshot if mode == "snapshot" else None, path, standin_url)
+                results["modes"][mode].append(run)
+                logging.info(f"round {i + 1} {mode:<8} ready {run['ready_ms']}ms, first response {run['first_response_ms']}ms, "
+                             f"{run['upstream_fetches']} upstream fetches")
+    finally:
+        standin.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for mode, runs in results["modes"].items():
+        if not runs:
+            continue
+        summary = {k: round(statistics.median(r[k] for r in runs), 3) for k in ("ready_ms", "first_response_ms", "upstream_fetches")}
+        results[f"{mode}_median"] = summary
+        logging.info(f"{mode:<8} median: ready {summary['ready_ms']}ms, first response {summary['first_response_ms']}ms, "
+                     f"{summary['upstream_fetches']} upstream fetches")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
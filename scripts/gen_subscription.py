@@ -0,0 +1,346 @@
+"""
+generate seeded synthetic subscriptions for scaling tests: N nodes with a configurable mix of protocols,
+transports and name patterns (emoji flags, duplicate names), written as a base64 URI list, Clash YAML
+and sing-box JSON in a single streaming pass, so 1M node inputs stay cheap.
+
+the same seed always produces the same files. --pair writes a 转换前/转换后 pair for compare_nodes.py,
+--serve serves the output directory through standin_server.py.
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import threading
+import uuid
+from urllib.parse import quote, urlencode
+
+PROTOCOLS = ("ss", "ssr", "vmess", "vless", "trojan", "hysteria2", "tuic")
+TRANSPORTS = ("tcp", "ws", "grpc", "h2")
+# transports each protocol can be generated with, the rest always use tcp/udp
+PROTOCOL_TRANSPORTS = {"vmess": TRANSPORTS, "vless": TRANSPORTS, "trojan": ("tcp", "ws", "grpc")}
+REGIONS = [
+    ("🇭🇰", "HK", "香港"), ("🇯🇵", "JP", "日本"), ("🇺🇸", "US", "美国"), ("🇸🇬", "SG", "新加坡"),
+    ("🇹🇼", "TW", "台湾"), ("🇰🇷", "KR", "韩国"), ("🇬🇧", "UK", "英国"), ("🇩🇪", "DE", "德国"),
+]
+SS_CIPHERS = ("aes-128-gcm", "aes-256-gcm", "chacha20-ietf-poly1305", "2022-blake3-aes-128-gcm")
+FINGERPRINTS = ("chrome", "firefox", "safari", "edge")
+
+
+def parse_weights(spec: str, allowed: tuple[str, ...]) -> dict[str, float]:
+    """'ss=3,vmess=1' -> {'ss': 3.0, 'vmess': 1.0}"""
+    weights = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        key, _, value = item.partition("=")
+        key = key.strip()
+        if key not in allowed:
+            raise ValueError(f"unknown value {key}, expected one of {', '.join(allowed)}")
+        weights[key] = float(value or 1)
+    return weights
+
+
+class NodeGenerator:
+    def __init__(self, seed: int, protocols: dict[str, float], transports: dict[str, float],
+                 emoji_ratio: float, duplicate_ratio: float, reality_ratio: float):
+        self.rng = random.Random(seed)
+        self.protocols = list(protocols)
+        self.protocol_weights = list(protocols.values())
+        self.transports = transports
+        self.emoji_ratio = emoji_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.reality_ratio = reality_ratio
+        self.names = []
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def secret(self, length: int = 16) -> str:
+        return "%0*x" % (length, self.rng.getrandbits(length * 4))
+
+    def name(self, index: int, protocol: str) -> str:
+        if self.names and self.rng.random() < self.duplicate_ratio:
+            return self.rng.choice(self.names)
+        flag, code, region = self.rng.choice(REGIONS)
+        style = self.rng.randrange(3)
+        if style == 0:
+            name = f"{region} {index:02d}"
+        elif style == 1:
+            name = f"{code}-{self.rng.choice(('IPLC', 'IEPL', 'BGP', 'CN2'))}-{index:02d} | {self.rng.choice((0.5, 1, 1.5, 2))}x"
+        else:
+            name = f"[{protocol}] {code} {index}"
+        if self.rng.random() < self.emoji_ratio:
+            name = f"{flag} {name}"
+        if len(self.names) < 10000:
+            self.names.append(name)
+        return name
+
+    def transport(self, protocol: str) -> str:
+        allowed = [t for t in PROTOCOL_TRANSPORTS.get(protocol, ()) if t in self.transports]
+        if not allowed:
+            return "tcp"
+        return self.rng.choices(allowed, [self.transports[t] for t in allowed])[0]
+
+    def node(self, index: int) -> dict:
+        """one node in Clash proxy form"""
+        rng = self.rng
+        protocol = rng.choices(self.protocols, self.protocol_weights)[0]
+        host = f"{rng.choice(REGIONS)[1].lower()}{index}.node{rng.randrange(100)}.example.com"
+        node = {
+            "name": self.name(index, protocol),
+            "type": protocol,
+            "server": host if rng.random() < 0.7 else f"198.{18 + rng.randrange(2)}.{rng.randrange(256)}.{rng.randrange(1, 255)}",
+            "port": rng.choice((443, 8443, 2053, 2096)) if rng.random() < 0.6 else rng.randrange(10000, 60000),
+        }
+        sni = f"cdn{rng.randrange(1000)}.example.net"
+        if protocol == "ss":
+            node.update({"cipher": rng.choice(SS_CIPHERS), "password": self.secret(), "udp": True})
+        elif protocol == "ssr":
+            node.update({"cipher": "aes-256-cfb", "password": self.secret(), "protocol": "auth_aes128_md5",
+                         "protocol-param": "", "obfs": "tls1.2_ticket_auth", "obfs-param": sni})
+        elif protocol == "hysteria2":
+            node.update({"password": self.uuid(), "sni": sni, "obfs": "salamander", "obfs-password": self.secret(8)})
+        elif protocol == "tuic":
+            node.update({"uuid": self.uuid(), "password": self.secret(), "sni": sni, "alpn": ["h3"],
+                         "congestion-controller": rng.choice(("bbr", "cubic")), "udp-relay-mode": "native"})
+        else:
+            network = self.transport(protocol)
+            if protocol == "vmess":
+                node.update({"uuid": self.uuid(), "alterId": 0, "cipher": "auto", "tls": rng.random() < 0.7})
+                if node["tls"]:
+                    node["servername"] = sni
+            elif protocol == "vless":
+                node.update({"uuid": self.uuid(), "tls": True, "servername": sni, "client-fingerprint": rng.choice(FINGERPRINTS)})
+                if network == "tcp" and rng.random() < self.reality_ratio:
+                    node["flow"] = "xtls-rprx-vision"
+                    node["reality-opts"] = {"public-key": base64.urlsafe_b64encode(rng.randbytes(32)).decode().rstrip("="),
+                                            "short-id": self.secret(8)}
+            else:
+                node.update({"password": self.secret(), "sni": sni, "udp": True})
+            node["network"] = network
+            if network == "ws":
+                node["ws-opts"] = {"path": f"/{self.secret(6)}?ed=2048", "headers": {"Host": sni}}
+            elif network == "grpc":
+                node["grpc-opts"] = {"grpc-service-name": self.secret(6)}
+            elif network == "h2":
+                node["h2-opts"] = {"host": [sni], "path": f"/{self.secret(6)}"}
+        return node
+
+
+def b64(text: str) -> str:
+    return base64.b64encode(text.encode()).decode()
+
+
+def transport_params(node: dict) -> dict:
+    network = node.get("network", "tcp")
+    params = {"type": "http" if network == "h2" else network}
+    if network == "ws":
+        params.update({"path": node["ws-opts"]["path"], "host": node["ws-opts"]["headers"]["Host"]})
+    elif network == "grpc":
+        params["serviceName"] = node["grpc-opts"]["grpc-service-name"]
+    elif network == "h2":
+        params.update({"path": node["h2-opts"]["path"], "host": node["h2-opts"]["host"][0]})
+    return params
+
+
+def to_uri(node: dict) -> str:
+    t, server, port, tag = node["type"], node["server"], node["port"], quote(node["name"])
+    if t == "ss":
+        userinfo = base64.urlsafe_b64encode(f"{node['cipher']}:{node['password']}".encode()).decode().rstrip("=")
+        return f"ss://{userinfo}@{server}:{port}#{tag}"
+    if t == "ssr":
+        params = urlencode({"obfsparam": b64(node["obfs-param"]), "protoparam": b64(node["protocol-param"]), "remarks": b64(node["name"])})
+        body = f"{server}:{port}:{node['protocol']}:{node['cipher']}:{node['obfs']}:{b64(node['password'])}/?{params}"
+        return "ssr://" + base64.urlsafe_b64encode(body.encode()).decode().rstrip("=")
+    if t == "vmess":
+        params = transport_params(node)
+        config = {"v": "2", "ps": node["name"], "add": server, "port": str(port), "id": node["uuid"], "aid": "0", "scy": "auto",
+                  "net": node["network"], "type": "none", "host": params.get("host", ""),
+                  "path": params.get("path", params.get("serviceName", "")),
+                  "tls": "tls" if node["tls"] else "", "sni": node.get("servername", "")}
+        return "vmess://" + b64(json.dumps(config, ensure_ascii=False))
+    if t == "vless":
+        params = {"encryption": "none", **transport_params(node), "sni": node["servername"], "fp": node["client-fingerprint"]}
+        if "reality-opts" in node:
+            params.update({"security": "reality", "flow": node["flow"], "pbk": node["reality-opts"]["public-key"],
+                           "sid": node["reality-opts"]["short-id"]})
+        else:
+            params["security"] = "tls"
+        return f"vless://{node['uuid']}@{server}:{port}?{urlencode(params)}#{tag}"
+    if t == "trojan":
+        params = {**transport_params(node), "sni": node["sni"]}
+        return f"trojan://{quote(node['password'])}@{server}:{port}?{urlencode(params)}#{tag}"
+    if t == "hysteria2":
+        params = {"sni": node["sni"], "obfs": node["obfs"], "obfs-password": node["obfs-password"]}
+        return f"hysteria2://{node['password']}@{server}:{port}?{urlencode(params)}#{tag}"
+    if t == "tuic":
+        params = {"sni": node["sni"], "alpn": ",".join(node["alpn"]), "congestion_control": node["congestion-controller"],
+                  "udp_relay_mode": node["udp-relay-mode"]}
+        return f"tuic://{node['uuid']}:{quote(node['password'])}@{server}:{port}?{urlencode(params)}#{tag}"
+    raise ValueError(f"unsupported type {t}")
+
+
+def to_singbox(node: dict) -> dict | None:
+    """sing-box outbound, None for protocols sing-box does not support (ssr)"""
+    t = node["type"]
+    outbound = {"type": "shadowsocks" if t == "ss" else t, "tag": node["name"], "server": node["server"], "server_port": node["port"]}
+    if t == "ss":
+        outbound.update({"method": node["cipher"], "password": node["password"]})
+        return outbound
+    if t == "ssr":
+        return None
+    if t == "hysteria2":
+        outbound.update({"password": node["password"], "tls": {"enabled": True, "server_name": node["sni"]},
+                         "obfs": {"type": node["obfs"], "password": node["obfs-password"]}})
+        return outbound
+    if t == "tuic":
+        outbound.update({"uuid": node["uuid"], "password": node["password"], "congestion_control": node["congestion-controller"],
+                         "udp_relay_mode": node["udp-relay-mode"],
+                         "tls": {"enabled": True, "server_name": node["sni"], "alpn": node["alpn"]}})
+        return outbound
+    if t == "vmess":
+        outbound.update({"uuid": node["uuid"], "security": "auto", "alter_id": 0})
+        if node["tls"]:
+            outbound["tls"] = {"enabled": True, "server_name": node["servername"]}
+    elif t == "vless":
+        outbound["uuid"] = node["uuid"]
+        tls = {"enabled": True, "server_name": node["servername"], "utls": {"enabled": True, "fingerprint": node["client-fingerprint"]}}
+        if "reality-opts" in node:
+            outbound["flow"] = node["flow"]
+            tls["reality"] = {"enabled": True, "public_key": node["reality-opts"]["public-key"], "short_id": node["reality-opts"]["short-id"]}
+        outbound["tls"] = tls
+    else:
+        outbound.update({"password": node["password"], "tls": {"enabled": True, "server_name": node["sni"]}})
+    network = node.get("network", "tcp")
+    if network == "ws":
+        outbound["transport"] = {"type": "ws", "path": node["ws-opts"]["path"], "headers": node["ws-opts"]["headers"]}
+    elif network == "grpc":
+        outbound["transport"] = {"type": "grpc", "service_name": node["grpc-opts"]["grpc-service-name"]}
+    elif network == "h2":
+        outbound["transport"] = {"type": "http", "host": node["h2-opts"]["host"], "path": node["h2-opts"]["path"]}
+    return outbound
+
+
+def mutate(node: dict, rng: random.Random) -> dict:
+    """the node as a converter might return it: mostly equivalent, sometimes with added defaults or real changes"""
+    after = json.loads(json.dumps(node))
+    r = rng.random()
+    if r < 0.2:
+        after["udp"] = True
+    elif r < 0.3 and node["type"] in ("vmess", "vless", "trojan"):
+        after["skip-cert-verify"] = False
+    elif r < 0.35 and node["type"] == "vless" and "flow" not in node:
+        after["flow"] = ""
+    elif r < 0.38:
+        after["port"] = node["port"] + 1
+    return after
+
+
+class Base64Writer:
+    """base64 encode a stream of lines without holding the whole subscription in memory"""
+
+    def __init__(self, f):
+        self.f = f
+        self.pending = b""
+
+    def write(self, text: str):
+        data = self.pending + text.encode()
+        cut = len(data) - len(data) % 3
+        self.f.write(base64.b64encode(data[:cut]).decode())
+        self.pending = data[cut:]
+
+    def close(self):
+        self.f.write(base64.b64encode(self.pending).decode())
+
+
+def clash_line(node: dict) -> str:
+    # JSON is a subset of YAML flow style, one proxy per line keeps writing and reading fast
+    return "  - " + json.dumps(node, ensure_ascii=False) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--nodes", type=int, default=1000)
+    parser.add_argument("-s", "--seed", type=int, default=1)
+    parser.add_argument("--mix", default="ss=3,vmess=2,vless=2,trojan=2,hysteria2=1,tuic=1,ssr=0.5",
+                        help=f"protocol weights, out of {', '.join(PROTOCOLS)}")
+    parser.add_argument("--transports", default="tcp=4,ws=3,grpc=2,h2=1", help="transport weights for vmess/vless/trojan")
+    parser.add_argument("--reality-ratio", type=float, default=0.5, help="share of vless tcp nodes using reality")
+    parser.add_argument("--emoji-ratio", type=float, default=0.6, help="share of names starting with a flag emoji")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.05, help="share of nodes reusing an earlier name")
+    parser.add_argument("--formats", default="base64,clash,sing-box", help="outputs to write: base64, clash, sing-box")
+    parser.add_argument("-o", "--output-dir", default="subscriptions")
+    parser.add_argument("--name", default=None, help="file name stem, sub-<nodes>-<seed> by default")
+    parser.add_argument("--pair", default=None, metavar="DIR", help="also write DIR/转换前 and DIR/转换后 for compare_nodes.py")
+    parser.add_argument("--serve", type=int, default=None, metavar="PORT", help="serve the output directory on PORT after writing")
+    args = parser.parse_args()
+
+    protocols = parse_weights(args.mix, PROTOCOLS)
+    transports = parse_weights(args.transports, TRANSPORTS)
+    formats = {f.strip() for f in args.formats.split(",") if f.strip()}
+    generator = NodeGenerator(args.seed, protocols, transports, args.emoji_ratio, args.duplicate_ratio, args.reality_ratio)
+    mutate_rng = random.Random(args.seed + 1)
+    stem = args.name or f"sub-{args.nodes}-{args.seed}"
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    files = []
+
+    def output(path):
+        f = open(path, "w", encoding="utf-8")
+        files.append(f)
+        return f
+
+    b64_out = Base64Writer(output(os.path.join(args.output_dir, f"{stem}.txt"))) if "base64" in formats else None
+    clash_out = output(os.path.join(args.output_dir, f"{stem}.yaml")) if "clash" in formats else None
+    singbox_out = output(os.path.join(args.output_dir, f"{stem}.json")) if "sing-box" in formats else None
+    if args.pair:
+        os.makedirs(args.pair, exist_ok=True)
+        before_out = output(os.path.join(args.pair, "转换前"))
+        after_out = output(os.path.join(args.pair, "转换后"))
+        before_out.write("proxies:\n")
+        after_out.write("proxies:\n")
+    if clash_out:
+        clash_out.write("proxies:\n")
+    if singbox_out:
+        singbox_out.write('{\n  "outbounds": [')
+
+    counts = dict.fromkeys(protocols, 0)
+    singbox_first = True
+    try:
+        for i in range(args.nodes):
+            node = generator.node(i)
+            counts[node["type"]] += 1
+            if b64_out:
+                b64_out.write(("\n" if i else "") + to_uri(node))
+            if clash_out:
+                clash_out.write(clash_line(node))
+            if singbox_out:
+                outbound = to_singbox(node)
+                if outbound is not None:
+                    singbox_out.write(("\n    " if singbox_first else ",\n    ") + json.dumps(outbound, ensure_ascii=False))
+                    singbox_first = False
+            if args.pair:
+                before_out.write(clash_line(node))
+                after_out.write(clash_line(mutate(node, mutate_rng)))
+        if b64_out:
+            b64_out.close()
+        if singbox_out:
+            singbox_out.write("\n  ]\n}\n")
+    finally:
+        for f in files:
+            f.close()
+    print(f"wrote {args.nodes} nodes to {args.output_dir}/{stem}.*: " + ", ".join(f"{k} {v}" for k, v in counts.items() if v))
+
+    if args.serve is not None:
+        from standin_server import start_server
+        server = start_server({"/": args.output_dir}, "127.0.0.1", args.serve)
+        print(f"serving {args.output_dir} at http://127.0.0.1:{server.server_port}/{stem}.txt")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
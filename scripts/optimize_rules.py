@@ -0,0 +1,325 @@
+"""
+find and optionally remove redundancy in rule lists: duplicate rules, rules shadowed by a broader rule
+(DOMAIN under a DOMAIN-SUFFIX, a suffix under a shorter suffix or a keyword, a CIDR inside another CIDR)
+and adjacent CIDRs that can be merged.
+
+lists are read in the order a subconverter config lists its rulesets, so with --cross-list a rule
+already matched by an earlier list (first match wins) is reported as dead as well. only report by default,
+--write rewrites the lists.
+"""
+import argparse
+import bisect
+import ipaddress
+import json
+import logging
+import os
+import re
+import tomllib
+
+from rulelist import CIDR_TYPES, Rule, parse_line, parse_network
+
+RULESET_PREFIXES = ("surge:", "quanx:", "clash-domain:", "clash-ipcidr:", "clash-classic:")
+DEFAULT_MAPS = ["https://raw.githubusercontent.com/LM-Firefly/Rules/master/=base/rules/LM-Firefly/"]
+SUFFIX = 1
+EXACT = 2
+
+
+class DomainTrie:
+    """domains stored by reversed labels, 'www.example.com' as com -> example -> www"""
+
+    def __init__(self):
+        self.root = {}
+        self.keywords = []
+
+    def add(self, rule_type: str, domain: str):
+        if rule_type == "DOMAIN-KEYWORD":
+            self.keywords.append(domain)
+            return
+        node = self.root
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, {})
+        node[None] = node.get(None, 0) | (SUFFIX if rule_type == "DOMAIN-SUFFIX" else EXACT)
+
+    def covers(self, rule_type: str, domain: str, strict: bool = False) -> bool:
+        """
+        True when a stored rule matches everything rule_type,domain matches.
+        with strict an identical rule does not count, only a broader one does.
+        """
+        if rule_type == "DOMAIN-KEYWORD":
+            return any(k in domain and not (strict and k == domain) for k in self.keywords)
+        if any(k in domain for k in self.keywords):
+            return True
+        labels = domain.split(".")
+        node = self.root
+        for i, label in enumerate(reversed(labels)):
+            node = node.get(label)
+            if node is None:
+                return False
+            flags = node.get(None, 0)
+            last = i == len(labels) - 1
+            if flags & SUFFIX and not (last and strict and rule_type == "DOMAIN-SUFFIX"):
+                return True
+            if last and rule_type == "DOMAIN" and flags & EXACT and not strict:
+                return True
+        return False
+
+
+class IntervalIndex:
+    """disjoint, sorted address intervals of the CIDRs added so far, one list per IP version"""
+
+    def __init__(self):
+        self.starts = {4: [], 6: []}
+        self.ends = {4: [], 6: []}
+
+    def add(self, network):
+        starts, ends = self.starts[network.version], self.ends[network.version]
+        start, end = int(network.network_address), int(network.broadcast_address)
+        # merge with every interval overlapping or touching [start, end]
+        lo = bisect.bisect_left(ends, start - 1)
+        hi = bisect.bisect_right(starts, end + 1)
+        if lo < hi:
+            start = min(start, starts[lo])
+            end = max(end, ends[hi - 1])
+        starts[lo:hi] = [start]
+        ends[lo:hi] = [end]
+
+    def covers(self, network) -> bool:
+        starts, ends = self.starts[network.version], self.ends[network.version]
+        i = bisect.bisect_right(starts, int(network.network_address)) - 1
+        return i >= 0 and ends[i] >= int(network.broadcast_address)
+
+
+class Corpus:
+    """
+    everything matched by the lists seen so far. CIDRs with no-resolve are kept apart: they only
+    cover later no-resolve rules, a later rule that resolves can still match where they cannot.
+    """
+
+    def __init__(self):
+        self.domains = DomainTrie()
+        self.networks = IntervalIndex()
+        self.networks_no_resolve = IntervalIndex()
+        self.others = set()
+
+    def add(self, rule: Rule, network=None):
+        if network is not None:
+            (self.networks_no_resolve if "no-resolve" in rule.options else self.networks).add(network)
+        elif rule.type.startswith("DOMAIN") and rule.type != "DOMAIN-REGEX":
+            self.domains.add(rule.type, rule.value)
+        else:
+            self.others.add(rule)
+
+    def covers(self, rule: Rule, network=None) -> bool:
+        if network is not None:
+            if self.networks.covers(network):
+                return True
+            return "no-resolve" in rule.options and self.networks_no_resolve.covers(network)
+        if rule.type.startswith("DOMAIN") and rule.type != "DOMAIN-REGEX":
+            return self.domains.covers(rule.type, rule.value)
+        return rule in self.others
+
+
+def normalize(rule: Rule) -> tuple[Rule, object]:
+    """rule with a canonical value, and its network for CIDR rules"""
+    if rule.type in CIDR_TYPES:
+        network = parse_network(rule.value)
+        if network is not None:
+            return rule._replace(type="IP-CIDR" if network.version == 4 else "IP-CIDR6", value=str(network)), network
+        return rule, None
+    if rule.type.startswith("DOMAIN") and rule.type != "DOMAIN-REGEX":
+        return rule._replace(value=rule.value.lower().strip(".")), None
+    return rule, None
+
+
+def optimize_list(lines: list[str], corpus: Corpus | None) -> tuple[list[str], dict]:
+    """
+    return the rewritten lines and counts. comments and unparsable lines are kept as they are,
+    merged CIDRs take the place of the first line they replace.
+    """
+    stats = {"before": 0, "after": 0, "duplicate": 0, "shadowed": 0, "cross_list": 0, "aggregated": 0}
+    parsed = {}
+    for i, line in enumerate(lines):
+        rule = parse_line(line)
+        if rule is not None:
+            parsed[i] = normalize(rule)
+    stats["before"] = len(parsed)
+
+    drop = set()
+    seen = set()
+    local = Corpus()
+    for i, (rule, network) in parsed.items():
+        if corpus is not None and corpus.covers(rule, network):
+            stats["cross_list"] += 1
+            drop.add(i)
+        elif rule in seen:
+            stats["duplicate"] += 1
+            drop.add(i)
+        else:
+            seen.add(rule)
+            if network is None:
+                local.add(rule)
+
+    # within a list every rule leads to the same policy, so order does not matter for shadowing
+    for i, (rule, network) in parsed.items():
+        if i not in drop and network is None and rule.type.startswith("DOMAIN") and rule.type != "DOMAIN-REGEX" \
+                and local.domains.covers(rule.type, rule.value, strict=True):
+            stats["shadowed"] += 1
+            drop.add(i)
+
+    replace = {}
+    by_option = {}
+    for i, (rule, network) in parsed.items():
+        if i not in drop and network is not None:
+            by_option.setdefault(rule.options, []).append((i, rule, network))
+    resolving = [n for options, items in by_option.items() if "no-resolve" not in options for _, _, n in items]
+    resolving_index = IntervalIndex()
+    for network in ipaddress.collapse_addresses([n for n in resolving if n.version == 4]):
+        resolving_index.add(network)
+    for network in ipaddress.collapse_addresses([n for n in resolving if n.version == 6]):
+        resolving_index.add(network)
+    for options, items in by_option.items():
+        for version in (4, 6):
+            # sorted by address, wider first: a CIDR ending inside an earlier one is contained in it
+            members = sorted((item for item in items if item[2].version == version),
+                             key=lambda item: (item[2].network_address, item[2].prefixlen))
+            kept = []
+            end = -1
+            for i, rule, network in members:
+                # a no-resolve CIDR inside a resolving one never matches first
+                if int(network.broadcast_address) <= end or "no-resolve" in options and resolving_index.covers(network):
+                    stats["shadowed"] += 1
+                    drop.add(i)
+                    continue
+                kept.append((i, rule, network))
+                end = int(network.broadcast_address)
+            j = 0
+            for merged in ipaddress.collapse_addresses([n for _, _, n in kept]):
+                group = []
+                while j < len(kept) and kept[j][2].subnet_of(merged):
+                    group.append(kept[j])
+                    j += 1
+                if len(group) == 1:
+                    continue
+                stats["aggregated"] += len(group) - 1
+                first, rule, _ = min(group)
+                replace[first] = str(rule._replace(value=str(merged)))
+                drop.update(i for i, _, _ in group if i != first)
+
+    output = []
+    for i, line in enumerate(lines):
+        if i in drop:
+            continue
+        output.append(replace.get(i, line))
+    stats["after"] = stats["before"] - len(drop)
+
+    if corpus is not None:
+        for i, (rule, network) in parsed.items():
+            if i not in drop:
+                corpus.add(rule, network)
+        for i, text in replace.items():
+            rule, network = normalize(parse_line(text))
+            corpus.add(rule, network)
+    return output, stats
+
+
+def ruleset_paths_from_config(path: str) -> list[str]:
+    """ruleset locations in the order the config lists them, inline '[]' rules are skipped"""
+    rulesets = []
+    if path.endswith(".toml"):
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+        for item in config.get("rulesets", []):
+            rulesets.append(item.get("ruleset", ""))
+    else:
+        pattern = re.compile(r"^\s*(?:surge_)?ruleset\s*=\s*[^,]*,(.+?)(?:,\d+)?\s*$")
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                m = pattern.match(line)
+                if m is not None:
+                    rulesets.append(m.group(1))
+    paths = []
+    for ruleset in rulesets:
+        if not ruleset or ruleset.startswith("[]"):
+            continue
+        for prefix in RULESET_PREFIXES:
+            if ruleset.startswith(prefix):
+                ruleset = ruleset[len(prefix):]
+                break
+        paths.append(ruleset)
+    return paths
+
+
+def resolve_path(location: str, maps: list[tuple[str, str]], base_dir: str) -> str | None:
+    for prefix, directory in maps:
+        if location.startswith(prefix):
+            return os.path.join(directory, location[len(prefix):])
+    if "://" in location:
+        return None
+    return location if os.path.isabs(location) else os.path.join(base_dir, location)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("lists", nargs="*", help="rule lists in match order, used when no --config is given")
+    parser.add_argument("-c", "--config", default=None, help="pref or external config (toml/ini) giving the ruleset order")
+    parser.add_argument("--base-dir", default="base", help="directory relative ruleset paths of the config are resolved against")
+    parser.add_argument("--map", action="append", default=None, metavar="URL_PREFIX=DIR",
+                        help=f"read rulesets under URL_PREFIX from DIR (default {DEFAULT_MAPS[0]})")
+    parser.add_argument("--cross-list", action="store_true",
+                        help="also drop rules already matched by an earlier list; only valid for configs using this exact order")
+    parser.add_argument("--write", action="store_true", help="rewrite the lists instead of only reporting")
+    parser.add_argument("-o", "--output-dir", default=None, help="with --write, write the lists here instead of in place")
+    parser.add_argument("--report", default=None, help="write the per-list counts as json")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
+
+    maps = [tuple(m.split("=", 1)) for m in (args.map or DEFAULT_MAPS)]
+    if args.config:
+        locations = ruleset_paths_from_config(args.config)
+        paths = []
+        for location in locations:
+            path = resolve_path(location, maps, args.base_dir)
+            if path is None or not os.path.isfile(path):
+                logging.warning(f"skipping {location}, no local copy")
+                continue
+            paths.append(path)
+    else:
+        paths = args.lists
+
+    corpus = Corpus() if args.cross_list else None
+    report = {"lists": [], "total": {}}
+    done = set()
+    for path in paths:
+        key = os.path.normpath(path)
+        if key in done:
+            continue
+        done.add(key)
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+        if lines and lines[0].strip() == "payload:":
+            logging.warning(f"skipping {path}, clash payload lists are not supported")
+            continue
+        output, stats = optimize_list(lines, corpus)
+        report["lists"].append({"path": path, **stats})
+        for k, v in stats.items():
+            report["total"][k] = report["total"].get(k, 0) + v
+        if args.write and (args.output_dir or stats["after"] != stats["before"]):
+            dest = path if args.output_dir is None else os.path.join(args.output_dir, os.path.relpath(path, os.path.commonpath(paths)))
+            os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+            with open(dest, "w", encoding="utf-8") as f:
+                f.write("\n".join(output) + "\n")
+
+    width = max([len(item["path"]) for item in report["lists"]] + [5])
+    print(f"{'list':<{width}} {'before':>8} {'after':>8} {'dup':>6} {'shadow':>6} {'cross':>6} {'merged':>6}")
+    for item in report["lists"] + [{"path": "total", **report["total"]}]:
+        if item.get("before", 0) == item.get("after", 0) and item["path"] != "total":
+            continue
+        print(f"{item['path']:<{width}} {item.get('before', 0):>8} {item.get('after', 0):>8} {item.get('duplicate', 0):>6} "
+              f"{item.get('shadowed', 0):>6} {item.get('cross_list', 0):>6} {item.get('aggregated', 0):>6}")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
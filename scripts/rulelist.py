@@ -0,0 +1,120 @@
+"""
+parse Surge-style rule lists (and Clash rule-provider payloads) the way subconverter reads them,
+shared by update_rules.py and the other rule tooling in this directory.
+"""
+import ipaddress
+import re
+from typing import NamedTuple
+
+# same as ClashRuleTypes in src/generator/config/ruleconvert.cpp
+CLASH_RULE_TYPES = (
+    "DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD", "IP-CIDR", "SRC-IP-CIDR", "GEOIP", "MATCH", "FINAL",
+    "IP-CIDR6", "SRC-PORT", "DST-PORT", "PROCESS-NAME", "DOMAIN-REGEX", "DOMAIN-WILDCARD", "GEOSITE",
+    "IP-SUFFIX", "IP-ASN", "SRC-GEOIP", "SRC-IP-ASN", "SRC-IP-SUFFIX", "IN-PORT", "IN-TYPE", "IN-USER",
+    "IN-NAME", "PROCESS-PATH-REGEX", "PROCESS-PATH", "PROCESS-NAME-REGEX", "PROCESS-NAME-WILDCARD",
+    "PROCESS-PATH-WILDCARD", "UID", "NETWORK", "DSCP", "SUB-RULE", "RULE-SET", "AND", "OR", "NOT",
+)
+# rule types that can be expressed in a sing-box headless rule, and the field they map to
+SINGBOX_FIELDS = {
+    "DOMAIN": "domain",
+    "DOMAIN-SUFFIX": "domain_suffix",
+    "DOMAIN-KEYWORD": "domain_keyword",
+    "DOMAIN-REGEX": "domain_regex",
+    "IP-CIDR": "ip_cidr",
+    "IP-CIDR6": "ip_cidr",
+    "SRC-IP-CIDR": "source_ip_cidr",
+    "PROCESS-NAME": "process_name",
+    "PROCESS-PATH": "process_path",
+    "PACKAGE-NAME": "package_name",
+    "PORT": "port",
+    "DST-PORT": "port",
+    "PORT-RANGE": "port_range",
+    "SRC-PORT": "source_port",
+    "SRC-PORT-RANGE": "source_port_range",
+    "NETWORK": "network",
+}
+DOMAIN_TYPES = ("DOMAIN", "DOMAIN-SUFFIX")
+CIDR_TYPES = ("IP-CIDR", "IP-CIDR6")
+
+payload_item = re.compile(r"^\s*-\s+(['\"]?)(.*)\1\s*$")
+
+
+class Rule(NamedTuple):
+    type: str
+    value: str
+    options: tuple[str, ...] = ()
+
+    def __str__(self):
+        return ",".join((self.type, self.value) + self.options)
+
+
+def strip_comment(line: str) -> str:
+    line = line.strip()
+    if not line or line[0] in ";#" or line.startswith("//"):
+        return ""
+    if "//" in line:
+        line = line[:line.index("//")].strip()
+    return line
+
+
+def provider_item_to_rule(item: str) -> Rule | None:
+    """a Clash domain/ipcidr provider entry ('+.example.com', '1.2.3.0/24', ...) as a classical rule"""
+    if "," in item:
+        return parse_line(item)
+    if "/" in item:
+        try:
+            network = ipaddress.ip_network(item, strict=False)
+        except ValueError:
+            return None
+        return Rule("IP-CIDR" if network.version == 4 else "IP-CIDR6", item)
+    if item.startswith("+.") or item.startswith("."):
+        value = item[2:] if item[0] == "+" else item[1:]
+        if not value.endswith(".*"):
+            return Rule("DOMAIN-SUFFIX", value)
+        while value.endswith(".*"):
+            value = value[:-2]
+        return Rule("DOMAIN-KEYWORD", value)
+    return Rule("DOMAIN", item)
+
+
+def parse_line(line: str) -> Rule | None:
+    line = strip_comment(line)
+    if not line:
+        return None
+    parts = [p.strip() for p in line.split(",")]
+    if len(parts) < 2 or not parts[1]:
+        return None
+    return Rule(parts[0].upper(), parts[1], tuple(p for p in parts[2:] if p))
+
+
+def parse_rules(text: str) -> list[Rule]:
+    """parse a rule list, either Surge-style lines or a Clash payload, skipping comments and junk"""
+    rules = []
+    lines = text.splitlines()
+    if lines and lines[0].strip() == "payload:":
+        for line in lines[1:]:
+            m = payload_item.match(line)
+            if m is None:
+                continue
+            item = strip_comment(m.group(2))
+            rule = provider_item_to_rule(item) if item else None
+            if rule is not None:
+                rules.append(rule)
+        return rules
+    for line in lines:
+        rule = parse_line(line)
+        if rule is not None:
+            rules.append(rule)
+    return rules
+
+
+def read_rules(path: str) -> list[Rule]:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return parse_rules(f.read())
+
+
+def parse_network(value: str) -> ipaddress.IPv4Network | ipaddress.IPv6Network | None:
+    try:
+        return ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        return None
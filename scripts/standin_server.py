@@ -0,0 +1,85 @@
+"""
+local stand-in for the remote servers subconverter fetches from (subscription providers, raw.githubusercontent.com),
+so benchmarks never touch the network. every mount maps a URL prefix to a directory, query strings are ignored.
+GET /__stats returns the number of requests served per mount, to tell cache hits from upstream fetches.
+"""
+import argparse
+import json
+import os
+import posixpath
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path)
+        if path == "/__stats":
+            with self.server.lock:
+                self.send_body(200, json.dumps(self.server.stats).encode(), "application/json")
+            return
+        for prefix, directory in self.server.mounts:
+            if not path.startswith(prefix + "/"):
+                continue
+            rel = posixpath.normpath(path[len(prefix) + 1:])
+            if rel.startswith("../") or rel == "..":
+                break
+            file = os.path.join(directory, *rel.split("/"))
+            if not os.path.isfile(file):
+                break
+            with self.server.lock:
+                self.server.stats[prefix] = self.server.stats.get(prefix, 0) + 1
+            if self.server.delay:
+                time.sleep(self.server.delay)
+            with open(file, "rb") as f:
+                self.send_body(200, f.read(), "text/plain; charset=utf-8")
+            return
+        self.send_body(404, b"not found\n", "text/plain")
+
+    def send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(mounts: dict[str, str], host: str = "127.0.0.1", port: int = 0, delay: float = 0.0) -> ThreadingHTTPServer:
+    """serve mounts ({url prefix: directory}) from a daemon thread, port 0 picks a free one (see server.server_port)"""
+    server = ThreadingHTTPServer((host, port), StandinHandler)
+    server.daemon_threads = True
+    server.mounts = sorted(((p.rstrip("/"), d) for p, d in mounts.items()), key=lambda m: -len(m[0]))
+    server.delay = delay
+    server.stats = {}
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8900)
+    parser.add_argument("-m", "--mount", action="append", default=[], metavar="PREFIX=DIR",
+                        help="serve DIR under URL PREFIX, e.g. /rules=base/rules/LM-Firefly (repeatable)")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before every response, to mimic a remote server")
+    args = parser.parse_args()
+
+    mounts = dict(m.split("=", 1) for m in args.mount) or {"/": "."}
+    server = start_server(mounts, args.host, args.port, args.delay)
+    print(f"serving {mounts} at http://{args.host}:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,29 @@
 import argparse
 import configparser
 import fnmatch
-import glob
+import hashlib
+import json
 import logging
 import os
+import re
 import shutil
 import stat
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from git import InvalidGitRepositoryError, Repo
 
+from rulelist import CIDR_TYPES, CLASH_RULE_TYPES, DOMAIN_TYPES, SINGBOX_FIELDS, parse_network, read_rules
+
+MANIFEST_NAME = ".rules_manifest.json"
+PRECOMPILED_MANIFEST = "manifest.json"
+# sing-box ORs these fields inside one headless rule, every other field is ANDed with them
+SINGBOX_MATCH_FIELDS = ("domain", "domain_suffix", "domain_keyword", "domain_regex", "ip_cidr")
+# domains are case-insensitive, every other value (regexes, process names, paths) keeps its case
+SINGBOX_LOWERCASE_FIELDS = ("domain", "domain_suffix", "domain_keyword")
+SINGBOX_INT_FIELDS = ("port", "source_port")
+manifest_lock = threading.Lock()
+
 
 def del_rw(action, name: str, exc):
     os.chmod(name, stat.S_IWRITE)
@@ -23,45 +39,399 @@ def open_repo(path: str):
         return None
 
 
-def update_rules(repo_path: str, save_path: str, matches: list[str], excludes: list[str], keep_tree: bool):
-    os.makedirs(save_path, exist_ok=True)
-    for pattern in matches:
-        files = glob.glob(os.path.join(repo_path, pattern), recursive=True)
-        if len(files) == 0:
-            logging.warn(f"no files found for pattern {pattern}")
+def sync_repo(url: str, repo_path: str, commit: str | None, branch: str | None, matches: list[str]):
+    """
+    keep a shallow, blob-less, sparse clone of url at repo_path and move it to the requested revision.
+    the clone is reused between runs and only updated with fetch; only paths covered by matches are checked out.
+    """
+    r = open_repo(repo_path)
+    if r is None:
+        logging.info(f"cloning repo {url} to {repo_path}")
+        kwargs = {"branch": branch} if branch is not None and commit is None else {}
+        r = Repo.clone_from(url, repo_path, no_checkout=True, depth=1, filter="blob:none", **kwargs)
+    else:
+        logging.info(f"repo {repo_path} exists, fetching")
+        r.remote("origin").set_url(url)
+
+    # non-cone patterns use gitignore syntax, anchor them at the repo root
+    r.git.sparse_checkout("set", "--no-cone", *["/" + m.lstrip("/") for m in matches])
+
+    if commit is not None:
+        logging.info(f"fetching commit {commit}")
+        ref = commit
+    elif branch is not None:
+        logging.info(f"fetching branch {branch}")
+        ref = branch
+    else:
+        logging.info(f"fetching default branch")
+        ref = "HEAD"
+    r.git.fetch("origin", ref, depth=1, filter="blob:none")
+    r.git.checkout("--force", "--detach", "FETCH_HEAD")
+    return r
+
+
+def git_blob_hash(path: str) -> str:
+    """same object id git assigns to the file content"""
+    h = hashlib.sha1()
+    h.update(b"blob %d\0" % os.path.getsize(path))
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def remove_empty_dirs(path: str, root: str):
+    """remove the directory of path and its parents up to (not including) root as long as they are empty"""
+    root = os.path.abspath(root)
+    directory = os.path.dirname(os.path.abspath(path))
+    while directory != root and directory.startswith(root + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+
+def atomic_copy(src: str, dest: str):
+    """copy to a temporary file next to dest and rename it over dest, readers never see a partial file"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as out, open(src, "rb") as f:
+            shutil.copyfileobj(f, out)
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def load_manifest(save_path: str, section: str) -> dict:
+    try:
+        with open(os.path.join(save_path, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            return json.load(f).get(section, {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(save_path: str, section: str, files: dict):
+    path = os.path.join(save_path, MANIFEST_NAME)
+    with manifest_lock:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        manifest[section] = files
+        fd, tmp = tempfile.mkstemp(dir=save_path, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600
+        os.replace(tmp, path)
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    translate a glob.glob(recursive=True) pattern to a regex over '/' separated relative paths.
+    like glob, wildcards never match a path component starting with '.'.
+    """
+    parts = []
+    components = pattern.strip("/").split("/")
+    for i, component in enumerate(components):
+        last = i == len(components) - 1
+        if component == "**":
+            parts.append(r"(?:[^/.][^/]*/)*[^/.][^/]*" if last else r"(?:[^/.][^/]*/)*")
             continue
-        for file in files:
-            if os.path.isdir(file):
-                continue
-            file_rel_path, file_name = os.path.split(os.path.relpath(file, repo_path))
-            # check excludes
-            rel_path = os.path.relpath(file, repo_path)
-            excluded = False
-            for exp in excludes:
-                if fnmatch.fnmatch(rel_path, exp) or rel_path.startswith(exp.rstrip("*").rstrip("/")):
-                    excluded = True
+        regex = ""
+        j = 0
+        while j < len(component):
+            c = component[j]
+            j += 1
+            if c == "*":
+                regex += "[^/]*"
+            elif c == "?":
+                regex += "[^/]"
+            elif c == "[":
+                # like fnmatch, a ']' right after '[' or '[!' is literal and an unclosed '[' is literal
+                start = j + 1 if component[j:j + 1] == "!" else j
+                end = component.find("]", start + 1 if component[start:start + 1] == "]" else start)
+                if end < 0:
+                    regex += re.escape(c)
+                    continue
+                body = component[j:end].replace("\\", "\\\\")
+                j = end + 1
+                regex += "[^" + body[1:] + "]" if body.startswith("!") else "[" + body + "]"
+            else:
+                regex += re.escape(c)
+        if not component.startswith("."):
+            regex = r"(?!\.)" + regex
+        parts.append(regex if last else regex + "/")
+    return "".join(parts)
+
+
+class FileMatcher:
+    """
+    every match and exclude pattern of a section compiled once.
+    excludes keep the old semantics: fnmatch on the relative path, or the pattern with
+    trailing '*' and '/' stripped as a plain prefix; a directory under such a prefix is pruned whole.
+    """
+
+    def __init__(self, matches: list[str], excludes: list[str]):
+        self.matches = matches
+        self.match_re = re.compile("|".join(f"(?P<m{i}>{glob_to_regex(m)})" for i, m in enumerate(matches)))
+        self.exclude_re = re.compile("|".join(fnmatch.translate(e) for e in excludes)) if excludes else None
+        self.exclude_prefixes = tuple(e.rstrip("*").rstrip("/") for e in excludes)
+        # literal leading directories of each match pattern, other subtrees can never match
+        literal_dirs = []
+        for m in matches:
+            dirs = []
+            for component in m.strip("/").split("/")[:-1]:
+                if any(c in component for c in "*?["):
                     break
-            if excluded:
-                logging.info(f"excluded {file}")
+                dirs.append(component)
+            literal_dirs.append("/".join(dirs) + "/" if dirs else "")
+        self.literal_dirs = tuple(literal_dirs)
+
+    def excluded(self, rel_path: str) -> bool:
+        return rel_path.startswith(self.exclude_prefixes) or (self.exclude_re is not None and self.exclude_re.match(rel_path) is not None)
+
+    def prune(self, rel_dir: str) -> bool:
+        """True when nothing below rel_dir can be selected"""
+        if not rel_dir:
+            return False
+        rel_dir += "/"
+        if rel_dir.startswith(self.exclude_prefixes):
+            return True
+        return not any(rel_dir.startswith(d) or d.startswith(rel_dir) for d in self.literal_dirs)
+
+    def match(self, rel_path: str) -> str | None:
+        """the first match pattern selecting rel_path, None if it is not selected"""
+        m = self.match_re.fullmatch(rel_path)
+        if m is None or self.excluded(rel_path):
+            return None
+        return self.matches[int(m.lastgroup[1:])]
+
+
+def iter_repo_files(repo_path: str, matcher: FileMatcher):
+    """
+    yield (relative path, git blob id, matched pattern) for every selected file in a single walk.
+    reads the checked out commit tree when repo_path is a git repository, the working directory otherwise.
+    """
+    r = open_repo(repo_path)
+    if r is not None and r.head.is_valid():
+        def prune(item, depth):
+            if item.type == "tree":
+                return matcher.prune(item.path)
+            return item.type != "blob"
+
+        for item in r.head.commit.tree.traverse(prune=prune, visit_once=False):
+            if item.type != "blob":
                 continue
-            if keep_tree:
-                file_dest_dir = os.path.join(save_path, file_rel_path)
-                os.makedirs(file_dest_dir, exist_ok=True)
-                file_dest_path = os.path.join(file_dest_dir, file_name)
+            pattern = matcher.match(item.path)
+            if pattern is not None:
+                yield item.path, item.hexsha, pattern
+        return
+
+    for root, dirs, files in os.walk(repo_path):
+        rel_root = os.path.relpath(root, repo_path).replace(os.sep, "/")
+        rel_root = "" if rel_root == "." else rel_root + "/"
+        dirs[:] = [d for d in dirs if not matcher.prune(rel_root + d)]
+        for name in files:
+            pattern = matcher.match(rel_root + name)
+            if pattern is not None:
+                yield rel_root + name, git_blob_hash(os.path.join(root, name)), pattern
+
+
+def update_rules(repo_path: str, save_path: str, matches: list[str], excludes: list[str], keep_tree: bool, section: str) -> dict:
+    """
+    copy matched files to save_path, only writing files whose git blob hash differs from the manifest,
+    and remove files this section wrote before but no longer matches. returns the change list.
+    """
+    os.makedirs(save_path, exist_ok=True)
+    previous = load_manifest(save_path, section)
+    current = {}
+    changes = {"added": [], "modified": [], "removed": []}
+    matched_patterns = set()
+
+    for rel_path, blob, pattern in iter_repo_files(repo_path, FileMatcher(matches, excludes)):
+        matched_patterns.add(pattern)
+        file = os.path.join(repo_path, rel_path)
+        if not os.path.isfile(file):
+            logging.warning(f"{file} is not checked out")
+            continue
+        file_rel_path, file_name = os.path.split(rel_path)
+        if keep_tree:
+            file_dest_dir = os.path.join(save_path, file_rel_path)
+            os.makedirs(file_dest_dir, exist_ok=True)
+            file_dest_path = os.path.join(file_dest_dir, file_name)
+        else:
+            file_dest_path = os.path.join(save_path, file_name)
+
+        rel_dest = os.path.relpath(file_dest_path, save_path).replace(os.sep, "/")
+        entry = {"blob": blob, "size": os.path.getsize(file)}
+        current[rel_dest] = entry
+        if os.path.exists(file_dest_path):
+            known = previous.get(rel_dest)
+            if known is not None:
+                unchanged = known == entry and os.path.getsize(file_dest_path) == entry["size"]
             else:
-                file_dest_path = os.path.join(save_path, file_name)
-            shutil.copy2(file, file_dest_path)
-            logging.info(f"copied {file} to {file_dest_path}")
+                unchanged = git_blob_hash(file_dest_path) == blob
+            if unchanged:
+                continue
+            changes["modified"].append(file_dest_path)
+        else:
+            changes["added"].append(file_dest_path)
+        atomic_copy(file, file_dest_path)
+        logging.info(f"copied {file} to {file_dest_path}")
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-c", "--config", default="rules_config.conf")
-    args = parser.parse_args()
+    for pattern in matches:
+        if pattern not in matched_patterns:
+            logging.warning(f"no files found for pattern {pattern}")
 
-    config = configparser.ConfigParser()
-    config.read(args.config)
-    logging.basicConfig(format="%(asctime)s %(message)s", level=logging.DEBUG)
+    for rel_dest in previous.keys() - current.keys():
+        file_dest_path = os.path.join(save_path, rel_dest)
+        if os.path.exists(file_dest_path):
+            os.remove(file_dest_path)
+            remove_empty_dirs(file_dest_path, save_path)
+            changes["removed"].append(file_dest_path)
+            logging.info(f"removed stale {file_dest_path}")
+
+    save_manifest(save_path, section, current)
+    logging.info(f"section {section}: {len(changes['added'])} added, {len(changes['modified'])} modified, "
+                 f"{len(changes['removed'])} removed, {len(current)} files")
+    return changes
+
+
+def atomic_write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def yaml_payload(items: list[str]) -> bytes:
+    return ("payload:\n" + "".join("  - '" + i.replace("'", "''") + "'\n" for i in items)).encode()
+
+
+def compile_rules(rules: list) -> dict[str, tuple[bytes, int]]:
+    """
+    render one rule list as Clash domain/ipcidr/classical rule-providers and a sing-box rule-set source,
+    deduplicated and sorted. returns {kind: (content bytes, rule count)}, kinds without any rule are left out.
+    """
+    domains = set()
+    networks = set()
+    classical = set()
+    singbox = {}
+    for rule in rules:
+        if rule.type in DOMAIN_TYPES:
+            domain = rule.value.lower().lstrip(".")
+            domains.add(("+." if rule.type == "DOMAIN-SUFFIX" else "") + domain)
+        network = None
+        if rule.type in CIDR_TYPES:
+            network = parse_network(rule.value)
+            if network is None:
+                logging.warning(f"invalid cidr {rule.value}")
+                continue
+            networks.add(network)
+        if rule.type in CLASH_RULE_TYPES:
+            classical.add(str(rule._replace(value=str(network))) if network is not None else str(rule))
+        field = SINGBOX_FIELDS.get(rule.type)
+        if field is None:
+            continue
+        if network is not None:
+            value = str(network)
+        elif field in SINGBOX_LOWERCASE_FIELDS:
+            value = rule.value.lower()
+        elif field in SINGBOX_INT_FIELDS:
+            if not rule.value.isdigit():
+                logging.warning(f"invalid port {rule.value}")
+                continue
+            value = int(rule.value)
+        else:
+            value = rule.value
+        singbox.setdefault(field, set()).add(value)
+
+    artifacts = {}
+    if domains:
+        artifacts["domain"] = (yaml_payload(sorted(domains)), len(domains))
+    if networks:
+        artifacts["ipcidr"] = (yaml_payload([str(n) for n in sorted(networks, key=lambda n: (n.version, n))]), len(networks))
+    if classical:
+        artifacts["classical"] = (yaml_payload(sorted(classical)), len(classical))
+    if singbox:
+        count = sum(len(v) for v in singbox.values())
+        match_rule = {f: sorted(singbox.pop(f)) for f in SINGBOX_MATCH_FIELDS if f in singbox}
+        headless = ([match_rule] if match_rule else []) + [{f: sorted(v)} for f, v in sorted(singbox.items())]
+        artifacts["sing-box"] = (json.dumps({"version": 1, "rules": headless}, indent=2, ensure_ascii=False).encode(), count)
+    return artifacts
+
+
+def artifact_path(source: str, kind: str) -> str:
+    stem = os.path.splitext(source)[0]
+    return f"{stem}.json" if kind == "sing-box" else f"{stem}.{kind}.yaml"
+
+
+def precompile_rules(groups: dict[tuple, list[dict]], out_dir: str) -> dict:
+    """
+    build provider artifacts for every synced .list file into out_dir/<section>/, next to a manifest
+    recording the source blob, rule counts and artifact hashes. lists whose source blob did not change
+    since the last build are skipped, artifacts of lists that went away are removed.
+    """
+    manifest_path = os.path.join(out_dir, PRECOMPILED_MANIFEST)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            previous = json.load(f).get("sources", {})
+    except (OSError, ValueError):
+        previous = {}
 
+    sources = {}
+    built = 0
+    for sections in groups.values():
+        for s in sections:
+            for rel_dest, entry in load_manifest(s["save_path"], s["section"]).items():
+                if not rel_dest.endswith(".list"):
+                    continue
+                source = f"{s['section']}/{rel_dest}"
+                known = previous.get(source)
+                if known is not None and known["blob"] == entry["blob"] and all(
+                        os.path.exists(os.path.join(out_dir, a["path"])) for a in known["artifacts"].values()):
+                    sources[source] = known
+                    continue
+                rules = read_rules(os.path.join(s["save_path"], rel_dest))
+                artifacts = {}
+                for kind, (data, count) in compile_rules(rules).items():
+                    path = artifact_path(source, kind)
+                    atomic_write(os.path.join(out_dir, path), data)
+                    artifacts[kind] = {"path": path, "sha256": hashlib.sha256(data).hexdigest(), "rules": count}
+                sources[source] = {"blob": entry["blob"], "rules": len(rules), "artifacts": artifacts}
+                built += 1
+
+    stale = {a["path"] for e in previous.values() for a in e["artifacts"].values()}
+    stale -= {a["path"] for e in sources.values() for a in e["artifacts"].values()}
+    for path in stale:
+        try:
+            os.remove(os.path.join(out_dir, path))
+        except FileNotFoundError:
+            pass
+        remove_empty_dirs(os.path.join(out_dir, path), out_dir)
+
+    atomic_write(manifest_path, json.dumps({"version": 1, "sources": sources}, indent=2, sort_keys=True).encode())
+    logging.info(f"precompiled {built} of {len(sources)} rule lists into {out_dir}, removed {len(stale)} stale artifacts")
+    return sources
+
+
+def read_sections(config: configparser.ConfigParser, cache_dir: str) -> dict[tuple, list[dict]]:
+    """
+    read all config sections and group them by (url, commit, branch),
+    sections pointing at the same repository revision share one clone
+    """
+    groups = {}
+    repo_paths = {}
     for section in config.sections():
         repo = config.get(section, "name", fallback=section)
         url = config.get(section, "url")
@@ -73,34 +443,78 @@ def main():
         save_path = config.get(section, "dest", fallback=f"base/rules/{repo}")
         keep_tree = config.getboolean(section, "keep_tree", fallback=True)
 
-        logging.info(f"reading files from url {url}, matches {matches}, excludes {excludes}, save to {save_path} keep_tree {keep_tree}")
+        key = (url, commit, branch)
+        if key not in repo_paths:
+            repo_path = os.path.join(cache_dir, repo)
+            if repo_path in repo_paths.values():
+                # same name but a different repository or revision, keep the clones apart
+                repo_path += "-" + hashlib.sha1(repr(key).encode()).hexdigest()[:8]
+            repo_paths[key] = repo_path
+        groups.setdefault(key, []).append({
+            "section": section,
+            "repo_path": repo_paths[key],
+            "matches": matches,
+            "excludes": excludes,
+            "save_path": save_path,
+            "keep_tree": keep_tree,
+        })
+    return groups
 
-        repo_path = os.path.join("./tmp/repo/", repo)
 
-        r = open_repo(repo_path)
-        if r is None:
-            logging.info(f"cloning repo {url} to {repo_path}")
-            r = Repo.clone_from(url, repo_path)
-        else:
-            logging.info(f"repo {repo_path} exists")
+def sync_group(key: tuple, sections: list[dict]) -> list[dict]:
+    url, commit, branch = key
+    repo_path = sections[0]["repo_path"]
+    matches = [m for s in sections for m in s["matches"]]
+    try:
+        sync_repo(url, repo_path, commit, branch, matches)
+    except Exception as e:
+        logging.error(f"sync {url} failed {e}")
+        return []
 
-        try:
-            if commit is not None:
-                logging.info(f"checking out to commit {commit}")
-                r.git.checkout(commit)
-            elif branch is not None:
-                logging.info(f"checking out to branch {branch}")
-                r.git.checkout(branch)
-            else:
-                logging.info(f"checking out to default branch")
-                r.active_branch.checkout()
-        except Exception as e:
-            logging.error(f"checkout failed {e}")
-            continue
+    changes = []
+    for s in sections:
+        logging.info(f"reading files from url {url}, matches {s['matches']}, excludes {s['excludes']}, save to {s['save_path']} keep_tree {s['keep_tree']}")
+        changes.append(update_rules(repo_path, s["save_path"], s["matches"], s["excludes"], s["keep_tree"], s["section"]))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", default="rules_config.conf")
+    parser.add_argument("--cache-dir", default="./tmp/repo", help="where repository clones are kept between runs")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="number of repositories synced concurrently")
+    parser.add_argument("--clean", action="store_true", help="remove the clone cache after updating")
+    parser.add_argument("--changes", default=None, help="write the list of added/modified/removed files as json")
+    parser.add_argument("--precompile", default=None, metavar="DIR",
+                        help="also build Clash rule-providers and sing-box rule-sets of every synced list into DIR")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    logging.basicConfig(format="%(asctime)s %(message)s", level=logging.DEBUG)
+
+    groups = read_sections(config, args.cache_dir)
+    changes = {"added": [], "modified": [], "removed": []}
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = [executor.submit(sync_group, key, sections) for key, sections in groups.items()]
+        for future in futures:
+            try:
+                for section_changes in future.result():
+                    for kind, files in section_changes.items():
+                        changes[kind] += files
+            except Exception as e:
+                logging.error(f"update failed {e}")
+
+    logging.info(f"{len(changes['added'])} added, {len(changes['modified'])} modified, {len(changes['removed'])} removed")
+    if args.changes:
+        with open(args.changes, "w", encoding="utf-8") as f:
+            json.dump(changes, f, indent=2)
 
-        update_rules(repo_path, save_path, matches, excludes, keep_tree)
+    if args.precompile:
+        precompile_rules(groups, args.precompile)
 
-    shutil.rmtree("./tmp", ignore_errors=True)
+    if args.clean:
+        shutil.rmtree(args.cache_dir, ignore_errors=True)
 
 
 if __name__ == "__main__":
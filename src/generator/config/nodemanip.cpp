@@ -2,6 +2,10 @@
 #include <vector>
 #include <iostream>
 #include <algorithm>
+#include <cstdint>
+#include <ctime>
+#include <map>
+#include <mutex>
 
 #include "handler/settings.h"
 #include "handler/webget.h"
@@ -246,13 +250,56 @@ int addNodes(std::string link, std::vector<Proxy> &allNodes, int groupID, parse_
     return 0;
 }
 
-bool chkIgnore(const Proxy &node, string_array &exclude_remarks, string_array &include_remarks)
+/// rules whose pattern is a plain regex on the remark, compiled into one matcher and checked in a single pass
+struct CompiledRules
+{
+    std::shared_ptr<const RegexMatcher> matcher;
+    std::vector<int> index; /// position of every rule in the matcher, -1 for rules checked one by one
+    std::vector<size_t> rules; /// rule position of every pattern in the matcher
+
+    /// position of the first plain rule from start on that matches src, SIZE_MAX if there is none
+    size_t findFirst(const std::string &src, size_t start) const
+    {
+        auto first = std::lower_bound(rules.begin(), rules.end(), start);
+        if(first == rules.end())
+            return SIZE_MAX;
+        int found = matcher->findFirst(src, first - rules.begin());
+        return found < 0 ? SIZE_MAX : rules[found];
+    }
+};
+
+/// patterns are the plain regex of every rule, empty for rules that are not plain
+static CompiledRules compileRules(const string_array &patterns)
+{
+    CompiledRules compiled;
+    string_array plain;
+    compiled.index.resize(patterns.size(), -1);
+    for(size_t i = 0; i < patterns.size(); i++)
+    {
+        if(patterns[i].empty())
+            continue;
+        compiled.index[i] = plain.size();
+        compiled.rules.push_back(i);
+        plain.push_back(patterns[i]);
+    }
+    compiled.matcher = getRegexMatcher(plain);
+    return compiled;
+}
+
+static CompiledRules compileRemarkRules(const string_array &rules)
+{
+    string_array patterns;
+    for(const std::string &x : rules)
+        patterns.emplace_back(startsWith(x, "!!") ? "" : x);
+    return compileRules(patterns);
+}
+
+bool chkIgnore(const Proxy &node, const string_array &exclude_remarks, const string_array &include_remarks, const CompiledRules &exclude_rules, const CompiledRules &include_rules)
 {
     bool included;
     //std::string remarks = UTF8ToACP(node.remarks);
     //std::string remarks = node.remarks;
-    //writeLog(LOG_TYPE_INFO, "Comparing exclude remarks...");
-    bool excluded = std::any_of(exclude_remarks.cbegin(), exclude_remarks.cend(), [&node](const auto &x)
+    auto matchRule = [&node](const auto &x)
     {
         std::string real_rule;
         if (applyMatcher(x, real_rule, node))
@@ -261,20 +308,23 @@ bool chkIgnore(const Proxy &node, string_array &exclude_remarks, string_array &i
             return regFind(node.Remark, real_rule);
         }
         return false;
-    });
+    };
+    /// plain rules are checked all at once, the rest one by one
+    auto matchAny = [&](const string_array &rules, const CompiledRules &compiled)
+    {
+        if(compiled.findFirst(node.Remark, 0) != SIZE_MAX)
+            return true;
+        for(size_t i = 0; i < rules.size(); i++)
+            if(compiled.index[i] < 0 && matchRule(rules[i]))
+                return true;
+        return false;
+    };
+    //writeLog(LOG_TYPE_INFO, "Comparing exclude remarks...");
+    bool excluded = matchAny(exclude_remarks, exclude_rules);
     if(!include_remarks.empty())
     {
         //writeLog(LOG_TYPE_INFO, "Comparing include remarks...");
-        included = std::any_of(include_remarks.cbegin(), include_remarks.cend(), [&node](const auto &x)
-        {
-            std::string real_rule;
-            if(applyMatcher(x, real_rule, node))
-            {
-                if(real_rule.empty()) return true;
-                return regFind(node.Remark, real_rule);
-            }
-            return false;
-        });
+        included = matchAny(include_remarks, include_rules);
     }
     else
     {
@@ -287,10 +337,11 @@ bool chkIgnore(const Proxy &node, string_array &exclude_remarks, string_array &i
 void filterNodes(std::vector<Proxy> &nodes, string_array &exclude_remarks, string_array &include_remarks, int groupID)
 {
     int node_index = 0;
+    CompiledRules exclude_rules = compileRemarkRules(exclude_remarks), include_rules = compileRemarkRules(include_remarks);
     auto iter = nodes.begin();
     while(iter != nodes.end())
     {
-        if(chkIgnore(*iter, exclude_remarks, include_remarks))
+        if(chkIgnore(*iter, exclude_remarks, include_remarks, exclude_rules, include_rules))
         {
             writeLog(LOG_TYPE_INFO, "Node  " + iter->Group + " - " + iter->Remark + "  has been ignored and will not be added.");
             nodes.erase(iter);
@@ -388,12 +439,29 @@ void filterNodes(std::vector<Proxy> &nodes, string_array &exclude_remarks, strin
     writeLog(LOG_TYPE_INFO, "Filter done.");
 }
 
-void nodeRename(Proxy &node, const RegexMatchConfigs &rename_array, extra_settings &ext)
+void nodeRename(Proxy &node, const RegexMatchConfigs &rename_array, const CompiledRules &rename_rules, extra_settings &ext)
 {
     std::string &remark = node.Remark, original_remark = node.Remark, returned_remark, real_rule;
+    size_t next_match = SIZE_MAX; /// next plain rule matching the current remark
+    bool next_known = false;
 
-    for(const RegexMatchConfig &x : rename_array)
+    for(size_t i = 0; i < rename_array.size(); i++)
     {
+        const RegexMatchConfig &x = rename_array[i];
+        if(rename_rules.index[i] >= 0)
+        {
+            if(!next_known)
+            {
+                next_match = rename_rules.findFirst(remark, i);
+                next_known = true;
+            }
+            if(next_match != i)
+                continue;
+            remark = rename_rules.matcher->replace(rename_rules.index[i], remark, x.Replace);
+            next_known = false;
+            continue;
+        }
+        next_known = false;
         if(!x.Script.empty() && ext.authorized)
         {
             script_safe_runner(ext.js_runtime, ext.js_context, [&](qjs::Context &ctx)
@@ -440,12 +508,33 @@ std::string removeEmoji(const std::string &orig_remark)
     return remark;
 }
 
-std::string addEmoji(const Proxy &node, const RegexMatchConfigs &emoji_array, extra_settings &ext, const std::string &original_remark)
+std::string addEmoji(const Proxy &node, const RegexMatchConfigs &emoji_array, const CompiledRules &emoji_rules, extra_settings &ext, const std::string &original_remark)
 {
     std::string real_rule, ret;
+    size_t first_match = SIZE_MAX; /// first plain rule matching either remark
+    bool first_known = false;
 
-    for(const RegexMatchConfig &x : emoji_array)
+    for(size_t i = 0; i < emoji_array.size(); i++)
     {
+        const RegexMatchConfig &x = emoji_array[i];
+        if(emoji_rules.index[i] >= 0)
+        {
+            if(!first_known)
+            {
+                first_match = emoji_rules.findFirst(original_remark, i);
+                if(node.Remark != original_remark)
+                    first_match = std::min(first_match, emoji_rules.findFirst(node.Remark, i));
+                first_known = true;
+            }
+            if(first_match != i)
+                continue;
+            std::string trimmed = trim(node.Remark);
+            if(trimmed != removeEmoji(trimmed))
+                return node.Remark;
+            if(startsWith(trimmed, x.Replace) || startsWith(trimmed, x.Replace + " "))
+                return node.Remark;
+            return x.Replace + " " + node.Remark;
+        }
         Proxy origNode = node;
         origNode.Remark = original_remark;
         if(!x.Script.empty() && ext.authorized)
@@ -509,19 +598,31 @@ std::string addEmoji(const Proxy &node, const RegexMatchConfigs &emoji_array, ex
 
 void preprocessNodes(std::vector<Proxy> &nodes, extra_settings &ext)
 {
-    std::for_each(nodes.begin(), nodes.end(), [&ext](Proxy &x)
+    /// plain regex rules are compiled once for all nodes, script and !! matcher rules still run one by one
+    string_array rename_patterns, emoji_patterns;
+    for(const RegexMatchConfig &x : ext.rename_array)
+        rename_patterns.emplace_back(x.Script.empty() && !startsWith(x.Match, "!!") ? x.Match : "");
+    CompiledRules rename_rules = compileRules(rename_patterns), emoji_rules;
+    if(ext.add_emoji)
+    {
+        for(const RegexMatchConfig &x : ext.emoji_array)
+            emoji_patterns.emplace_back(x.Script.empty() && !x.Replace.empty() && !startsWith(x.Match, "!!") ? x.Match : "");
+        emoji_rules = compileRules(emoji_patterns);
+    }
+
+    std::for_each(nodes.begin(), nodes.end(), [&](Proxy &x)
     {
         std::string original_remark = x.Remark;
         if(ext.remove_emoji)
             x.Remark = trim(removeEmoji(x.Remark));
 
-        nodeRename(x, ext.rename_array, ext);
+        nodeRename(x, ext.rename_array, rename_rules, ext);
 
         if(ext.add_emoji)
         {
             Proxy tmp = x;
             tmp.Remark = x.Remark;
-            std::string added = addEmoji(tmp, ext.emoji_array, ext, original_remark);
+            std::string added = addEmoji(tmp, ext.emoji_array, emoji_rules, ext, original_remark);
             if(added != tmp.Remark)
             {
                 if(added.size() >= tmp.Remark.size() && added.compare(added.size() - tmp.Remark.size(), tmp.Remark.size(), tmp.Remark) == 0)
@@ -572,3 +673,57 @@ void preprocessNodes(std::vector<Proxy> &nodes, extra_settings &ext)
         });
     }
 }
+
+/// processed node lists kept for global.cacheNodes seconds, keyed by everything that affects them
+struct NodeCacheEntry
+{
+    time_t created;
+    ProcessedNodesPtr nodes;
+};
+
+static const size_t NODE_CACHE_MAX_ENTRIES = 128;
+static std::mutex node_cache_mutex;
+static std::map<std::string, NodeCacheEntry> node_cache;
+
+ProcessedNodesPtr getProcessedNodes(const std::string &key)
+{
+    if(global.cacheNodes <= 0)
+        return nullptr;
+    std::lock_guard<std::mutex> guard(node_cache_mutex);
+    auto iter = node_cache.find(key);
+    if(iter == node_cache.end())
+        return nullptr;
+    if(time(nullptr) - iter->second.created >= global.cacheNodes)
+    {
+        node_cache.erase(iter);
+        return nullptr;
+    }
+    return iter->second.nodes;
+}
+
+void putProcessedNodes(const std::string &key, const ProcessedNodesPtr &nodes)
+{
+    if(global.cacheNodes <= 0)
+        return;
+    time_t now = time(nullptr);
+    std::lock_guard<std::mutex> guard(node_cache_mutex);
+    for(auto iter = node_cache.begin(); iter != node_cache.end();)
+    {
+        if(now - iter->second.created >= global.cacheNodes)
+            iter = node_cache.erase(iter);
+        else
+            ++iter;
+    }
+    if(node_cache.size() >= NODE_CACHE_MAX_ENTRIES && !node_cache.contains(key))
+    {
+        auto oldest = std::min_element(node_cache.begin(), node_cache.end(), [](const auto &a, const auto &b){ return a.second.created < b.second.created; });
+        node_cache.erase(oldest);
+    }
+    node_cache[key] = {now, nodes};
+}
+
+void flushNodeCache()
+{
+    std::lock_guard<std::mutex> guard(node_cache_mutex);
+    node_cache.clear();
+}
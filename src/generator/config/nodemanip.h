@@ -3,6 +3,7 @@
 
 #include <string>
 #include <vector>
+#include <memory>
 #include <limits.h>
 
 #ifndef NO_JS_RUNTIME
@@ -13,6 +14,7 @@
 #include "parser/config/proxy.h"
 #include "utils/map_extra.h"
 #include "utils/string.h"
+#include "subexport.h"
 
 struct parse_settings
 {
@@ -37,4 +39,17 @@ void filterNodes(std::vector<Proxy> &nodes, string_array &exclude_remarks, strin
 bool applyMatcher(const std::string &rule, std::string &real_rule, const Proxy &node);
 void preprocessNodes(std::vector<Proxy> &nodes, extra_settings &ext);
 
+/// node list after fetching, filtering, renaming and sorting, ready to be exported to any target
+struct ProcessedNodes
+{
+    std::vector<Proxy> nodes;
+    std::string sub_info;
+};
+
+using ProcessedNodesPtr = std::shared_ptr<const ProcessedNodes>;
+
+ProcessedNodesPtr getProcessedNodes(const std::string &key);
+void putProcessedNodes(const std::string &key, const ProcessedNodesPtr &nodes);
+void flushNodeCache();
+
 #endif // NODEMANIP_H_INCLUDED
@@ -1,13 +1,20 @@
 #include <string>
+#include <list>
+#include <memory>
+#include <mutex>
+#include <unordered_map>
 
 #include "handler/settings.h"
 #include "utils/logger.h"
+#include "utils/md5/md5_interface.h"
 #include "utils/network.h"
 #include "utils/regexp.h"
 #include "utils/string.h"
 #include "utils/rapidjson_extra.h"
 #include "subexport.h"
 
+using guarded_mutex = std::lock_guard<std::mutex>;
+
 /// rule type lists
 #define basic_types "DOMAIN", "DOMAIN-SUFFIX", "DOMAIN-KEYWORD", "IP-CIDR", "SRC-IP-CIDR", "GEOIP", "MATCH", "FINAL"
 string_array ClashRuleTypes = {basic_types, "IP-CIDR6", "SRC-PORT", "DST-PORT", "PROCESS-NAME", "DOMAIN-REGEX", "DOMAIN-WILDCARD", "GEOSITE", "IP-SUFFIX", "IP-ASN", "SRC-GEOIP", "SRC-IP-ASN", "SRC-IP-SUFFIX", "IN-PORT", "IN-TYPE", "IN-USER", "IN-NAME", "PROCESS-PATH-REGEX", "PROCESS-PATH", "PROCESS-NAME-REGEX", "PROCESS-NAME-WILDCARD", "PROCESS-PATH-WILDCARD", "UID", "NETWORK", "DSCP", "SUB-RULE", "RULE-SET", "AND", "OR", "NOT"};
@@ -95,6 +102,113 @@ std::string convertRuleset(const std::string &content, int type)
     }
 }
 
+/// rule lines of a ruleset already converted for one target, shared by all requests using the same content
+struct ConvertedRuleset
+{
+    string_array lines;
+    std::string fragment; /// lines joined as YAML list items, only for rulesetToClashStr
+    size_t size = 0;
+};
+
+using ConvertedRulesetPtr = std::shared_ptr<const ConvertedRuleset>;
+
+static std::mutex converted_cache_mutex;
+static std::list<std::pair<std::string, ConvertedRulesetPtr>> converted_cache_list; // most recently used first
+static std::unordered_map<std::string, decltype(converted_cache_list)::iterator> converted_cache_index;
+static size_t converted_cache_bytes = 0;
+
+void flushRulesetCache()
+{
+    guarded_mutex guard(converted_cache_mutex);
+    converted_cache_list.clear();
+    converted_cache_index.clear();
+    converted_cache_bytes = 0;
+}
+
+/// look up the converted form of a ruleset by (content MD5, ruleset type, target, group), building it with convert on a miss
+/// a 64-bit std::hash could collide and silently serve the rules of another ruleset, the MD5 digest makes that practically impossible
+template <typename F>
+static ConvertedRulesetPtr getConvertedRuleset(const std::string &content, int type, const std::string &target, const std::string &group, F &&convert)
+{
+    std::string key = getMD5(content) + ":" + std::to_string(content.size()) + ":" + std::to_string(type) + ":" + target + ":" + group;
+    if(global.rulesetCacheSize)
+    {
+        guarded_mutex guard(converted_cache_mutex);
+        auto iter = converted_cache_index.find(key);
+        if(iter != converted_cache_index.end())
+        {
+            converted_cache_list.splice(converted_cache_list.begin(), converted_cache_list, iter->second);
+            return iter->second->second;
+        }
+    }
+
+    auto converted = std::make_shared<ConvertedRuleset>();
+    convert(converted->lines);
+    if(target == "clash-str")
+    {
+        for(const std::string &x : converted->lines)
+        {
+            converted->fragment += "  - ";
+            converted->fragment += x;
+            converted->fragment += "\n";
+        }
+    }
+    converted->size = key.size() + converted->fragment.size() + sizeof(ConvertedRuleset);
+    for(const std::string &x : converted->lines)
+        converted->size += x.size() + sizeof(std::string);
+    if(!global.rulesetCacheSize || converted->size > global.rulesetCacheSize)
+        return converted;
+
+    guarded_mutex guard(converted_cache_mutex);
+    auto iter = converted_cache_index.find(key);
+    if(iter != converted_cache_index.end()) // converted by another request in the meantime
+    {
+        converted_cache_bytes -= iter->second->second->size;
+        converted_cache_list.erase(iter->second);
+        converted_cache_index.erase(iter);
+    }
+    converted_cache_list.emplace_front(key, converted);
+    converted_cache_index[key] = converted_cache_list.begin();
+    converted_cache_bytes += converted->size;
+    while(converted_cache_bytes > global.rulesetCacheSize)
+    {
+        auto &oldest = converted_cache_list.back();
+        converted_cache_bytes -= oldest.second->size;
+        converted_cache_index.erase(oldest.first);
+        converted_cache_list.pop_back();
+    }
+    return converted;
+}
+
+/// convert a ruleset to Surge format and call process on every line that is neither empty nor a comment
+template <typename F>
+static void forEachRuleLine(const std::string &content, int type, F &&process)
+{
+    std::string converted = convertRuleset(content, type), strLine;
+    char delimiter = getLineBreak(converted);
+    std::stringstream strStrm;
+    strStrm<<converted;
+    std::string::size_type lineSize;
+    while(getline(strStrm, strLine, delimiter))
+    {
+        strLine = trimWhitespace(strLine, true, true); //remove whitespaces
+        lineSize = strLine.size();
+        if(!lineSize || strLine[0] == ';' || strLine[0] == '#' || (lineSize >= 2 && strLine[0] == '/' && strLine[1] == '/')) //empty lines and comments are ignored
+            continue;
+        process(strLine);
+    }
+}
+
+/// how many of count lines fit when total rules are already used, the limit check runs before every line
+static size_t allowedRules(size_t total_rules, size_t count)
+{
+    if(!global.maxAllowedRules)
+        return count;
+    if(total_rules > global.maxAllowedRules)
+        return 0;
+    return std::min(count, global.maxAllowedRules - total_rules + 1);
+}
+
 static std::string transformRuleToCommon(string_view_array &temp, const std::string &input, const std::string &group, bool no_resolve_only = false)
 {
     temp.clear();
@@ -126,7 +240,6 @@ void rulesetToClash(YAML::Node &base_rule, std::vector<RulesetContent> &ruleset_
 {
     string_array allRules;
     std::string rule_group, retrieved_rules, strLine;
-    std::stringstream strStrm;
     const std::string field_name = new_field_name ? "rules" : "Rule";
     YAML::Node rules;
     size_t total_rules = 0;
@@ -159,32 +272,23 @@ void rulesetToClash(YAML::Node &base_rule, std::vector<RulesetContent> &ruleset_
             total_rules++;
             continue;
         }
-        retrieved_rules = convertRuleset(retrieved_rules, x.rule_type);
-        char delimiter = getLineBreak(retrieved_rules);
-
-        strStrm.clear();
-        strStrm<<retrieved_rules;
-        std::string::size_type lineSize;
-        while(getline(strStrm, strLine, delimiter))
+        auto converted = getConvertedRuleset(retrieved_rules, x.rule_type, "clash", rule_group, [&](string_array &lines)
         {
-            if(global.maxAllowedRules && total_rules > global.maxAllowedRules)
-                break;
-            strLine = trimWhitespace(strLine, true, true); //remove whitespaces
-            lineSize = strLine.size();
-            if(!lineSize || strLine[0] == ';' || strLine[0] == '#' || (lineSize >= 2 && strLine[0] == '/' && strLine[1] == '/')) //empty lines and comments are ignored
-                continue;
-            if(std::none_of(ClashRuleTypes.begin(), ClashRuleTypes.end(), [strLine](const std::string& type){return startsWith(strLine, type);}))
-                continue;
-            if(strFind(strLine, "//"))
+            forEachRuleLine(retrieved_rules, x.rule_type, [&](std::string &strLine)
             {
-                strLine.erase(strLine.find("//"));
-                strLine = trimWhitespace(strLine);
-            }
-            strLine = transformRuleToCommon(temp, strLine, rule_group);
-//            if(!startsWith(strLine, "AND") && !startsWith(strLine, "OR") && !startsWith(strLine, "NOT") && count_least(strLine, ',', 3))
-//                strLine = regReplace(strLine, rule_match_regex, "$1$3$2");
-            allRules.emplace_back(strLine);
-        }
+                if(std::none_of(ClashRuleTypes.begin(), ClashRuleTypes.end(), [&strLine](const std::string& type){return startsWith(strLine, type);}))
+                    return;
+                if(strFind(strLine, "//"))
+                {
+                    strLine.erase(strLine.find("//"));
+                    strLine = trimWhitespace(strLine);
+                }
+                lines.emplace_back(transformRuleToCommon(temp, strLine, rule_group));
+//                if(!startsWith(strLine, "AND") && !startsWith(strLine, "OR") && !startsWith(strLine, "NOT") && count_least(strLine, ',', 3))
+//                    strLine = regReplace(strLine, rule_match_regex, "$1$3$2");
+            });
+        });
+        allRules.insert(allRules.end(), converted->lines.begin(), converted->lines.end());
     }
 
     for(std::string &x : allRules)
@@ -198,7 +302,6 @@ void rulesetToClash(YAML::Node &base_rule, std::vector<RulesetContent> &ruleset_
 std::string rulesetToClashStr(YAML::Node &base_rule, std::vector<RulesetContent> &ruleset_content_array, bool overwrite_original_rules, bool new_field_name)
 {
     std::string rule_group, retrieved_rules, strLine;
-    std::stringstream strStrm;
     const std::string field_name = new_field_name ? "rules" : "Rule";
     std::string output_content = "\n" + field_name + ":\n";
     size_t total_rules = 0;
@@ -236,49 +339,39 @@ std::string rulesetToClashStr(YAML::Node &base_rule, std::vector<RulesetContent>
             total_rules++;
             continue;
         }
-        retrieved_rules = convertRuleset(retrieved_rules, x.rule_type);
-        char delimiter = getLineBreak(retrieved_rules);
-
-        strStrm.clear();
-        strStrm<<retrieved_rules;
-        std::string::size_type lineSize;
-        while(getline(strStrm, strLine, delimiter))
+        auto converted = getConvertedRuleset(retrieved_rules, x.rule_type, "clash-str", rule_group, [&](string_array &lines)
         {
-            if(global.maxAllowedRules && total_rules > global.maxAllowedRules)
-                break;
-            strLine = trimWhitespace(strLine, true, true); //remove whitespaces
-            lineSize = strLine.size();
-            if(!lineSize || strLine[0] == ';' || strLine[0] == '#' || (lineSize >= 2 && strLine[0] == '/' && strLine[1] == '/')) //empty lines and comments are ignored
-                continue;
-            if(std::none_of(ClashRuleTypes.begin(), ClashRuleTypes.end(), [strLine](const std::string& type){ return startsWith(strLine, type); }))
-                continue;
-            if(strFind(strLine, "//"))
-            {
-                strLine.erase(strLine.find("//"));
-                strLine = trimWhitespace(strLine);
-            }
-            //AND & OR & NOT
-            if(startsWith(strLine, "AND") || startsWith(strLine, "OR") || startsWith(strLine, "NOT"))
-            {
-                output_content += "  - " + strLine + "," + rule_group + "\n";
-            }
-            //SUB-RULE & RULE-SET
-            else if(startsWith(strLine, "SUB-RULE") || startsWith(strLine, "RULE-SET"))
-            {
-                output_content += "  - " + strLine + "\n";
-            }
-            else
-            //OTHER
+            forEachRuleLine(retrieved_rules, x.rule_type, [&](std::string &strLine)
             {
-                strLine = transformRuleToCommon(temp, strLine, rule_group);
-                output_content += "  - " + strLine + "\n";
-            }
-//            strLine = transformRuleToCommon(temp, strLine, rule_group);
-//            if(!startsWith(strLine, "AND") && !startsWith(strLine, "OR") && !startsWith(strLine, "NOT") && count_least(strLine, ',', 3))
-//                strLine = regReplace(strLine, rule_match_regex, "$1$3$2");
-//            output_content += "  - " + strLine + "\n";
-            total_rules++;
+                if(std::none_of(ClashRuleTypes.begin(), ClashRuleTypes.end(), [&strLine](const std::string& type){ return startsWith(strLine, type); }))
+                    return;
+                if(strFind(strLine, "//"))
+                {
+                    strLine.erase(strLine.find("//"));
+                    strLine = trimWhitespace(strLine);
+                }
+                //AND & OR & NOT
+                if(startsWith(strLine, "AND") || startsWith(strLine, "OR") || startsWith(strLine, "NOT"))
+                    lines.emplace_back(strLine + "," + rule_group);
+                //SUB-RULE & RULE-SET
+                else if(startsWith(strLine, "SUB-RULE") || startsWith(strLine, "RULE-SET"))
+                    lines.emplace_back(strLine);
+                //OTHER
+                else
+                    lines.emplace_back(transformRuleToCommon(temp, strLine, rule_group));
+//                if(!startsWith(strLine, "AND") && !startsWith(strLine, "OR") && !startsWith(strLine, "NOT") && count_least(strLine, ',', 3))
+//                    strLine = regReplace(strLine, rule_match_regex, "$1$3$2");
+            });
+        });
+        size_t count = allowedRules(total_rules, converted->lines.size());
+        if(count == converted->lines.size())
+            output_content += converted->fragment;
+        else
+        {
+            for(size_t i = 0; i < count; i++)
+                output_content += "  - " + converted->lines[i] + "\n";
         }
+        total_rules += count;
     }
     return output_content;
 }
@@ -287,7 +380,6 @@ void rulesetToSurge(INIReader &base_rule, std::vector<RulesetContent> &ruleset_c
 {
     string_array allRules;
     std::string rule_group, rule_path, rule_path_typed, retrieved_rules, strLine;
-    std::stringstream strStrm;
     size_t total_rules = 0;
 
     switch(surge_ver) //other version: -3 for Surfboard, -4 for Loon
@@ -425,69 +517,61 @@ void rulesetToSurge(INIReader &base_rule, std::vector<RulesetContent> &ruleset_c
                 continue;
             }
 
-            retrieved_rules = convertRuleset(retrieved_rules, x.rule_type);
-            char delimiter = getLineBreak(retrieved_rules);
-
-            strStrm.clear();
-            strStrm<<retrieved_rules;
-            std::string::size_type lineSize;
-            while(getline(strStrm, strLine, delimiter))
+            auto converted = getConvertedRuleset(retrieved_rules, x.rule_type, "surge" + std::to_string(surge_ver), rule_group, [&](string_array &lines)
             {
-                if(global.maxAllowedRules && total_rules > global.maxAllowedRules)
-                    break;
-                strLine = trimWhitespace(strLine, true, true);
-                lineSize = strLine.size();
-                if(!lineSize || strLine[0] == ';' || strLine[0] == '#' || (lineSize >= 2 && strLine[0] == '/' && strLine[1] == '/')) //empty lines and comments are ignored
-                    continue;
-
-                /// remove unsupported types
-                switch(surge_ver)
+                forEachRuleLine(retrieved_rules, x.rule_type, [&](std::string &strLine)
                 {
-                case -2:
-                    if(startsWith(strLine, "IP-CIDR6"))
-                        continue;
-                    [[fallthrough]];
-                case -1:
-                    if(!std::any_of(QuanXRuleTypes.begin(), QuanXRuleTypes.end(), [strLine](const std::string& type){return startsWith(strLine, type);}))
-                        continue;
-                    break;
-                case -3:
-                    if(!std::any_of(SurfRuleTypes.begin(), SurfRuleTypes.end(), [strLine](const std::string& type){return startsWith(strLine, type);}))
-                        continue;
-                    break;
-                default:
-                    if(surge_ver > 2)
+                    /// remove unsupported types
+                    switch(surge_ver)
                     {
-                        if(!std::any_of(SurgeRuleTypes.begin(), SurgeRuleTypes.end(), [strLine](const std::string& type){return startsWith(strLine, type);}))
-                            continue;
+                    case -2:
+                        if(startsWith(strLine, "IP-CIDR6"))
+                            return;
+                        [[fallthrough]];
+                    case -1:
+                        if(!std::any_of(QuanXRuleTypes.begin(), QuanXRuleTypes.end(), [&strLine](const std::string& type){return startsWith(strLine, type);}))
+                            return;
+                        break;
+                    case -3:
+                        if(!std::any_of(SurfRuleTypes.begin(), SurfRuleTypes.end(), [&strLine](const std::string& type){return startsWith(strLine, type);}))
+                            return;
+                        break;
+                    default:
+                        if(surge_ver > 2)
+                        {
+                            if(!std::any_of(SurgeRuleTypes.begin(), SurgeRuleTypes.end(), [&strLine](const std::string& type){return startsWith(strLine, type);}))
+                                return;
+                        }
+                        else
+                        {
+                            if(!std::any_of(Surge2RuleTypes.begin(), Surge2RuleTypes.end(), [&strLine](const std::string& type){return startsWith(strLine, type);}))
+                                return;
+                        }
                     }
-                    else
+
+                    if(strFind(strLine, "//"))
                     {
-                        if(!std::any_of(Surge2RuleTypes.begin(), Surge2RuleTypes.end(), [strLine](const std::string& type){return startsWith(strLine, type);}))
-                            continue;
+                        strLine.erase(strLine.find("//"));
+                        strLine = trimWhitespace(strLine);
                     }
-                }
-
-                if(strFind(strLine, "//"))
-                {
-                    strLine.erase(strLine.find("//"));
-                    strLine = trimWhitespace(strLine);
-                }
 
-                if(surge_ver == -1 || surge_ver == -2)
-                {
-                    if(startsWith(strLine, "IP-CIDR6"))
-                        strLine.replace(0, 8, "IP6-CIDR");
-                    strLine = transformRuleToCommon(temp, strLine, rule_group, true);
-                }
-                else
-                {
-                    if(!startsWith(strLine, "AND") && !startsWith(strLine, "OR") && !startsWith(strLine, "NOT"))
-                        strLine = transformRuleToCommon(temp, strLine, rule_group);
-                }
-                allRules.emplace_back(strLine);
-                total_rules++;
-            }
+                    if(surge_ver == -1 || surge_ver == -2)
+                    {
+                        if(startsWith(strLine, "IP-CIDR6"))
+                            strLine.replace(0, 8, "IP6-CIDR");
+                        strLine = transformRuleToCommon(temp, strLine, rule_group, true);
+                    }
+                    else
+                    {
+                        if(!startsWith(strLine, "AND") && !startsWith(strLine, "OR") && !startsWith(strLine, "NOT"))
+                            strLine = transformRuleToCommon(temp, strLine, rule_group);
+                    }
+                    lines.emplace_back(strLine);
+                });
+            });
+            size_t count = allowedRules(total_rules, converted->lines.size());
+            allRules.insert(allRules.end(), converted->lines.begin(), converted->lines.begin() + count);
+            total_rules += count;
         }
     }
 
@@ -523,32 +607,37 @@ static rapidjson::Value transformRuleToSingBox(std::vector<std::string_view> &ar
     return rule_obj;
 }
 
-static void appendSingBoxRule(std::vector<std::string_view> &args, rapidjson::Value &rules, const std::string& rule, rapidjson::MemoryPoolAllocator<>& allocator)
+/// translate a rule to "field,value" of a sing-box rule object, empty when the type is not supported
+static std::string transformRuleToSingBoxField(std::vector<std::string_view> &args, const std::string& rule)
 {
-    using namespace rapidjson_ext;
     args.clear();
     split(args, rule, ',');
-    if (args.size() < 2) return;
+    if (args.size() < 2) return "";
     auto type = args[0];
 //    std::string_view option;
 //    if (args.size() >= 3) option = args[2];
 
     if (none_of(SingBoxRuleTypes, [&](const std::string& t){ return type == t; }))
-        return;
+        return "";
 
     auto realType = toLower(std::string(type));
     auto value = toLower(std::string(args[1]));
     realType = replaceAllDistinct(realType, "-", "_");
     realType = replaceAllDistinct(realType, "ip_cidr6", "ip_cidr");
+    return realType + "," + value;
+}
 
-    rules | AppendToArray(realType.c_str(), rapidjson::Value(value.c_str(), value.size(), allocator), allocator);
+static void appendSingBoxRule(rapidjson::Value &rules, const std::string& field, rapidjson::MemoryPoolAllocator<>& allocator)
+{
+    using namespace rapidjson_ext;
+    auto pos = field.find(',');
+    rules | AppendToArray(field.data(), pos, rapidjson::Value(field.data() + pos + 1, field.size() - pos - 1, allocator), allocator);
 }
 
 void rulesetToSingBox(rapidjson::Document &base_rule, std::vector<RulesetContent> &ruleset_content_array, bool overwrite_original_rules)
 {
     using namespace rapidjson_ext;
     std::string rule_group, retrieved_rules, strLine, final;
-    std::stringstream strStrm;
     size_t total_rules = 0;
     auto &allocator = base_rule.GetAllocator();
 
@@ -594,30 +683,24 @@ void rulesetToSingBox(rapidjson::Document &base_rule, std::vector<RulesetContent
             total_rules++;
             continue;
         }
-        retrieved_rules = convertRuleset(retrieved_rules, x.rule_type);
-        char delimiter = getLineBreak(retrieved_rules);
-
-        strStrm.clear();
-        strStrm<<retrieved_rules;
-
-        std::string::size_type lineSize;
-        rapidjson::Value rule(rapidjson::kObjectType);
-
-        while(getline(strStrm, strLine, delimiter))
+        auto converted = getConvertedRuleset(retrieved_rules, x.rule_type, "singbox", rule_group, [&](string_array &lines)
         {
-            if(global.maxAllowedRules && total_rules > global.maxAllowedRules)
-                break;
-            strLine = trimWhitespace(strLine, true, true); //remove whitespaces
-            lineSize = strLine.size();
-            if(!lineSize || strLine[0] == ';' || strLine[0] == '#' || (lineSize >= 2 && strLine[0] == '/' && strLine[1] == '/')) //empty lines and comments are ignored
-                continue;
-            if(strFind(strLine, "//"))
+            forEachRuleLine(retrieved_rules, x.rule_type, [&](std::string &strLine)
             {
-                strLine.erase(strLine.find("//"));
-                strLine = trimWhitespace(strLine);
-            }
-            appendSingBoxRule(temp, rule, strLine, allocator);
-        }
+                if(strFind(strLine, "//"))
+                {
+                    strLine.erase(strLine.find("//"));
+                    strLine = trimWhitespace(strLine);
+                }
+                std::string field = transformRuleToSingBoxField(temp, strLine);
+                if(!field.empty())
+                    lines.emplace_back(std::move(field));
+            });
+        });
+
+        rapidjson::Value rule(rapidjson::kObjectType);
+        for(const std::string &field : converted->lines)
+            appendSingBoxRule(rule, field, allocator);
         if (rule.ObjectEmpty()) continue;
         rule.AddMember("outbound", rapidjson::Value(rule_group.c_str(), allocator), allocator);
         rules.PushBack(rule, allocator);
@@ -17,6 +17,7 @@
 #include "utils/ini_reader/ini_reader.h"
 #include "utils/logger.h"
 #include "utils/network.h"
+#include "utils/rapidjson_extra.h"
 #include "utils/regexp.h"
 #include "utils/stl_extra.h"
 #include "utils/string.h"
@@ -301,7 +302,65 @@ void checkExternalBase(const std::string &path, std::string &dest)
         dest = path;
 }
 
-std::string subconverter(RESPONSE_CALLBACK_ARGS)
+static void appendKeyField(std::string &key, const std::string &value)
+{
+    key += std::to_string(value.size());
+    key += ':';
+    key += value;
+}
+
+static void appendKeyField(std::string &key, const string_array &values)
+{
+    key += std::to_string(values.size()) + "#";
+    for(const std::string &x : values)
+        appendKeyField(key, x);
+}
+
+static void appendKeyField(std::string &key, const RegexMatchConfigs &values)
+{
+    key += std::to_string(values.size()) + "#";
+    for(const RegexMatchConfig &x : values)
+    {
+        appendKeyField(key, x.Match);
+        appendKeyField(key, x.Replace);
+        appendKeyField(key, x.Script);
+    }
+}
+
+/// everything that changes the node list before it is exported, so that requests for different targets share it.
+/// like the subscription cache the client's headers are left out, client_user_agent is only set when subscriptions are not cached
+static std::string nodeCacheKey(const std::string &urls, const std::string &insert_urls, bool prepend_insert, const std::string &proxy,
+                                const string_array &include_remarks, const string_array &exclude_remarks, const RegexMatchConfigs &stream_rules,
+                                const RegexMatchConfigs &time_rules, bool authorized, const std::string &user_agent, const std::string &client_user_agent,
+                                const std::string &age_key, const std::string &filter_script, const std::string &group_name, const extra_settings &ext)
+{
+    std::string key;
+    appendKeyField(key, urls);
+    appendKeyField(key, insert_urls);
+    appendKeyField(key, proxy);
+    appendKeyField(key, include_remarks);
+    appendKeyField(key, exclude_remarks);
+    appendKeyField(key, stream_rules);
+    appendKeyField(key, time_rules);
+    appendKeyField(key, user_agent);
+    appendKeyField(key, client_user_agent);
+    appendKeyField(key, age_key);
+    appendKeyField(key, filter_script);
+    appendKeyField(key, group_name);
+    appendKeyField(key, ext.rename_array);
+    if(ext.add_emoji)
+        appendKeyField(key, ext.emoji_array);
+    appendKeyField(key, ext.sort_flag ? ext.sort_script : "");
+    key += prepend_insert ? '1' : '0';
+    key += authorized ? '1' : '0';
+    key += ext.add_emoji ? '1' : '0';
+    key += ext.remove_emoji ? '1' : '0';
+    key += ext.sort_flag ? '1' : '0';
+    return key;
+}
+
+/// convert to the target in the request, node lists already processed by earlier targets of the same call are taken from parsed_nodes
+static std::string convertSubscription(RESPONSE_CALLBACK_ARGS, std::map<std::string, ProcessedNodesPtr> *parsed_nodes)
 {
     auto &argument = request.argument;
     int *status_code = &response.status_code;
@@ -600,37 +659,83 @@ std::string subconverter(RESPONSE_CALLBACK_ARGS)
     //start parsing urls
     RegexMatchConfigs stream_temp = safe_get_streams(), time_temp = safe_get_times();
 
-    //loading urls
-    string_array urls;
-    std::vector<Proxy> nodes, insert_nodes;
-    int groupID = 0;
-
-    parse_settings parse_set;
-    parse_set.proxy = &proxy;
-    parse_set.exclude_remarks = &lExcludeRemarks;
-    parse_set.include_remarks = &lIncludeRemarks;
-    parse_set.stream_rules = &stream_temp;
-    parse_set.time_rules = &time_temp;
-    parse_set.sub_info = &subInfo;
-    parse_set.authorized = authorized;
-    parse_set.request_header = &request.headers;
-    parse_set.custom_user_agent = &argUserAgent;
-    parse_set.age_secret_key = &argAgeKey;
-    parse_set.js_runtime = ext.js_runtime;
-    parse_set.js_context = ext.js_context;
-
-    if(!global.insertUrls.empty() && argEnableInsert)
+    //reuse the node list processed for the same subscriptions and node settings
+    std::vector<Proxy> nodes;
+    argPrependInsert.define(global.prependInsert);
+    std::string filterScript = global.filterScript;
+    if(authorized && !argFilterScript.empty())
+        filterScript = argFilterScript;
+    std::string client_user_agent = global.cacheSubscription > 0 ? "" : request.headers["User-Agent"];
+    std::string nodes_key = nodeCacheKey(argUrl, argEnableInsert ? global.insertUrls : "", argPrependInsert, proxy, lIncludeRemarks, lExcludeRemarks, stream_temp, time_temp, authorized, argUserAgent, client_user_agent, argAgeKey, filterScript, argGroupName, ext);
+    ProcessedNodesPtr cached_nodes;
+    if(parsed_nodes && parsed_nodes->contains(nodes_key))
+        cached_nodes = parsed_nodes->at(nodes_key);
+    else
+        cached_nodes = getProcessedNodes(nodes_key);
+    if(cached_nodes)
+    {
+        writeLog(0, "Using processed node list from cache.", LOG_LEVEL_INFO);
+        nodes = cached_nodes->nodes;
+        subInfo = cached_nodes->sub_info;
+        if(parsed_nodes)
+            (*parsed_nodes)[nodes_key] = cached_nodes;
+    }
+    else
     {
-        groupID = -1;
-        urls = split(global.insertUrls, "|");
+        //loading urls
+        string_array urls;
+        std::vector<Proxy> insert_nodes;
+        int groupID = 0;
+
+        parse_settings parse_set;
+        parse_set.proxy = &proxy;
+        parse_set.exclude_remarks = &lExcludeRemarks;
+        parse_set.include_remarks = &lIncludeRemarks;
+        parse_set.stream_rules = &stream_temp;
+        parse_set.time_rules = &time_temp;
+        parse_set.sub_info = &subInfo;
+        parse_set.authorized = authorized;
+        parse_set.request_header = &request.headers;
+        parse_set.custom_user_agent = &argUserAgent;
+        parse_set.age_secret_key = &argAgeKey;
+        parse_set.js_runtime = ext.js_runtime;
+        parse_set.js_context = ext.js_context;
+
+        if(!global.insertUrls.empty() && argEnableInsert)
+        {
+            groupID = -1;
+            urls = split(global.insertUrls, "|");
+            // Remove empty urls
+            urls.erase(std::remove_if(urls.begin(), urls.end(), [](const std::string& str) { return str.empty(); }), urls.end());
+            importItems(urls, true);
+            for(std::string &x : urls)
+            {
+                x = regTrim(x);
+                writeLog(0, "Fetching node data from url '" + x + "'.", LOG_LEVEL_INFO);
+                if(addNodes(x, insert_nodes, groupID, parse_set) == -1)
+                {
+                    if(global.skipFailedLinks)
+                        writeLog(0, "The following link doesn't contain any valid node info: " + x, LOG_LEVEL_WARNING);
+                    else
+                    {
+                        *status_code = 400;
+                        return "The following link doesn't contain any valid node info: " + x;
+                    }
+                }
+                groupID--;
+            }
+        }
+        urls = split(argUrl, "|");
         // Remove empty urls
         urls.erase(std::remove_if(urls.begin(), urls.end(), [](const std::string& str) { return str.empty(); }), urls.end());
         importItems(urls, true);
+        groupID = 0;
         for(std::string &x : urls)
         {
             x = regTrim(x);
+            //std::cerr<<"Fetching node data from url '"<<x<<"'."<<std::endl;
             writeLog(0, "Fetching node data from url '" + x + "'.", LOG_LEVEL_INFO);
-            if(addNodes(x, insert_nodes, groupID, parse_set) == -1)
+            if(addNodes(x, nodes, groupID, parse_set) == -1)
             {
                 if(global.skipFailedLinks)
                     writeLog(0, "The following link doesn't contain any valid node info: " + x, LOG_LEVEL_WARNING);
@@ -640,106 +745,93 @@ std::string subconverter(RESPONSE_CALLBACK_ARGS)
                     return "The following link doesn't contain any valid node info: " + x;
                 }
             }
-            groupID--;
+            groupID++;
         }
-    }
-    urls = split(argUrl, "|");
-    // Remove empty urls
-    urls.erase(std::remove_if(urls.begin(), urls.end(), [](const std::string& str) { return str.empty(); }), urls.end());
-    importItems(urls, true);
-    groupID = 0;
-    for(std::string &x : urls)
-    {
-        x = regTrim(x);
-        //std::cerr<<"Fetching node data from url '"<<x<<"'."<<std::endl;
-        writeLog(0, "Fetching node data from url '" + x + "'.", LOG_LEVEL_INFO);
-        if(addNodes(x, nodes, groupID, parse_set) == -1)
+        //exit if found nothing
+        if(nodes.empty() && insert_nodes.empty())
         {
-            if(global.skipFailedLinks)
-                writeLog(0, "The following link doesn't contain any valid node info: " + x, LOG_LEVEL_WARNING);
-            else
-            {
-                *status_code = 400;
-                return "The following link doesn't contain any valid node info: " + x;
-            }
+            *status_code = 400;
+            return "No nodes were found!";
         }
-        groupID++;
-    }
-    //exit if found nothing
-    if(nodes.empty() && insert_nodes.empty())
-    {
-        *status_code = 400;
-        return "No nodes were found!";
-    }
-    if(!subInfo.empty() && argAppendUserinfo.get(global.appendUserinfo))
-        response.headers.emplace("Subscription-UserInfo", subInfo);
-
-    if(request.method == "HEAD")
-        return "";
-
-    argPrependInsert.define(global.prependInsert);
-    if(argPrependInsert)
-    {
-        std::move(nodes.begin(), nodes.end(), std::back_inserter(insert_nodes));
-        nodes.swap(insert_nodes);
-    }
-    else
-    {
-        std::move(insert_nodes.begin(), insert_nodes.end(), std::back_inserter(nodes));
-    }
-    //run filter script
-    std::string filterScript = global.filterScript;
-    if(authorized && !argFilterScript.empty())
-        filterScript = argFilterScript;
-    if(!filterScript.empty())
-    {
-        if(startsWith(filterScript, "path:"))
-            filterScript = fileGet(filterScript.substr(5), false);
-        /*
-        duk_context *ctx = duktape_init();
-        if(ctx)
+        //nothing would reuse the processed list, answer HEAD before filtering and preprocessing
+        if(request.method == "HEAD" && global.cacheNodes <= 0)
         {
-            defer(duk_destroy_heap(ctx);)
-            if(duktape_peval(ctx, filterScript) == 0)
-            {
-                auto filter = [&](const Proxy &x)
-                {
-                    duk_get_global_string(ctx, "filter");
-                    duktape_push_Proxy(ctx, x);
-                    duk_pcall(ctx, 1);
-                    return !duktape_get_res_bool(ctx);
-                };
-                nodes.erase(std::remove_if(nodes.begin(), nodes.end(), filter), nodes.end());
-            }
-            else
-            {
-                writeLog(0, "Error when trying to parse script:\n" + duktape_get_err_stack(ctx), LOG_LEVEL_ERROR);
-                duk_pop(ctx); /// pop err
-            }
+            if(!subInfo.empty() && argAppendUserinfo.get(global.appendUserinfo))
+                response.headers.emplace("Subscription-UserInfo", subInfo);
+            return "";
+        }
+        if(argPrependInsert)
+        {
+            std::move(nodes.begin(), nodes.end(), std::back_inserter(insert_nodes));
+            nodes.swap(insert_nodes);
+        }
+        else
+        {
+            std::move(insert_nodes.begin(), insert_nodes.end(), std::back_inserter(nodes));
         }
-        */
-        script_safe_runner(ext.js_runtime, ext.js_context, [&](qjs::Context &ctx)
+        //run filter script
+        if(!filterScript.empty())
         {
-            try
+            if(startsWith(filterScript, "path:"))
+                filterScript = fileGet(filterScript.substr(5), false);
+            /*
+            duk_context *ctx = duktape_init();
+            if(ctx)
             {
-                ctx.eval(filterScript);
-                auto filter = (std::function<bool(const Proxy&)>) ctx.eval("filter");
-                nodes.erase(std::remove_if(nodes.begin(), nodes.end(), filter), nodes.end());
+                defer(duk_destroy_heap(ctx);)
+                if(duktape_peval(ctx, filterScript) == 0)
+                {
+                    auto filter = [&](const Proxy &x)
+                    {
+                        duk_get_global_string(ctx, "filter");
+                        duktape_push_Proxy(ctx, x);
+                        duk_pcall(ctx, 1);
+                        return !duktape_get_res_bool(ctx);
+                    };
+                    nodes.erase(std::remove_if(nodes.begin(), nodes.end(), filter), nodes.end());
+                }
+                else
+                {
+                    writeLog(0, "Error when trying to parse script:\n" + duktape_get_err_stack(ctx), LOG_LEVEL_ERROR);
+                    duk_pop(ctx); /// pop err
+                }
             }
-            catch(qjs::exception)
+            */
+            script_safe_runner(ext.js_runtime, ext.js_context, [&](qjs::Context &ctx)
             {
-                script_print_stack(ctx);
-            }
-        }, global.scriptCleanContext);
-    }
+                try
+                {
+                    ctx.eval(filterScript);
+                    auto filter = (std::function<bool(const Proxy&)>) ctx.eval("filter");
+                    nodes.erase(std::remove_if(nodes.begin(), nodes.end(), filter), nodes.end());
+                }
+                catch(qjs::exception)
+                {
+                    script_print_stack(ctx);
+                }
+            }, global.scriptCleanContext);
+        }
 
-    //check custom group name
-    if(!argGroupName.empty())
-        for(Proxy &x : nodes)
-            x.Group = argGroupName;
+        //check custom group name
+        if(!argGroupName.empty())
+            for(Proxy &x : nodes)
+                x.Group = argGroupName;
 
-    //do pre-process now
-    preprocessNodes(nodes, ext);
+        //do pre-process now
+        preprocessNodes(nodes, ext);
+
+        auto processed = std::make_shared<ProcessedNodes>();
+        processed->nodes = nodes;
+        processed->sub_info = subInfo;
+        putProcessedNodes(nodes_key, processed);
+        if(parsed_nodes)
+            (*parsed_nodes)[nodes_key] = processed;
+    }
+    if(!subInfo.empty() && argAppendUserinfo.get(global.appendUserinfo))
+        response.headers.emplace("Subscription-UserInfo", subInfo);
+
+    if(request.method == "HEAD")
+        return "";
 
     /*
     //insert node info to template
@@ -974,6 +1066,64 @@ std::string subconverter(RESPONSE_CALLBACK_ARGS)
     return output_content;
 }
 
+std::string subconverter(RESPONSE_CALLBACK_ARGS)
+{
+    return convertSubscription(request, response, nullptr);
+}
+
+std::string subconverterMulti(RESPONSE_CALLBACK_ARGS)
+{
+    using namespace rapidjson_ext;
+    string_array targets;
+    for(std::string &x : split(getUrlArg(request.argument, "target"), ","))
+    {
+        x = trim(x);
+        if(!x.empty() && std::find(targets.begin(), targets.end(), x) == targets.end())
+            targets.emplace_back(x);
+    }
+    rapidjson::Document json;
+    json.SetObject();
+    auto &allocator = json.GetAllocator();
+    if(targets.empty())
+    {
+        response.status_code = 400;
+        json.AddMember("error", "Invalid target!", allocator);
+        return json | SerializeObject();
+    }
+
+    /// the subscriptions are fetched and processed once, every target is generated from the same node list
+    /// a target that fails gets {"status": code, "error": message} instead of its content, the others are still generated
+    std::map<std::string, ProcessedNodesPtr> parsed_nodes;
+    int failed_status = 0;
+    bool any_success = false;
+    for(std::string &target : targets)
+    {
+        Request target_request = request;
+        target_request.argument.erase("target");
+        target_request.argument.emplace("target", target);
+        Response target_response;
+        std::string content = convertSubscription(target_request, target_response, &parsed_nodes);
+        if(target_response.status_code != 200)
+        {
+            if(!failed_status)
+                failed_status = target_response.status_code;
+            rapidjson::Value error(rapidjson::kObjectType);
+            error.AddMember("status", target_response.status_code, allocator);
+            error.AddMember("error", rapidjson::Value(content.c_str(), content.size(), allocator), allocator);
+            json.AddMember(rapidjson::Value(target.c_str(), allocator), error, allocator);
+            continue;
+        }
+        any_success = true;
+        auto iter = target_response.headers.find("Subscription-UserInfo");
+        if(iter != target_response.headers.end())
+            response.headers[iter->first] = iter->second;
+        json.AddMember(rapidjson::Value(target.c_str(), allocator), rapidjson::Value(content.c_str(), content.size(), allocator), allocator);
+    }
+    if(!any_success)
+        response.status_code = failed_status;
+    return json | SerializeObject();
+}
+
 std::string simpleToClashR(RESPONSE_CALLBACK_ARGS)
 {
     auto argument = joinArguments(request.argument);
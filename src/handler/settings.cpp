@@ -1,16 +1,24 @@
 #include <string>
 #include <mutex>
+#include <atomic>
+#include <thread>
+#include <cstdio>
+#include <sys/stat.h>
 #include <toml.hpp>
 
 #include "config/binding.h"
 #include "handler/webget.h"
 #include "script/cron.h"
 #include "server/webserver.h"
+#include "utils/defer.h"
 #include "utils/logger.h"
+#include "utils/md5/md5_interface.h"
 #include "utils/network.h"
+#include "utils/rapidjson_extra.h"
 #include "interfaces.h"
 #include "multithread.h"
 #include "settings.h"
+#include "version.h"
 
 //multi-thread lock
 std::mutex gMutexConfigure;
@@ -22,6 +30,234 @@ extern WebServer webServer;
 const std::map<std::string, ruleset_type> RulesetTypes = {{"clash-domain:", RULESET_CLASH_DOMAIN}, {"clash-ipcidr:", RULESET_CLASH_IPCIDR}, {"clash-classic:", RULESET_CLASH_CLASSICAL}, \
             {"quanx:", RULESET_QUANX}, {"surge:", RULESET_SURGE}};
 
+/// one file or url captured by the warm start snapshot: local files are checked against their mtime and size,
+/// falling back to the md5 of their content, remote ones stay valid for the cache TTL counted from when they were fetched
+struct SnapshotEntry
+{
+    std::string content;
+    bool local = false;
+    time_t mtime = 0;
+    long long size = 0;
+    std::string hash;
+};
+
+static std::mutex snapshot_mutex, snapshot_write_mutex;
+/// entries read from the snapshot at startup, each one is handed out once and the rest dropped after the first load
+static std::map<std::string, SnapshotEntry> snapshot_entries;
+/// imports seen by the last readConf and fetch times of the rulesets of the last refreshRulesets, written by saveSnapshot
+static std::map<std::string, SnapshotEntry> snapshot_imports;
+static std::map<std::string, time_t> snapshot_ruleset_times;
+static bool snapshot_conf_loaded = false;
+/// set while readConf loads the pref, imports made by requests (insert urls, external configs) are never recorded
+static thread_local bool snapshot_recording = false;
+static std::atomic<unsigned int> snapshot_generation {0};
+
+static bool makeSnapshotEntry(const std::string &path, std::string content, bool local, time_t fetched, SnapshotEntry &entry)
+{
+    entry = {std::move(content), local, fetched};
+    if(local)
+    {
+        struct stat st {};
+        // a file changed while or after it was read can not be told apart from its snapshot by the mtime
+        if(stat(path.data(), &st) != 0 || st.st_mtime >= fetched)
+            return false;
+        entry.mtime = st.st_mtime;
+        entry.size = st.st_size;
+    }
+    entry.hash = getMD5(entry.content);
+    return true;
+}
+
+static bool takeSnapshotEntry(const std::string &path, int cache_ttl, std::string &content, time_t &fetched)
+{
+    SnapshotEntry entry;
+    {
+        guarded_mutex guard(snapshot_mutex);
+        auto iter = snapshot_entries.find(path);
+        if(iter == snapshot_entries.end())
+            return false;
+        entry = std::move(iter->second);
+        snapshot_entries.erase(iter);
+    }
+    if(entry.local)
+    {
+        struct stat st {};
+        if(stat(path.data(), &st) != 0)
+            return false;
+        if(st.st_mtime != entry.mtime || st.st_size != entry.size)
+        {
+            // copied or touched files are still used as long as their content did not change
+            std::string current = fileGet(path, true);
+            if(getMD5(current) != entry.hash)
+                return false;
+            entry.content.swap(current);
+        }
+        fetched = time(nullptr);
+    }
+    else
+    {
+        if(cache_ttl <= 0 || difftime(time(nullptr), entry.mtime) > cache_ttl)
+            return false;
+        fetched = entry.mtime;
+    }
+    content.swap(entry.content);
+    return true;
+}
+
+static std::string fetchImport(const std::string &path, bool scope_limit)
+{
+    std::string content;
+    time_t fetched = time(nullptr);
+    bool local = fileExist(path);
+    if(snapshot_recording && takeSnapshotEntry(path, global.cacheConfig, content, fetched))
+        writeLog(0, "Using snapshot of " + path);
+    else if(local)
+        content = fileGet(path, scope_limit);
+    else if(isLink(path))
+    {
+        content = webGet(path, parseProxy(global.proxyConfig), global.cacheConfig);
+        // content may come from the webGet cache, its age counts from the original download, uncached content is not recorded
+        if(!getCacheTime(path, fetched))
+            return content;
+    }
+    else
+        writeLog(0, "File not found or not a valid URL: " + path, LOG_LEVEL_ERROR);
+    SnapshotEntry entry;
+    if(snapshot_recording && !content.empty() && makeSnapshotEntry(path, content, local, fetched, entry))
+    {
+        guarded_mutex guard(snapshot_mutex);
+        snapshot_imports[path] = std::move(entry);
+    }
+    return content;
+}
+
+bool loadSnapshot(const std::string &path)
+{
+    std::string data = fileGet(path);
+    if(data.empty())
+        return false;
+    rapidjson::Document json;
+    json.Parse(data.data(), data.size());
+    if(json.HasParseError() || !json.IsObject())
+    {
+        writeLog(0, "Unable to parse warm start snapshot '" + path + "': " + rapidjson::GetParseError_En(json.GetParseError()), LOG_LEVEL_WARNING);
+        return false;
+    }
+    if(GetMember(json, "version") != VERSION || !json.HasMember("files") || !json["files"].IsArray())
+    {
+        writeLog(0, "Ignoring warm start snapshot '" + path + "' written by another version.", LOG_LEVEL_WARNING);
+        return false;
+    }
+    std::map<std::string, SnapshotEntry> entries;
+    for(const rapidjson::Value &x : json["files"].GetArray())
+    {
+        if(!x.IsObject() || !x.HasMember("content") || !x["content"].IsString())
+            continue;
+        SnapshotEntry entry;
+        entry.content.assign(x["content"].GetString(), x["content"].GetStringLength());
+        entry.local = GetMember(x, "local") == "true";
+        if(x.HasMember("mtime") && x["mtime"].IsInt64())
+            entry.mtime = x["mtime"].GetInt64();
+        if(x.HasMember("size") && x["size"].IsInt64())
+            entry.size = x["size"].GetInt64();
+        entry.hash = GetMember(x, "md5");
+        if(getMD5(entry.content) != entry.hash)
+            continue;
+        entries[GetMember(x, "path")] = std::move(entry);
+    }
+    writeLog(0, "Loaded " + std::to_string(entries.size()) + " file(s) from warm start snapshot '" + path + "'.", LOG_LEVEL_INFO);
+    guarded_mutex guard(snapshot_mutex);
+    snapshot_entries.swap(entries);
+    return true;
+}
+
+void saveSnapshot(const std::string &path)
+{
+    std::vector<std::pair<std::string, SnapshotEntry>> files;
+    std::vector<RulesetContent> rulesets = global.rulesetsContent;
+    std::map<std::string, time_t> ruleset_times;
+    {
+        guarded_mutex guard(snapshot_mutex);
+        // whatever the first load did not use is stale by now
+        eraseElements(snapshot_entries);
+        if(!snapshot_conf_loaded)
+        {
+            writeLog(0, "Preference settings were not loaded, not writing warm start snapshot.", LOG_LEVEL_WARNING);
+            return;
+        }
+        files.assign(snapshot_imports.begin(), snapshot_imports.end());
+        ruleset_times = snapshot_ruleset_times;
+    }
+    // remote rulesets may still be downloading, wait for them without holding up the caller
+    unsigned int generation = ++snapshot_generation;
+    std::thread([path, generation, files = std::move(files), rulesets = std::move(rulesets), ruleset_times = std::move(ruleset_times)]() mutable
+    {
+        for(RulesetContent &x : rulesets)
+        {
+            auto iter = ruleset_times.find(x.rule_path);
+            if(x.rule_path.empty() || iter == ruleset_times.end())
+                continue;
+            SnapshotEntry entry;
+            std::string content = x.rule_content.get();
+            bool local = fileExist(x.rule_path, true);
+            time_t fetched = iter->second;
+            // downloaded rulesets are as old as their webGet cache entry, which may predate this load
+            if(content.empty() || (!local && !fetched && !getCacheTime(x.rule_path, fetched)))
+                continue;
+            if(makeSnapshotEntry(x.rule_path, std::move(content), local, fetched, entry))
+                files.emplace_back(x.rule_path, std::move(entry));
+        }
+
+        rapidjson::StringBuffer sb;
+        rapidjson::Writer<rapidjson::StringBuffer> writer(sb);
+        writer.StartObject();
+        writer.Key("version");
+        writer.String(VERSION);
+        writer.Key("files");
+        writer.StartArray();
+        for(const auto &x : files)
+        {
+            writer.StartObject();
+            writer.Key("path");
+            writer.String(x.first.data(), x.first.size());
+            writer.Key("local");
+            writer.Bool(x.second.local);
+            writer.Key("mtime");
+            writer.Int64(x.second.mtime);
+            writer.Key("size");
+            writer.Int64(x.second.size);
+            writer.Key("md5");
+            writer.String(x.second.hash.data(), x.second.hash.size());
+            writer.Key("content");
+            writer.String(x.second.content.data(), x.second.content.size());
+            writer.EndObject();
+        }
+        writer.EndArray();
+        writer.EndObject();
+
+        // a half written snapshot must never be picked up, so write next to it and swap it in
+        guarded_mutex guard(snapshot_write_mutex);
+        if(generation != snapshot_generation)
+            return; // a later load is writing its own snapshot
+        std::string temp = path + ".tmp";
+        std::FILE *fp = std::fopen(temp.data(), "wb");
+        if(fp == nullptr)
+        {
+            writeLog(0, "Unable to write warm start snapshot '" + path + "'.", LOG_LEVEL_WARNING);
+            return;
+        }
+        bool written = std::fwrite(sb.GetString(), 1, sb.GetSize(), fp) == sb.GetSize();
+        written = std::fclose(fp) == 0 && written;
+        if(!written || std::rename(temp.data(), path.data()) != 0)
+        {
+            std::remove(temp.data());
+            writeLog(0, "Unable to write warm start snapshot '" + path + "'.", LOG_LEVEL_WARNING);
+            return;
+        }
+        writeLog(0, "Warm start snapshot '" + path + "' written with " + std::to_string(files.size()) + " file(s).", LOG_LEVEL_INFO);
+    }).detach();
+}
+
 int importItems(string_array &target, bool scope_limit)
 {
     string_array result;
@@ -38,14 +274,7 @@ int importItems(string_array &target, bool scope_limit)
         path = x.substr(x.find(":") + 1);
         writeLog(0, "Trying to import items from " + path);
 
-        std::string proxy = parseProxy(global.proxyConfig);
-
-        if(fileExist(path))
-            content = fileGet(path, scope_limit);
-        else if(isLink(path))
-            content = webGet(path, proxy, global.cacheConfig);
-        else
-            writeLog(0, "File not found or not a valid URL: " + path, LOG_LEVEL_ERROR);
+        content = fetchImport(path, scope_limit);
         if(content.empty())
             return -1;
 
@@ -82,7 +311,6 @@ void importItems(std::vector<toml::value> &root, const std::string &import_key,
     auto iter = root.begin();
     size_t count = 0;
 
-    std::string proxy = parseProxy(global.proxyConfig);
     while(iter != root.end())
     {
         auto& table = iter->as_table();
@@ -92,12 +320,7 @@ void importItems(std::vector<toml::value> &root, const std::string &import_key,
         {
             const std::string &path = toml::get<std::string>(table.at("import"));
             writeLog(0, "Trying to import items from " + path);
-            if(fileExist(path))
-                content = fileGet(path, scope_limit);
-            else if(isLink(path))
-                content = webGet(path, proxy, global.cacheConfig);
-            else
-                writeLog(0, "File not found or not a valid URL: " + path, LOG_LEVEL_ERROR);
+            content = fetchImport(path, scope_limit);
             if(!content.empty())
             {
                 auto items = parseToml(content, path);
@@ -250,6 +473,9 @@ void refreshRulesets(RulesetConfigs &ruleset_list, std::vector<RulesetContent> &
     eraseElements(ruleset_content_array);
     std::string rule_group, rule_url, rule_url_typed, interval;
     RulesetContent rc;
+    std::map<std::string, time_t> ruleset_times;
+    // per-request rulesets of external configs are not part of the snapshot
+    bool recording = &ruleset_content_array == &global.rulesetsContent;
 
     std::string proxy = parseProxy(global.proxyRuleset);
 
@@ -273,12 +499,32 @@ void refreshRulesets(RulesetConfigs &ruleset_list, std::vector<RulesetContent> &
                 rule_url.erase(0, iter->first.size());
                 type = iter->second;
             }
-            writeLog(0, "Updating ruleset url '" + rule_url + "' with group '" + rule_group + "'.", LOG_LEVEL_INFO);
-            rc = {rule_group, rule_url, rule_url_typed, type, fetchFileAsync(rule_url, proxy, global.cacheRuleset, true, global.asyncFetchRuleset), x.Interval};
+            std::string content;
+            time_t fetched = time(nullptr);
+            if(recording && takeSnapshotEntry(rule_url, global.cacheRuleset, content, fetched))
+            {
+                writeLog(0, "Loading ruleset url '" + rule_url + "' with group '" + rule_group + "' from snapshot.", LOG_LEVEL_INFO);
+                std::promise<std::string> ready;
+                ready.set_value(std::move(content));
+                rc = {rule_group, rule_url, rule_url_typed, type, ready.get_future().share(), x.Interval};
+            }
+            else
+            {
+                writeLog(0, "Updating ruleset url '" + rule_url + "' with group '" + rule_group + "'.", LOG_LEVEL_INFO);
+                rc = {rule_group, rule_url, rule_url_typed, type, fetchFileAsync(rule_url, proxy, global.cacheRuleset, true, global.asyncFetchRuleset), x.Interval};
+                if(!fileExist(rule_url, true))
+                    fetched = 0; // looked up in the webGet cache once the download finished
+            }
+            ruleset_times[rule_url] = fetched;
         }
         ruleset_content_array.emplace_back(std::move(rc));
     }
     ruleset_content_array.shrink_to_fit();
+    if(recording)
+    {
+        guarded_mutex guard(snapshot_mutex);
+        snapshot_ruleset_times.swap(ruleset_times);
+    }
 }
 
 void readYAMLConf(YAML::Node &node)
@@ -554,11 +800,14 @@ void readYAMLConf(YAML::Node &node)
                 node["advanced"]["cache_subscription"] >> global.cacheSubscription;
                 node["advanced"]["cache_config"] >> global.cacheConfig;
                 node["advanced"]["cache_ruleset"] >> global.cacheRuleset;
+                node["advanced"]["cache_nodes"] >> global.cacheNodes;
                 node["advanced"]["serve_cache_on_fetch_fail"] >> global.serveCacheOnFetchFail;
+                node["advanced"]["cache_memory_size"] >> global.cacheMemorySize;
             }
             else
-                global.cacheSubscription = global.cacheConfig = global.cacheRuleset = 0; //disable cache
+                global.cacheSubscription = global.cacheConfig = global.cacheRuleset = global.cacheNodes = 0; //disable cache
         }
+        node["advanced"]["ruleset_cache_size"] >> global.rulesetCacheSize;
         node["advanced"]["script_clean_context"] >> global.scriptCleanContext;
         node["advanced"]["async_fetch_ruleset"] >> global.asyncFetchRuleset;
         node["advanced"]["skip_failed_links"] >> global.skipFailedLinks;
@@ -724,7 +973,7 @@ void readTOMLConf(toml::value &root)
 
     std::string log_level;
     bool enable_cache = true;
-    int cache_subscription = global.cacheSubscription, cache_config = global.cacheConfig, cache_ruleset = global.cacheRuleset;
+    int cache_subscription = global.cacheSubscription, cache_config = global.cacheConfig, cache_ruleset = global.cacheRuleset, cache_nodes = global.cacheNodes;
 
     find_if_exist(section_advanced,
                   "log_level", log_level,
@@ -738,6 +987,9 @@ void readTOMLConf(toml::value &root)
                   "cache_subscription", cache_subscription,
                   "cache_config", cache_config,
                   "cache_ruleset", cache_ruleset,
+                  "cache_nodes", cache_nodes,
+                  "cache_memory_size", global.cacheMemorySize,
+                  "ruleset_cache_size", global.rulesetCacheSize,
                   "script_clean_context", global.scriptCleanContext,
                   "async_fetch_ruleset", global.asyncFetchRuleset,
                   "skip_failed_links", global.skipFailedLinks
@@ -774,10 +1026,11 @@ void readTOMLConf(toml::value &root)
         global.cacheSubscription = cache_subscription;
         global.cacheConfig = cache_config;
         global.cacheRuleset = cache_ruleset;
+        global.cacheNodes = cache_nodes;
     }
     else
     {
-        global.cacheSubscription = global.cacheConfig = global.cacheRuleset = 0;
+        global.cacheSubscription = global.cacheConfig = global.cacheRuleset = global.cacheNodes = 0;
     }
 
     writeLog(0, "Load preference settings in TOML format completed.", LOG_LEVEL_INFO);
@@ -792,6 +1045,13 @@ void readConf()
     eraseElements(global.includeRemarks);
     eraseElements(global.customProxyGroups);
     eraseElements(global.customRulesets);
+    {
+        guarded_mutex guard(snapshot_mutex);
+        eraseElements(snapshot_imports);
+        snapshot_conf_loaded = true;
+    }
+    snapshot_recording = true;
+    defer(snapshot_recording = false;)
 
     try
     {
@@ -826,6 +1086,8 @@ void readConf()
     if(retVal != INIREADER_EXCEPTION_NONE)
     {
         writeLog(0, "Unable to load preference settings as INI. Reason: " + ini.get_last_error(), LOG_LEVEL_FATAL);
+        guarded_mutex guard(snapshot_mutex);
+        snapshot_conf_loaded = false;
         return;
     }
 
@@ -1059,14 +1321,17 @@ void readConf()
             ini.get_int_if_exist("cache_subscription", global.cacheSubscription);
             ini.get_int_if_exist("cache_config", global.cacheConfig);
             ini.get_int_if_exist("cache_ruleset", global.cacheRuleset);
+            ini.get_int_if_exist("cache_nodes", global.cacheNodes);
             ini.get_bool_if_exist("serve_cache_on_fetch_fail", global.serveCacheOnFetchFail);
+            ini.get_number_if_exist("cache_memory_size", global.cacheMemorySize);
         }
         else
         {
-            global.cacheSubscription = global.cacheConfig = global.cacheRuleset = 0; //disable cache
+            global.cacheSubscription = global.cacheConfig = global.cacheRuleset = global.cacheNodes = 0; //disable cache
             global.serveCacheOnFetchFail = false;
         }
     }
+    ini.get_number_if_exist("ruleset_cache_size", global.rulesetCacheSize);
     ini.get_bool_if_exist("script_clean_context", global.scriptCleanContext);
     ini.get_bool_if_exist("async_fetch_ruleset", global.asyncFetchRuleset);
     ini.get_bool_if_exist("skip_failed_links", global.skipFailedLinks);
@@ -60,7 +60,8 @@ struct Settings
 
     //cache system
     bool serveCacheOnFetchFail = false;
-    int cacheSubscription = 60, cacheConfig = 300, cacheRuleset = 21600;
+    int cacheSubscription = 60, cacheConfig = 300, cacheRuleset = 21600, cacheNodes = 30;
+    size_t cacheMemorySize = 16777216, rulesetCacheSize = 67108864;
 
     //limits
     size_t maxAllowedRulesets = 64, maxAllowedRules = 32768;
@@ -69,6 +70,9 @@ struct Settings
     //cron system
     bool enableCron = false;
     CronTaskConfigs cronTasks;
+
+    //warm start
+    std::string snapshotPath;
 };
 
 
@@ -100,6 +104,8 @@ extern Settings global;
 
 int importItems(string_array &target, bool scope_limit = true);
 int loadExternalConfig(std::string &path, ExternalConfig &ext);
+bool loadSnapshot(const std::string &path);
+void saveSnapshot(const std::string &path);
 
 template <class... Args>
 void parseGroupTimes(const std::string &src, Args... args)
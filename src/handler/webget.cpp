@@ -1,7 +1,11 @@
 #include <iostream>
 #include <unistd.h>
 #include <sys/stat.h>
-//#include <mutex>
+#include <mutex>
+#include <condition_variable>
+#include <list>
+#include <memory>
+#include <unordered_map>
 #include <thread>
 #include <atomic>
 
@@ -23,12 +27,89 @@
 #endif // _stat
 #endif // _WIN32
 
-/*
 using guarded_mutex = std::lock_guard<std::mutex>;
-std::mutex cache_rw_lock;
-*/
 
-RWLock cache_rw_lock;
+/// disk cache files are locked per key: every url hashes to one of these stripes instead of a single global lock
+static constexpr size_t CACHE_LOCK_STRIPES = 64;
+static RWLock cache_rw_locks[CACHE_LOCK_STRIPES];
+
+static RWLock &cache_lock_for(const std::string &url)
+{
+    return cache_rw_locks[std::hash<std::string>{}(url) % CACHE_LOCK_STRIPES];
+}
+
+/// in-memory LRU tier in front of the disk cache, bounded by global.cacheMemorySize bytes
+struct MemoryCacheEntry
+{
+    std::string url;
+    std::string content;
+    std::string headers;
+    time_t mtime = 0;
+};
+
+static std::mutex memory_cache_mutex;
+static std::list<MemoryCacheEntry> memory_cache_list; // most recently used first
+static std::unordered_map<std::string, std::list<MemoryCacheEntry>::iterator> memory_cache_index;
+static size_t memory_cache_bytes = 0;
+
+/// a fetch of a cached url in progress, concurrent requests for the same url wait for its result
+struct InflightFetch
+{
+    std::mutex mutex;
+    std::condition_variable done_cv;
+    bool done = false;
+    std::string content;
+    std::string headers;
+};
+
+static std::mutex inflight_mutex;
+static std::unordered_map<std::string, std::shared_ptr<InflightFetch>> inflight_fetches;
+
+static std::atomic_ullong cache_memory_hits {0}, cache_disk_hits {0}, cache_misses {0}, cache_coalesced {0};
+
+static size_t memory_cache_entry_size(const MemoryCacheEntry &entry)
+{
+    return entry.url.size() + entry.content.size() + entry.headers.size() + sizeof(MemoryCacheEntry);
+}
+
+static void memory_cache_erase(std::unordered_map<std::string, std::list<MemoryCacheEntry>::iterator>::iterator iter)
+{
+    memory_cache_bytes -= memory_cache_entry_size(*iter->second);
+    memory_cache_list.erase(iter->second);
+    memory_cache_index.erase(iter);
+}
+
+static bool memory_cache_get(const std::string &url, unsigned int cache_ttl, std::string &content, std::string *headers)
+{
+    guarded_mutex guard(memory_cache_mutex);
+    auto iter = memory_cache_index.find(url);
+    if(iter == memory_cache_index.end())
+        return false;
+    if(difftime(time(nullptr), iter->second->mtime) > cache_ttl)
+        return false; // kept for callers with a longer TTL, replaced by the next successful fetch
+    memory_cache_list.splice(memory_cache_list.begin(), memory_cache_list, iter->second);
+    content = iter->second->content;
+    if(headers)
+        *headers = iter->second->headers;
+    return true;
+}
+
+static void memory_cache_put(const std::string &url, const std::string &content, const std::string &headers, time_t mtime)
+{
+    MemoryCacheEntry entry {url, content, headers, mtime};
+    size_t size = memory_cache_entry_size(entry);
+    guarded_mutex guard(memory_cache_mutex);
+    auto iter = memory_cache_index.find(url);
+    if(iter != memory_cache_index.end())
+        memory_cache_erase(iter);
+    if(size > global.cacheMemorySize)
+        return;
+    memory_cache_list.emplace_front(std::move(entry));
+    memory_cache_index[url] = memory_cache_list.begin();
+    memory_cache_bytes += size;
+    while(memory_cache_bytes > global.cacheMemorySize)
+        memory_cache_erase(memory_cache_index.find(memory_cache_list.back().url));
+}
 
 //std::string user_agent_str = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.169 Safari/537.36";
 static auto user_agent_str = "subconverter/" VERSION " cURL/" LIBCURL_VERSION;
@@ -297,6 +378,65 @@ std::string buildSocks5ProxyString(const std::string &addr, int port, const std:
     return proxystr;
 }
 
+/// fetch through the disk cache, writing a successful fetch back to it; response headers are always captured so they can be shared
+static std::string cachedGet(const FetchArgument &argument, std::string &headers, time_t &mtime, bool &cacheable)
+{
+    int return_code = 0;
+    std::string content;
+    FetchResult fetch_res {&return_code, &content, &headers, nullptr};
+    const std::string &url = argument.url;
+    RWLock &cache_lock = cache_lock_for(url);
+
+    md("cache");
+    const std::string url_md5 = getMD5(url);
+    const std::string path = "cache/" + url_md5, path_header = path + "_header";
+    struct stat result {};
+    cacheable = false;
+    if(stat(path.data(), &result) == 0) // cache exist
+    {
+        time_t now = time(nullptr);
+        mtime = result.st_mtime; // get cache modified time and current time
+        if(difftime(now, mtime) <= argument.cache_ttl) // within TTL
+        {
+            writeLog(0, "CACHE HIT: '" + url + "', using local cache.");
+            cache_disk_hits++;
+            cache_lock.readLock();
+            defer(cache_lock.readUnlock();)
+            headers = fileGet(path_header, true);
+            cacheable = true;
+            return fileGet(path, true);
+        }
+        writeLog(0, "CACHE MISS: '" + url + "', TTL timeout, creating new cache."); // out of TTL
+    }
+    else
+        writeLog(0, "CACHE NOT EXIST: '" + url + "', creating new cache.");
+    cache_misses++;
+    curlGet(argument, fetch_res);
+    if(return_code == 200) // success, save new cache
+    {
+        cache_lock.writeLock();
+        defer(cache_lock.writeUnlock();)
+        fileWrite(path, content, true);
+        fileWrite(path_header, headers, true);
+        mtime = time(nullptr);
+        cacheable = true;
+    }
+    else
+    {
+        if(fileExist(path) && global.serveCacheOnFetchFail) // failed, check if cache exist
+        {
+            writeLog(0, "Fetch failed. Serving cached content."); // cache exist, serving cache
+            cache_lock.readLock();
+            defer(cache_lock.readUnlock();)
+            content = fileGet(path, true);
+            headers = fileGet(path_header, true);
+        }
+        else
+            writeLog(0, "Fetch failed. No local cache available."); // cache not exist or not allow to serve cache, serving nothing
+    }
+    return content;
+}
+
 std::string webGet(const std::string &url, const std::string &proxy, unsigned int cache_ttl, std::string *response_headers, string_icase_map *request_headers)
 {
     int return_code = 0;
@@ -310,53 +450,61 @@ std::string webGet(const std::string &url, const std::string &proxy, unsigned in
     // cache system
     if(cache_ttl > 0)
     {
-        md("cache");
-        const std::string url_md5 = getMD5(url);
-        const std::string path = "cache/" + url_md5, path_header = path + "_header";
-        struct stat result {};
-        if(stat(path.data(), &result) == 0) // cache exist
+        if(global.cacheMemorySize && memory_cache_get(url, cache_ttl, content, response_headers))
+        {
+            writeLog(0, "CACHE HIT: '" + url + "', using memory cache.");
+            cache_memory_hits++;
+            return content;
+        }
+
+        // only the first request for a url fetches it, the others wait for its result
+        std::shared_ptr<InflightFetch> fetch;
+        bool leader = false;
         {
-            time_t mtime = result.st_mtime, now = time(nullptr); // get cache modified time and current time
-            if(difftime(now, mtime) <= cache_ttl) // within TTL
+            guarded_mutex guard(inflight_mutex);
+            auto &slot = inflight_fetches[url];
+            if(!slot)
             {
-                writeLog(0, "CACHE HIT: '" + url + "', using local cache.");
-                //guarded_mutex guard(cache_rw_lock);
-                cache_rw_lock.readLock();
-                defer(cache_rw_lock.readUnlock();)
-                if(response_headers)
-                    *response_headers = fileGet(path_header, true);
-                return fileGet(path, true);
+                slot = std::make_shared<InflightFetch>();
+                leader = true;
             }
-            writeLog(0, "CACHE MISS: '" + url + "', TTL timeout, creating new cache."); // out of TTL
+            fetch = slot;
         }
-        else
-            writeLog(0, "CACHE NOT EXIST: '" + url + "', creating new cache.");
-        //content = curlGet(url, proxy, response_headers, return_code); // try to fetch data
-        curlGet(argument, fetch_res);
-        if(return_code == 200) // success, save new cache
+        if(!leader)
         {
-            //guarded_mutex guard(cache_rw_lock);
-            cache_rw_lock.writeLock();
-            defer(cache_rw_lock.writeUnlock();)
-            fileWrite(path, content, true);
+            writeLog(0, "CACHE WAIT: '" + url + "', joining the fetch in progress.");
+            cache_coalesced++;
+            std::unique_lock<std::mutex> lock(fetch->mutex);
+            fetch->done_cv.wait(lock, [&fetch]{ return fetch->done; });
             if(response_headers)
-                fileWrite(path_header, *response_headers, true);
+                *response_headers = fetch->headers;
+            return fetch->content;
         }
-        else
+
+        std::string headers;
+        time_t mtime = 0;
+        bool cacheable = false;
+        auto publish = [&]()
         {
-            if(fileExist(path) && global.serveCacheOnFetchFail) // failed, check if cache exist
             {
-                writeLog(0, "Fetch failed. Serving cached content."); // cache exist, serving cache
-                //guarded_mutex guard(cache_rw_lock);
-                cache_rw_lock.readLock();
-                defer(cache_rw_lock.readUnlock();)
-                content = fileGet(path, true);
-                if(response_headers)
-                    *response_headers = fileGet(path_header, true);
+                guarded_mutex guard(fetch->mutex);
+                if(fetch->done)
+                    return;
+                fetch->content = content;
+                fetch->headers = headers;
+                fetch->done = true;
             }
-            else
-                writeLog(0, "Fetch failed. No local cache available."); // cache not exist or not allow to serve cache, serving nothing
-        }
+            fetch->done_cv.notify_all();
+            guarded_mutex guard(inflight_mutex);
+            inflight_fetches.erase(url);
+        };
+        defer(publish();) // never leave the waiting requests behind, even if the fetch throws
+        content = cachedGet(argument, headers, mtime, cacheable);
+        if(cacheable && global.cacheMemorySize)
+            memory_cache_put(url, content, headers, mtime);
+        publish();
+        if(response_headers)
+            *response_headers = headers;
         return content;
     }
     //return curlGet(url, proxy, response_headers, return_code);
@@ -366,12 +514,45 @@ std::string webGet(const std::string &url, const std::string &proxy, unsigned in
 
 void flushCache()
 {
-    //guarded_mutex guard(cache_rw_lock);
-    cache_rw_lock.writeLock();
-    defer(cache_rw_lock.writeUnlock();)
+    {
+        guarded_mutex guard(memory_cache_mutex);
+        memory_cache_list.clear();
+        memory_cache_index.clear();
+        memory_cache_bytes = 0;
+    }
+    for(auto &lock : cache_rw_locks)
+        lock.writeLock();
+    defer(for(auto &lock : cache_rw_locks) lock.writeUnlock();)
     operateFiles("cache", [](const std::string &file){ remove(("cache/" + file).data()); return 0; });
 }
 
+bool getCacheTime(const std::string &url, time_t &mtime)
+{
+    {
+        guarded_mutex guard(memory_cache_mutex);
+        auto iter = memory_cache_index.find(url);
+        if(iter != memory_cache_index.end())
+        {
+            mtime = iter->second->mtime;
+            return true;
+        }
+    }
+    struct stat result {};
+    if(stat(("cache/" + getMD5(url)).data(), &result) != 0)
+        return false;
+    mtime = result.st_mtime;
+    return true;
+}
+
+CacheStatistics getCacheStatistics()
+{
+    CacheStatistics stats {cache_memory_hits.load(), cache_disk_hits.load(), cache_misses.load(), cache_coalesced.load(), 0, 0};
+    guarded_mutex guard(memory_cache_mutex);
+    stats.memory_entries = memory_cache_list.size();
+    stats.memory_bytes = memory_cache_bytes;
+    return stats;
+}
+
 int webPost(const std::string &url, const std::string &data, const std::string &proxy, const string_icase_map &request_headers, std::string *retData)
 {
     //return curlPost(url, data, proxy, request_headers, retData);
@@ -3,6 +3,7 @@
 
 #include <string>
 #include <map>
+#include <ctime>
 
 #include "utils/map_extra.h"
 #include "utils/string.h"
@@ -38,6 +39,21 @@ struct FetchResult
 int webGet(const FetchArgument& argument, FetchResult &result);
 std::string webGet(const std::string &url, const std::string &proxy = "", unsigned int cache_ttl = 0, std::string *response_headers = nullptr, string_icase_map *request_headers = nullptr);
 void flushCache();
+/// time the cached content of url was fetched, false if it is not cached
+bool getCacheTime(const std::string &url, time_t &mtime);
+
+struct CacheStatistics
+{
+    unsigned long long memory_hits = 0;
+    unsigned long long disk_hits = 0;
+    unsigned long long misses = 0;
+    unsigned long long coalesced = 0;
+    size_t memory_entries = 0;
+    size_t memory_bytes = 0;
+};
+
+CacheStatistics getCacheStatistics();
+
 int webPost(const std::string &url, const std::string &data, const std::string &proxy, const string_icase_map &request_headers, std::string *retData);
 int webPatch(const std::string &url, const std::string &data, const std::string &proxy, const string_icase_map &request_headers, std::string *retData);
 std::string buildSocks5ProxyString(const std::string &addr, int port, const std::string &username, const std::string &password);
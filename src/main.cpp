@@ -7,6 +7,7 @@
 #include <dirent.h>
 
 #include "config/ruleset.h"
+#include "generator/config/nodemanip.h"
 #include "handler/interfaces.h"
 #include "handler/webget.h"
 #include "handler/settings.h"
@@ -81,6 +82,11 @@ void chkArg(int argc, char *argv[])
             if(i < argc - 1)
                 global.generateProfiles.assign(argv[++i]);
         }
+        else if(strcmp(argv[i], "-s") == 0 || strcmp(argv[i], "--snapshot") == 0)
+        {
+            if(i < argc - 1)
+                global.snapshotPath.assign(argv[++i]);
+        }
         else if(strcmp(argv[i], "-l") == 0 || strcmp(argv[i], "--log") == 0)
         {
             if(i < argc - 1)
@@ -162,6 +168,10 @@ int main(int argc, char *argv[])
     signal(SIGINT, signal_handler);
 
     SetConsoleTitle("SubConverter " VERSION);
+    if(global.snapshotPath.empty())
+        global.snapshotPath = getEnv("WARM_START_SNAPSHOT");
+    if(!global.snapshotPath.empty())
+        loadSnapshot(global.snapshotPath);
     readConf();
     //vfs::vfs_read("vfs.ini");
     if(!global.updateRulesetOnRequest)
@@ -177,6 +187,9 @@ int main(int argc, char *argv[])
     if(global.generatorMode)
         return simpleGenerator();
 
+    if(!global.snapshotPath.empty())
+        saveSnapshot(global.snapshotPath);
+
     /*
     webServer.append_response("GET", "/", "text/plain", [](RESPONSE_CALLBACK_ARGS) -> std::string
     {
@@ -200,7 +213,10 @@ int main(int argc, char *argv[])
                 return "Forbidden\n";
             }
         }
+        flushRulesetCache();
         refreshRulesets(global.customRulesets, global.rulesetsContent);
+        if(!global.snapshotPath.empty())
+            saveSnapshot(global.snapshotPath);
         return "done\n";
     });
 
@@ -216,8 +232,12 @@ int main(int argc, char *argv[])
             }
         }
         readConf();
+        flushRulesetCache();
+        flushNodeCache();
         if(!global.updateRulesetOnRequest)
             refreshRulesets(global.customRulesets, global.rulesetsContent);
+        if(!global.snapshotPath.empty())
+            saveSnapshot(global.snapshotPath);
         return "done\n";
     });
 
@@ -244,8 +264,12 @@ int main(int argc, char *argv[])
         }
 
         readConf();
+        flushRulesetCache();
+        flushNodeCache();
         if(!global.updateRulesetOnRequest)
             refreshRulesets(global.customRulesets, global.rulesetsContent);
+        if(!global.snapshotPath.empty())
+            saveSnapshot(global.snapshotPath);
         return "done\n";
     });
 
@@ -257,13 +281,38 @@ int main(int argc, char *argv[])
             return "Forbidden";
         }
         flushCache();
+        flushNodeCache();
         return "done";
     });
 
+    webServer.append_response("GET", "/cachestats", "text/plain", [](RESPONSE_CALLBACK_ARGS) -> std::string
+    {
+        if(!global.accessToken.empty())
+        {
+            std::string token = getUrlArg(request.argument, "token");
+            if(token != global.accessToken)
+            {
+                response.status_code = 403;
+                return "Forbidden\n";
+            }
+        }
+        CacheStatistics stats = getCacheStatistics();
+        std::string result;
+        result += "memory_hits=" + std::to_string(stats.memory_hits) + "\n";
+        result += "disk_hits=" + std::to_string(stats.disk_hits) + "\n";
+        result += "misses=" + std::to_string(stats.misses) + "\n";
+        result += "coalesced=" + std::to_string(stats.coalesced) + "\n";
+        result += "memory_entries=" + std::to_string(stats.memory_entries) + "\n";
+        result += "memory_bytes=" + std::to_string(stats.memory_bytes) + "\n";
+        return result;
+    });
+
     webServer.append_response("GET", "/sub", "text/plain;charset=utf-8", subconverter);
 
     webServer.append_response("HEAD", "/sub", "text/plain", subconverter);
 
+    webServer.append_response("GET", "/subs", "application/json;charset=utf-8", subconverterMulti);
+
     webServer.append_response("GET", "/sub2clashr", "text/plain;charset=utf-8", simpleToClashR);
 
     webServer.append_response("GET", "/surge2clash", "text/plain;charset=utf-8", surgeConfToClash);
@@ -86,46 +86,36 @@ bool getSubInfoFromHeader(const std::string &header, std::string &result)
 bool getSubInfoFromNodes(const std::vector<Proxy> &nodes, const RegexMatchConfigs &stream_rules, const RegexMatchConfigs &time_rules, std::string &result)
 {
     std::string remarks, stream_info, time_info, retStr;
-
-    for(const Proxy &x : nodes)
+    string_array stream_patterns, time_patterns;
+    for(const RegexMatchConfig &y : stream_rules)
+        stream_patterns.emplace_back(y.Match);
+    for(const RegexMatchConfig &y : time_rules)
+        time_patterns.emplace_back(y.Match);
+    /// nodes without usage info are rejected by a single match against all rules
+    auto stream_matcher = getRegexMatcher(stream_patterns, true), time_matcher = getRegexMatcher(time_patterns, true);
+
+    /// first rule in order that matches the whole remark and changes it when applied
+    auto applyFirst = [&](const RegexMatchConfigs &rules, const RegexMatcher &matcher, std::string &info)
     {
-        remarks = x.Remark;
-        if(stream_info.empty())
+        for(int index = matcher.findFirst(remarks); index >= 0; index = matcher.findFirst(remarks, index + 1))
         {
-            for(const RegexMatchConfig &y : stream_rules)
+            retStr = regReplace(remarks, rules[index].Match, rules[index].Replace);
+            if(retStr != remarks)
             {
-                if(regMatch(remarks, y.Match))
-                {
-                    retStr = regReplace(remarks, y.Match, y.Replace);
-                    if(retStr != remarks)
-                    {
-                        stream_info = retStr;
-                        break;
-                    }
-                }
-                else
-                    continue;
+                info = retStr;
+                break;
             }
         }
+    };
 
+    for(const Proxy &x : nodes)
+    {
         remarks = x.Remark;
+        if(stream_info.empty())
+            applyFirst(stream_rules, *stream_matcher, stream_info);
+
         if(time_info.empty())
-        {
-            for(const RegexMatchConfig &y : time_rules)
-            {
-                if(regMatch(remarks, y.Match))
-                {
-                    retStr = regReplace(remarks, y.Match, y.Replace);
-                    if(retStr != remarks)
-                    {
-                        time_info = retStr;
-                        break;
-                    }
-                }
-                else
-                    continue;
-            }
-        }
+            applyFirst(time_rules, *time_matcher, time_info);
 
         if(!stream_info.empty() && !time_info.empty())
             break;
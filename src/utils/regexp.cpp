@@ -1,5 +1,7 @@
 #include <string>
 #include <cstdarg>
+#include <list>
+#include <mutex>
 
 /*
 #ifdef USE_STD_REGEX
@@ -223,3 +225,83 @@ std::string regTrim(const std::string &src)
 {
     return regReplace(src, R"(^\s*([\s\S]*)\s*$)", "$1", false, false);
 }
+
+struct RegexMatcher::Impl
+{
+    std::vector<jp::Regex> regexes;
+};
+
+RegexMatcher::RegexMatcher(const std::vector<std::string> &patterns, bool full_match) : impl(new Impl)
+{
+    impl->regexes.resize(patterns.size());
+    for(size_t i = 0; i < patterns.size(); i++)
+    {
+        jp::Regex &reg = impl->regexes[i];
+        if(full_match)
+            reg.setPattern(patterns[i]).addModifier("mS").addPcre2Option(PCRE2_ANCHORED|PCRE2_ENDANCHORED|PCRE2_UTF).compile();
+        else
+            reg.setPattern(patterns[i]).addModifier("mS").addPcre2Option(PCRE2_UTF|PCRE2_MULTILINE|PCRE2_ALT_BSUX).compile();
+    }
+}
+
+RegexMatcher::~RegexMatcher() = default;
+
+size_t RegexMatcher::size() const
+{
+    return impl->regexes.size();
+}
+
+bool RegexMatcher::match(size_t index, const std::string &src) const
+{
+    jp::Regex &reg = impl->regexes[index];
+    if(!reg)
+        return false;
+    return reg.match(src, "");
+}
+
+std::string RegexMatcher::replace(size_t index, const std::string &src, const std::string &rep) const
+{
+    jp::Regex &reg = impl->regexes[index];
+    if(!reg)
+        return src;
+    return reg.replace(src, rep, "gEx");
+}
+
+int RegexMatcher::findFirst(const std::string &src, size_t start) const
+{
+    for(size_t i = start; i < impl->regexes.size(); i++)
+    {
+        if(match(i, src))
+            return static_cast<int>(i);
+    }
+    return -1;
+}
+
+std::shared_ptr<const RegexMatcher> getRegexMatcher(const std::vector<std::string> &patterns, bool full_match)
+{
+    static const size_t max_entries = 32;
+    static std::mutex cache_mutex;
+    static std::list<std::pair<std::string, std::shared_ptr<const RegexMatcher>>> cache; // most recently used first
+
+    std::string key = full_match ? "F" : "P";
+    for(const std::string &x : patterns)
+        key += std::to_string(x.size()) + ":" + x;
+    {
+        std::lock_guard<std::mutex> guard(cache_mutex);
+        for(auto iter = cache.begin(); iter != cache.end(); ++iter)
+        {
+            if(iter->first == key)
+            {
+                cache.splice(cache.begin(), cache, iter);
+                return iter->second;
+            }
+        }
+    }
+
+    auto matcher = std::make_shared<const RegexMatcher>(patterns, full_match);
+    std::lock_guard<std::mutex> guard(cache_mutex);
+    cache.emplace_front(key, matcher);
+    if(cache.size() > max_entries)
+        cache.pop_back();
+    return matcher;
+}
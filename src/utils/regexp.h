@@ -2,6 +2,8 @@
 #define REGEXP_H_INCLUDED
 
 #include <string>
+#include <vector>
+#include <memory>
 
 bool regValid(const std::string &reg);
 bool regFind(const std::string &src, const std::string &match);
@@ -11,4 +13,28 @@ int regGetMatch(const std::string &src, const std::string &match, size_t group_c
 std::vector<std::string> regGetAllMatch(const std::string &src, const std::string &match, bool group_only = false);
 std::string regTrim(const std::string &src);
 
+/// a list of patterns compiled once, instead of on every regFind/regReplace call
+class RegexMatcher
+{
+public:
+    /// full_match compiles the patterns like regMatch, otherwise like regFind
+    RegexMatcher(const std::vector<std::string> &patterns, bool full_match = false);
+    ~RegexMatcher();
+
+    size_t size() const;
+    /// same result as regFind (or regMatch) with the pattern at index
+    bool match(size_t index, const std::string &src) const;
+    /// same result as regReplace with the pattern at index, only for matchers not created with full_match
+    std::string replace(size_t index, const std::string &src, const std::string &rep) const;
+    /// index of the first pattern from start on that matches src, -1 if there is none
+    int findFirst(const std::string &src, size_t start = 0) const;
+
+private:
+    struct Impl;
+    std::unique_ptr<Impl> impl;
+};
+
+/// compiled matcher for a pattern list, shared by all callers passing the same list
+std::shared_ptr<const RegexMatcher> getRegexMatcher(const std::vector<std::string> &patterns, bool full_match = false);
+
 #endif // REGEXP_H_INCLUDED